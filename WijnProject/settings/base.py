@@ -40,6 +40,7 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "WijnVoorraad.projectie.ProjectieMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -68,6 +69,10 @@ WSGI_APPLICATION = "WijnProject.wsgi.application"
 DB_PASSWORD = config("DB_PASSWORD")
 OPENAI_API_KEY = config("OPENAI_API_KEY")
 
+# Update the stock from the mutations with the projector (projectie_verwerken) instead
+# of in the request, see WijnVoorraad/projectie.py
+VOORRAAD_PROJECTIE_ASYNC = config("VOORRAAD_PROJECTIE_ASYNC", default=False, cast=bool)
+
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
@@ -4,6 +4,7 @@ from django.template.loader import render_to_string
 
 # import django.forms as forms
 from django.contrib.auth.models import User
+from django.db.models import Case, When
 from django_select2 import forms as s2forms
 
 from .models import (
@@ -20,7 +21,7 @@ from .models import (
     BestellingRegel,
 )
 
-from . import wijnvars
+from . import wijnvars, zoekindex
 
 
 class SelectWithPop(forms.Select):
@@ -47,6 +48,25 @@ class WijnWidget(s2forms.ModelSelect2Widget):
         "domein__icontains",
     ]
 
+    def filter_queryset(self, request, term, queryset=None, **dependent_fields):
+        """Ranked lookup via the autocomplete index, best match first.
+
+        Falls back to the search_fields of select2 when the index can not be used.
+        """
+        wijn_ids = zoekindex.zoek_wijnen(term) if term else None
+        if wijn_ids is None:
+            return super().filter_queryset(
+                request, term, queryset, **dependent_fields
+            )
+        if queryset is None:
+            queryset = self.get_queryset()
+        if dependent_fields:
+            queryset = queryset.filter(**dependent_fields)
+        if not wijn_ids:
+            return queryset.none()
+        volgorde = Case(*(When(pk=pk, then=i) for i, pk in enumerate(wijn_ids)))
+        return queryset.filter(pk__in=wijn_ids).order_by(volgorde)
+
 
 class WijnWidgetWithPop(WijnWidget):
 
@@ -99,6 +119,53 @@ class VoorraadFilterForm(forms.Form):
             del self.fields["sortering"]
 
 
+class AllesVerplaatsenForm(forms.Form):
+    van_locatie = forms.ModelChoiceField(Locatie.objects, empty_label="----------")
+    van_vak = forms.ModelChoiceField(
+        Vak.objects.select_related("locatie"),
+        empty_label="Alle vakken",
+        required=False,
+    )
+    deelnemer = forms.ModelChoiceField(
+        Deelnemer.objects, empty_label="Alle deelnemers", required=False
+    )
+    wijnsoort = forms.ModelChoiceField(
+        WijnSoort.objects, empty_label="Alle wijnsoorten", required=False
+    )
+    naar_locatie = forms.ModelChoiceField(Locatie.objects, empty_label="----------")
+    naar_vak = forms.ModelChoiceField(
+        Vak.objects.select_related("locatie"), empty_label="Geen vak", required=False
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        for locatie_veld, vak_veld in (
+            ("van_locatie", "van_vak"),
+            ("naar_locatie", "naar_vak"),
+        ):
+            locatie = cleaned_data.get(locatie_veld)
+            vak = cleaned_data.get(vak_veld)
+            if locatie is not None and vak is not None and vak.locatie_id != locatie.id:
+                self.add_error(vak_veld, "Dit vak hoort niet bij de gekozen locatie")
+        if (
+            cleaned_data.get("van_locatie") == cleaned_data.get("naar_locatie")
+            and cleaned_data.get("van_vak") is not None
+            and cleaned_data.get("van_vak") == cleaned_data.get("naar_vak")
+        ):
+            raise forms.ValidationError("Het vak en het nieuwe vak zijn hetzelfde")
+        return cleaned_data
+
+
+class VoorraadOpDatumForm(forms.Form):
+    datum = forms.DateField()
+    locatie = forms.ModelChoiceField(
+        Locatie.objects, empty_label="Alle locaties", required=False
+    )
+    deelnemer = forms.ModelChoiceField(
+        Deelnemer.objects, empty_label="Alle deelnemers", required=False
+    )
+
+
 class OntvangstCreateForm(forms.ModelForm):
     deelnemer = forms.ModelChoiceField(Deelnemer.objects, widget=SelectWithPop)
     wijn = forms.ModelChoiceField(
@@ -0,0 +1,20 @@
+"""Recompute the totals stored on Bestelling from the regels.
+
+The totals are kept up to date by BestellingRegel.save and delete; this command
+repairs them after changes that bypass those, such as bulk updates or edits in the
+database itself.
+"""
+
+from django.core.management.base import BaseCommand
+
+from WijnVoorraad.models import Bestelling
+
+
+class Command(BaseCommand):
+    help = "Recompute the totals stored on all bestellingen from their regels"
+
+    def handle(self, *args, **options):
+        aantal = Bestelling.objects.totalen_herberekenen()
+        self.stdout.write(
+            self.style.SUCCESS(f"Totalen van {aantal} bestellingen gecorrigeerd")
+        )
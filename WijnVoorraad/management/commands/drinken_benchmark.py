@@ -0,0 +1,145 @@
+"""Measure concurrent drinking from one shared stock entry.
+
+Several threads drink bottles from the same WijnVoorraad until it is empty. The
+command reports the successful drinks per second and checks that no more bottles
+were drunk than there were in stock. The benchmark data is removed afterwards.
+Run it on a development copy of the database, not on the production database.
+"""
+
+import threading
+import time
+from datetime import date
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+
+from WijnVoorraad import zoekindex
+from WijnVoorraad.models import (
+    Deelnemer,
+    Locatie,
+    Ontvangst,
+    VoorraadMutatie,
+    Wijn,
+    WijnSoort,
+    WijnVoorraad,
+)
+
+BENCHMARK_NAAM = "Drinken benchmark"
+
+
+class Command(BaseCommand):
+    help = "Measure the successful drink operations per second on one shared stock entry"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--flessen", type=int, default=200)
+
+    def handle(self, *args, **options):
+        if options["threads"] < 1 or options["flessen"] < 1:
+            raise CommandError("--threads and --flessen must be at least 1")
+        gegevens = self.aanmaken(options["flessen"])
+        try:
+            resultaat = self.meten(gegevens, options["threads"])
+        finally:
+            self.opruimen(gegevens)
+
+        self.stdout.write(
+            f"{resultaat['gedronken']} van {options['flessen']} flessen gedronken "
+            f"door {options['threads']} threads in {resultaat['seconden']:.2f} s: "
+            f"{resultaat['gedronken'] / resultaat['seconden']:.1f} per seconde"
+        )
+        self.stdout.write(
+            f"Geweigerd (geen voorraad): {resultaat['geweigerd']}, "
+            f"opnieuw geprobeerd (database bezet): {resultaat['bezet']}"
+        )
+        if resultaat["gedronken"] != options["flessen"] or resultaat["rest"] != 0:
+            raise CommandError(
+                f"Onjuiste voorraad: {resultaat['gedronken']} gedronken, "
+                f"rest {resultaat['rest']}"
+            )
+        self.stdout.write(self.style.SUCCESS("Voorraad klopt"))
+
+    def aanmaken(self, flessen):
+        wijnsoort, wijnsoort_aangemaakt = WijnSoort.objects.get_or_create(
+            omschrijving=BENCHMARK_NAAM
+        )
+        locatie = Locatie.objects.create(omschrijving=BENCHMARK_NAAM, aantal_kolommen=1)
+        deelnemer = Deelnemer.objects.create(naam=BENCHMARK_NAAM, standaardLocatie=locatie)
+        wijn = Wijn.objects.create(
+            domein=BENCHMARK_NAAM, naam=BENCHMARK_NAAM, wijnsoort=wijnsoort
+        )
+        ontvangst = Ontvangst.objects.create(
+            deelnemer=deelnemer, wijn=wijn, datumOntvangst=date.today()
+        )
+        VoorraadMutatie(
+            ontvangst=ontvangst,
+            locatie=locatie,
+            in_uit=VoorraadMutatie.IN,
+            actie=VoorraadMutatie.KOOP,
+            datum=date.today(),
+            aantal=flessen,
+            omschrijving=BENCHMARK_NAAM,
+        ).save()
+        return {
+            "wijnsoort": wijnsoort if wijnsoort_aangemaakt else None,
+            "locatie": locatie,
+            "deelnemer": deelnemer,
+            "wijn": wijn,
+            "ontvangst": ontvangst,
+        }
+
+    def meten(self, gegevens, aantal_threads):
+        tellers = {"gedronken": 0, "geweigerd": 0, "bezet": 0}
+        slot = threading.Lock()
+        start = threading.Barrier(aantal_threads + 1)
+
+        def tellen(teller):
+            with slot:
+                tellers[teller] += 1
+
+        def drinken():
+            start.wait()
+            try:
+                while True:
+                    try:
+                        VoorraadMutatie.drinken(gegevens["ontvangst"], gegevens["locatie"])
+                    except ValidationError:
+                        tellen("geweigerd")
+                        return
+                    except OperationalError:
+                        # SQLite: another thread holds the write lock longer than the timeout
+                        tellen("bezet")
+                        continue
+                    tellen("gedronken")
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=drinken) for _ in range(aantal_threads)]
+        for thread in threads:
+            thread.start()
+        start.wait()
+        begin = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        tellers["seconden"] = time.perf_counter() - begin
+        tellers["rest"] = sum(
+            WijnVoorraad.objects.filter(ontvangst=gegevens["ontvangst"]).values_list(
+                "aantal", flat=True
+            )
+        )
+        return tellers
+
+    def opruimen(self, gegevens):
+        mutaties = VoorraadMutatie.objects.filter(ontvangst=gegevens["ontvangst"])
+        for mutatie_id in mutaties.values_list("id", flat=True):
+            zoekindex.mutatie_verwijderen(mutatie_id)
+        # QuerySet.delete() does not call VoorraadMutatie.delete(), the stock is removed below
+        mutaties.delete()
+        WijnVoorraad.objects.filter(ontvangst=gegevens["ontvangst"]).delete()
+        gegevens["ontvangst"].delete()
+        gegevens["wijn"].delete()
+        gegevens["deelnemer"].delete()
+        gegevens["locatie"].delete()
+        if gegevens["wijnsoort"] is not None:
+            gegevens["wijnsoort"].delete()
@@ -0,0 +1,33 @@
+"""Write the monthly snapshot of the stock, used to calculate the stock at a date.
+
+Without --datum the snapshot is of the last day of the previous month, so the command
+can be scheduled monthly (for example with cron on the first day of the month).
+"""
+
+from datetime import date, timedelta
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from WijnVoorraad.services import WijnVoorraadService
+
+
+class Command(BaseCommand):
+    help = "Write the VoorraadMomentopname of a day (default: end of the previous month)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--datum",
+            type=date.fromisoformat,
+            help="Day of the snapshot (YYYY-MM-DD), must be before today",
+        )
+
+    def handle(self, *args, **options):
+        datum = options["datum"] or date.today().replace(day=1) - timedelta(days=1)
+        try:
+            aantal = WijnVoorraadService.MomentopnameVastleggen(datum)
+        except ValidationError as e:
+            raise CommandError(e.message) from e
+        self.stdout.write(
+            self.style.SUCCESS(f"Momentopname van {datum}: {aantal} rijen vastgelegd")
+        )
@@ -0,0 +1,43 @@
+"""Move the mutations of wines that were closed long ago to the archive.
+
+All mutations of the ontvangsten of wines closed more than --maanden months ago are
+moved to VoorraadMutatieArchief; their totals are kept per ontvangst in
+OntvangstArchief. See WijnVoorraadService.MutatiesArchiveren.
+"""
+
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from WijnVoorraad.services import WijnVoorraadService
+
+
+def maanden_terug(datum, maanden):
+    """datum minus maanden months, on the last day of the month when it is shorter."""
+    maand = datum.year * 12 + datum.month - 1 - maanden
+    jaar, maand = divmod(maand, 12)
+    for dag in range(datum.day, 0, -1):
+        try:
+            return date(jaar, maand + 1, dag)
+        except ValueError:
+            continue
+    raise ValueError(datum)
+
+
+class Command(BaseCommand):
+    help = "Archive the mutations of wines closed more than --maanden months ago"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--maanden", type=int, default=24)
+
+    def handle(self, *args, **options):
+        if options["maanden"] < 1:
+            raise CommandError("--maanden must be at least 1")
+        grens = maanden_terug(date.today(), options["maanden"])
+        aantallen = WijnVoorraadService.MutatiesArchiveren(grens)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{aantallen['mutaties']} mutaties van {aantallen['ontvangsten']} "
+                f"ontvangsten gearchiveerd (wijnen afgesloten voor {grens})"
+            )
+        )
@@ -0,0 +1,21 @@
+"""Rebuild the stock from zero for the asynchronous projection.
+
+WijnVoorraad is recalculated from all mutations and the open bestellingregels, and the
+checkpoint is set to the last mutation. Run it before VOORRAAD_PROJECTIE_ASYNC is
+switched on, or to repair the stock.
+"""
+
+from django.core.management.base import BaseCommand
+
+from WijnVoorraad import projectie
+
+
+class Command(BaseCommand):
+    help = "Rebuild WijnVoorraad from all mutations and set the projection checkpoint"
+
+    def handle(self, *args, **options):
+        aantal = projectie.opbouwen()
+        self.stdout.write(
+            f"{aantal} voorraadregels, checkpoint {projectie.checkpoint()}"
+        )
+        self.stdout.write(self.style.SUCCESS("Projectie opgebouwd"))
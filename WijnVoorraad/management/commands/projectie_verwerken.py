@@ -0,0 +1,42 @@
+"""The projector of the asynchronous stock projection (see WijnVoorraad/projectie.py).
+
+Applies the mutations after the checkpoint on the stock, in batches. With --continu it
+keeps running and checks for new mutations every --interval seconds.
+"""
+
+import time
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from WijnVoorraad import projectie
+
+
+class Command(BaseCommand):
+    help = "Apply the mutations that are not projected yet on the stock"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch", type=int, default=projectie.BATCH_GROOTTE)
+        parser.add_argument("--continu", action="store_true")
+        parser.add_argument("--interval", type=float, default=5.0)
+
+    def handle(self, *args, **options):
+        if options["batch"] < 1:
+            raise CommandError("--batch must be at least 1")
+        try:
+            while True:
+                totaal = 0
+                while aantal := projectie.verwerken(options["batch"]):
+                    totaal += aantal
+                if totaal:
+                    self.stdout.write(
+                        f"{totaal} mutaties verwerkt, checkpoint {projectie.checkpoint()}"
+                    )
+                if not options["continu"]:
+                    break
+                time.sleep(options["interval"])
+        except ValidationError as e:
+            raise CommandError(
+                f"{e.message}, voer eerst projectie_opbouwen uit"
+            ) from e
+        self.stdout.write(self.style.SUCCESS("Projectie bijgewerkt"))
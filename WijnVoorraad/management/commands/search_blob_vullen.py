@@ -0,0 +1,59 @@
+"""Recalculate the search_blob columns of Wijn and Ontvangst in chunks."""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from WijnVoorraad import zoekindex
+from WijnVoorraad.models import Ontvangst, Wijn
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalculate search_blob of all wijnen and ontvangsten in chunks "
+        "and rebuild the search index afterwards"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk",
+            type=int,
+            default=500,
+            help="Number of rows per chunk (default 500)",
+        )
+
+    def handle(self, *args, **options):
+        chunk = options["chunk"]
+        bronnen = (
+            (
+                Wijn.objects.select_related("wijnsoort").prefetch_related(
+                    "wijnDruivensoorten"
+                ),
+                zoekindex.wijn_tekst,
+            ),
+            (Ontvangst.objects.all(), zoekindex.ontvangst_tekst),
+        )
+        for queryset, tekst in bronnen:
+            aantal = 0
+            laatste_id = 0
+            while True:
+                rijen = list(queryset.filter(pk__gt=laatste_id).order_by("pk")[:chunk])
+                if not rijen:
+                    break
+                gewijzigd = []
+                for obj in rijen:
+                    search_blob = tekst(obj)
+                    if search_blob != obj.search_blob:
+                        obj.search_blob = search_blob
+                        gewijzigd.append(obj)
+                with transaction.atomic():
+                    queryset.model.objects.bulk_update(gewijzigd, ["search_blob"])
+                aantal += len(gewijzigd)
+                laatste_id = rijen[-1].pk
+            self.stdout.write(
+                f"{queryset.model._meta.verbose_name_plural}: {aantal} bijgewerkt"
+            )
+
+        if zoekindex.index_beschikbaar():
+            zoekindex.opbouwen()
+            self.stdout.write("Zoekindex opgebouwd")
+        self.stdout.write(self.style.SUCCESS("search_blob gevuld"))
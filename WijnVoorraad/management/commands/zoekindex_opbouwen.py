@@ -0,0 +1,17 @@
+"""Rebuild the full-text search index used by the fuzzy selection."""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from WijnVoorraad import zoekindex
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index (SQLite FTS5) for wijnen, ontvangsten and mutaties"
+
+    def handle(self, *args, **options):
+        if not zoekindex.index_beschikbaar():
+            raise CommandError("The search index is only available on SQLite")
+        aantallen = zoekindex.opbouwen()
+        for tabel, aantal in aantallen.items():
+            self.stdout.write(f"{tabel}: {aantal} rijen")
+        self.stdout.write(self.style.SUCCESS("Zoekindex opgebouwd"))
@@ -0,0 +1,73 @@
+"""Create the FTS5 search index tables (SQLite only) and fill them with the current data."""
+
+from django.db import migrations
+
+TABELLEN = (
+    "WijnVoorraad_zoekindex_wijn",
+    "WijnVoorraad_zoekindex_ontvangst",
+    "WijnVoorraad_zoekindex_mutatie",
+)
+
+
+def _tekst(*delen):
+    return "\n".join(str(deel) for deel in delen if deel not in (None, ""))
+
+
+def zoekindex_aanmaken(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    Wijn = apps.get_model("WijnVoorraad", "Wijn")
+    Ontvangst = apps.get_model("WijnVoorraad", "Ontvangst")
+    VoorraadMutatie = apps.get_model("WijnVoorraad", "VoorraadMutatie")
+
+    wijnen = [
+        (
+            w.pk,
+            _tekst(
+                w.naam,
+                w.domein,
+                w.jaar,
+                w.land,
+                w.streek,
+                w.classificatie,
+                w.opmerking,
+                w.wijnsoort.omschrijving,
+                *(d.omschrijving for d in w.wijnDruivensoorten.all()),
+            ),
+        )
+        for w in Wijn.objects.select_related("wijnsoort").prefetch_related(
+            "wijnDruivensoorten"
+        )
+    ]
+    ontvangsten = [
+        (o.pk, _tekst(o.leverancier, o.opmerking)) for o in Ontvangst.objects.all()
+    ]
+    mutaties = [(m.pk, _tekst(m.omschrijving)) for m in VoorraadMutatie.objects.all()]
+
+    with schema_editor.connection.cursor() as cursor:
+        for tabel, rijen in zip(TABELLEN, (wijnen, ontvangsten, mutaties)):
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE "{tabel}" USING fts5(tekst, tokenize=\'trigram\')'
+            )
+            cursor.executemany(
+                f'INSERT INTO "{tabel}" (rowid, tekst) VALUES (%s, %s)', rijen
+            )
+
+
+def zoekindex_verwijderen(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for tabel in TABELLEN:
+            cursor.execute(f'DROP TABLE IF EXISTS "{tabel}"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("WijnVoorraad", "0077_alter_bestellingregel_opmerking"),
+    ]
+
+    operations = [
+        migrations.RunPython(zoekindex_aanmaken, zoekindex_verwijderen),
+    ]
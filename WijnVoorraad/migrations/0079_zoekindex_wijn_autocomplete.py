@@ -0,0 +1,63 @@
+"""Create the FTS5 table for the ranked wine autocomplete (SQLite only) and fill it."""
+
+import unicodedata
+
+from django.db import migrations
+
+TABEL = "WijnVoorraad_zoekindex_wijn_autocomplete"
+
+
+def _normaliseer(tekst):
+    tekst = unicodedata.normalize("NFKD", str(tekst or ""))
+    return "".join(c for c in tekst if not unicodedata.combining(c)).lower()
+
+
+def _overig(wijn):
+    return "\n".join(
+        deel for deel in (wijn.land, wijn.streek, wijn.classificatie) if deel
+    )
+
+
+def autocomplete_aanmaken(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    Wijn = apps.get_model("WijnVoorraad", "Wijn")
+    rijen = [
+        (
+            w.pk,
+            _normaliseer(w.naam),
+            _normaliseer(w.domein),
+            _normaliseer(w.jaar),
+            _normaliseer(w.wijnsoort.omschrijving),
+            _normaliseer(_overig(w)),
+        )
+        for w in Wijn.objects.select_related("wijnsoort")
+    ]
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE VIRTUAL TABLE "{TABEL}" USING '
+            "fts5(naam, domein, jaar, wijnsoort, overig, tokenize='trigram')"
+        )
+        cursor.executemany(
+            f'INSERT INTO "{TABEL}" (rowid, naam, domein, jaar, wijnsoort, overig) '
+            "VALUES (%s, %s, %s, %s, %s, %s)",
+            rijen,
+        )
+
+
+def autocomplete_verwijderen(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS "{TABEL}"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("WijnVoorraad", "0078_zoekindex"),
+    ]
+
+    operations = [
+        migrations.RunPython(autocomplete_aanmaken, autocomplete_verwijderen),
+    ]
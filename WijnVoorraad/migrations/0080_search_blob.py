@@ -0,0 +1,78 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:36
+
+import unicodedata
+
+from django.db import migrations, models
+
+
+def _normaliseer(*delen):
+    tekst = "\n".join(str(deel) for deel in delen if deel not in (None, ""))
+    tekst = unicodedata.normalize("NFKD", tekst)
+    return "".join(c for c in tekst if not unicodedata.combining(c)).lower()
+
+
+def search_blob_vullen(apps, schema_editor):
+    """Fill search_blob and rebuild the search index with the normalised text."""
+    Wijn = apps.get_model("WijnVoorraad", "Wijn")
+    Ontvangst = apps.get_model("WijnVoorraad", "Ontvangst")
+    VoorraadMutatie = apps.get_model("WijnVoorraad", "VoorraadMutatie")
+
+    wijnen = list(
+        Wijn.objects.select_related("wijnsoort").prefetch_related("wijnDruivensoorten")
+    )
+    for w in wijnen:
+        w.search_blob = _normaliseer(
+            w.naam,
+            w.domein,
+            w.jaar,
+            w.land,
+            w.streek,
+            w.classificatie,
+            w.opmerking,
+            w.wijnsoort.omschrijving,
+            *(d.omschrijving for d in w.wijnDruivensoorten.all()),
+        )
+    Wijn.objects.bulk_update(wijnen, ["search_blob"], batch_size=500)
+
+    ontvangsten = list(Ontvangst.objects.all())
+    for o in ontvangsten:
+        o.search_blob = _normaliseer(o.leverancier, o.opmerking)
+    Ontvangst.objects.bulk_update(ontvangsten, ["search_blob"], batch_size=500)
+
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    tabellen = (
+        ("WijnVoorraad_zoekindex_wijn", [(w.pk, w.search_blob) for w in wijnen]),
+        ("WijnVoorraad_zoekindex_ontvangst", [(o.pk, o.search_blob) for o in ontvangsten]),
+        (
+            "WijnVoorraad_zoekindex_mutatie",
+            [(m.pk, _normaliseer(m.omschrijving)) for m in VoorraadMutatie.objects.all()],
+        ),
+    )
+    with schema_editor.connection.cursor() as cursor:
+        for tabel, rijen in tabellen:
+            cursor.execute(f'DELETE FROM "{tabel}"')
+            cursor.executemany(
+                f'INSERT INTO "{tabel}" (rowid, tekst) VALUES (%s, %s)', rijen
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('WijnVoorraad', '0079_zoekindex_wijn_autocomplete'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ontvangst',
+            name='search_blob',
+            field=models.TextField(blank=True, db_index=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='wijn',
+            name='search_blob',
+            field=models.TextField(blank=True, db_index=True, default='', editable=False),
+        ),
+        migrations.RunPython(search_blob_vullen, migrations.RunPython.noop),
+    ]
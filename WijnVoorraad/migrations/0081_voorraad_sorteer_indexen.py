@@ -0,0 +1,24 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:41
+
+import WijnVoorraad.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('WijnVoorraad', '0080_search_blob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ontvangst',
+            name='prijs',
+            field=models.DecimalField(blank=True, db_index=True, decimal_places=2, max_digits=5, null=True),
+        ),
+        migrations.AlterField(
+            model_name='wijn',
+            name='jaar',
+            field=models.PositiveSmallIntegerField(blank=True, db_index=True, null=True, validators=[WijnVoorraad.models.Wijn.validate_jaartal]),
+        ),
+    ]
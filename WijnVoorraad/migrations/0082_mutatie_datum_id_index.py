@@ -0,0 +1,21 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('WijnVoorraad', '0081_voorraad_sorteer_indexen'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='voorraadmutatie',
+            index=models.Index(fields=['datum', 'id'], name='mutatie_datum_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voorraadmutatie',
+            index=models.Index(fields=['in_uit', 'datum', 'id'], name='mutatie_inuit_datum_id_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('WijnVoorraad', '0082_mutatie_datum_id_index'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='wijnvoorraad',
+            constraint=models.UniqueConstraint(condition=models.Q(('vak__isnull', True)), fields=('ontvangst', 'locatie'), name='unique_wijnvoorraad_zonder_vak'),
+        ),
+    ]
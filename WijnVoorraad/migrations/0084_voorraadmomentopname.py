@@ -0,0 +1,30 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('WijnVoorraad', '0083_wijnvoorraad_zonder_vak_uniek'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoorraadMomentopname',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('datum', models.DateField()),
+                ('aantal', models.IntegerField()),
+                ('locatie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='WijnVoorraad.locatie')),
+                ('ontvangst', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='WijnVoorraad.ontvangst')),
+                ('vak', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='WijnVoorraad.vak')),
+            ],
+            options={
+                'verbose_name_plural': 'voorraadmomentopnamen',
+                'ordering': ['datum', 'ontvangst', 'locatie', 'vak'],
+                'indexes': [models.Index(fields=['datum'], name='momentopname_datum_idx')],
+            },
+        ),
+    ]
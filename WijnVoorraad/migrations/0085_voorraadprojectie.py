@@ -0,0 +1,24 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('WijnVoorraad', '0084_voorraadmomentopname'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoorraadProjectie',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('laatste_mutatie_id', models.BigIntegerField(default=0)),
+                ('bijgewerkt', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'voorraadprojecties',
+            },
+        ),
+    ]
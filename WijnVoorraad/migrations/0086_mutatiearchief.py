@@ -0,0 +1,48 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('WijnVoorraad', '0085_voorraadprojectie'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OntvangstArchief',
+            fields=[
+                ('ontvangst', models.OneToOneField(on_delete=django.db.models.deletion.PROTECT, primary_key=True, serialize=False, to='WijnVoorraad.ontvangst')),
+                ('aantal_records_in', models.IntegerField(default=0)),
+                ('aantal_in', models.IntegerField(default=0)),
+                ('aantal_records_uit', models.IntegerField(default=0)),
+                ('aantal_uit', models.IntegerField(default=0)),
+                ('bijgewerkt', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'ontvangstarchieven',
+            },
+        ),
+        migrations.CreateModel(
+            name='VoorraadMutatieArchief',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('in_uit', models.CharField(choices=[('I', 'In'), ('U', 'Uit')], max_length=1)),
+                ('actie', models.CharField(choices=[('K', 'Koop'), ('O', 'Ontvangst'), ('V', 'Verplaatsing'), ('D', 'Drink'), ('A', 'Afboeking')], max_length=1)),
+                ('datum', models.DateField()),
+                ('aantal', models.IntegerField()),
+                ('omschrijving', models.CharField(blank=True, max_length=200)),
+                ('locatie', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='WijnVoorraad.locatie')),
+                ('ontvangst', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='WijnVoorraad.ontvangst')),
+                ('vak', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='WijnVoorraad.vak')),
+            ],
+            options={
+                'verbose_name': 'gearchiveerde voorraadmutatie',
+                'verbose_name_plural': 'gearchiveerde voorraadmutaties',
+                'ordering': ['ontvangst', 'datum', 'in_uit'],
+                'indexes': [models.Index(fields=['datum', 'id'], name='archief_datum_id_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:22
+
+from django.db import migrations, models
+from django.db.models import Q, Sum
+from django.db.models.functions import Coalesce
+
+
+def totalen_vullen(apps, schema_editor):
+    """Fill the totals of the existing bestellingen from their regels."""
+    Bestelling = apps.get_model("WijnVoorraad", "Bestelling")
+    BestellingRegel = apps.get_model("WijnVoorraad", "BestellingRegel")
+
+    aantal = Coalesce("aantal_correctie", "aantal")
+    totalen = {
+        rij["bestelling_id"]: rij
+        for rij in BestellingRegel.objects.order_by()
+        .values("bestelling_id")
+        .annotate(
+            tot_aantal=Sum(aantal, default=0),
+            aantal_verzameld=Sum(
+                aantal, filter=Q(verwerkt="N", isVerzameld=True), default=0
+            ),
+            aantal_verwerkt=Sum(aantal, filter=Q(verwerkt__in=["A", "V"]), default=0),
+        )
+    }
+    bestellingen = list(Bestelling.objects.filter(pk__in=totalen))
+    for b in bestellingen:
+        b.tot_aantal = totalen[b.pk]["tot_aantal"]
+        b.aantal_verzameld = totalen[b.pk]["aantal_verzameld"]
+        b.aantal_verwerkt = totalen[b.pk]["aantal_verwerkt"]
+    Bestelling.objects.bulk_update(
+        bestellingen,
+        ["tot_aantal", "aantal_verzameld", "aantal_verwerkt"],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('WijnVoorraad', '0086_mutatiearchief'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bestelling',
+            name='aantal_verwerkt',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='bestelling',
+            name='aantal_verzameld',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='bestelling',
+            name='tot_aantal',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(totalen_vullen, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:29
+
+import django.db.models.expressions
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('WijnVoorraad', '0087_bestelling_totalen'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wijnvoorraad',
+            name='aantal_beschikbaar',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.expressions.CombinedExpression(models.F('aantal'), '-', models.F('aantal_rsv')), output_field=models.IntegerField()),
+        ),
+        migrations.AddIndex(
+            model_name='wijnvoorraad',
+            index=models.Index(fields=['deelnemer', 'locatie', 'aantal_beschikbaar'], name='voorraad_beschikbaar_idx'),
+        ),
+    ]
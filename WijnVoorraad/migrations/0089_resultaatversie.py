@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('WijnVoorraad', '0088_wijnvoorraad_beschikbaar'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResultaatVersie',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('versie', models.BigIntegerField(default=1)),
+            ],
+            options={
+                'verbose_name_plural': 'resultaatversies',
+            },
+        ),
+    ]
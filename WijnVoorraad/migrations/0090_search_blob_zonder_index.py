@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('WijnVoorraad', '0089_resultaatversie'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ontvangst',
+            name='search_blob',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AlterField(
+            model_name='wijn',
+            name='search_blob',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+    ]
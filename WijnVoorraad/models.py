@@ -4,20 +4,133 @@ inventory and mutations. Implements inventory and reservation logic (VoorraadMut
 validation rules and unique constraints. Includes auxiliary models (Deelnemer, Bestelling, AIUsage)
 and helper methods for copying, searching and auditing.
 """
+import threading
+from contextlib import contextmanager
 from datetime import date, datetime
+from typing import NamedTuple
 
 from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db import models
-from django.db.models import Deferrable, F, Sum
-from django.db.models.functions import Lower
-from django.db.models.query import QuerySet
+from django.db import connection, models, transaction
+from django.db.models import (
+    Case,
+    Deferrable,
+    Exists,
+    F,
+    OuterRef,
+    Q,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce, Lower
+from django.db.models.query import QuerySet, prefetch_related_objects
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
 from django_group_by import GroupByMixin
 
+from . import projectie, resultaatcache, zoekindex
+
+# wines to check with Wijn.afsluiten_na_commit, per thread (and so per connection)
+_na_commit = threading.local()
 
 # Create your models here.
 
 
+class OrigineleStaatMixin:
+    """Remembers the field values as they were loaded from (or last saved to) the
+    database, so clean(), save() and delete() can compare with the old version of
+    the object without reading it again."""
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.origineel_vastleggen()
+        return instance
+
+    def origineel_vastleggen(self, velden=None):
+        """Remember the current values of velden (attnames, default all loaded fields)."""
+        if velden is None or not hasattr(self, "_origineel"):
+            self._origineel = {}
+            velden = [veld.attname for veld in self._meta.concrete_fields]
+        # deferred fields are not in __dict__ and are not loaded for this
+        self._origineel.update(
+            {naam: self.__dict__[naam] for naam in velden if naam in self.__dict__}
+        )
+
+    def origineel(self):
+        """The object as it is in the database, None for a new object.
+
+        Built from the remembered values without a query. Related objects that did
+        not change are shared with self. Objects that were not loaded from the
+        database (or with deferred fields) are read from the database instead.
+        """
+        if self.pk is None:
+            return None
+        waarden = getattr(self, "_origineel", {})
+        if len(waarden) != len(self._meta.concrete_fields) or waarden.get(
+            self._meta.pk.attname
+        ) != self.pk:
+            try:
+                return type(self).objects.get(pk=self.pk)
+            except type(self).DoesNotExist:
+                return None
+        oud = type(self)(**waarden)
+        oud._state.adding = False
+        oud._state.db = self._state.db
+        for veld in self._meta.concrete_fields:
+            if (
+                veld.is_relation
+                and veld.is_cached(self)
+                and waarden[veld.attname] == getattr(self, veld.attname)
+            ):
+                veld.set_cached_value(oud, veld.get_cached_value(self))
+        return oud
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None:
+            self.origineel_vastleggen()
+        else:
+            # the other fields are not stored, they keep their remembered value
+            self.origineel_vastleggen(
+                [self._meta.get_field(naam).attname for naam in update_fields]
+            )
+
+    @contextmanager
+    def opslaan_in_transactie(self):
+        """Transaction for a save() or delete() that writes more than the row itself.
+
+        When it is rolled back, the object gets back the pk, adding state and
+        remembered values it had before, so a retried save() compares with the
+        database as it still is instead of with the rolled back row.
+        """
+        pk, adding = self.pk, self._state.adding
+        origineel = self.__dict__.get("_origineel")
+        if origineel is not None:
+            origineel = dict(origineel)
+        gelukt = False
+        try:
+            with transaction.atomic():
+                yield
+            gelukt = True
+        finally:
+            if not gelukt:
+                self.pk = pk
+                self._state.adding = adding
+                if origineel is None:
+                    self.__dict__.pop("_origineel", None)
+                else:
+                    self._origineel = origineel
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using, fields, from_queryset)
+        if fields is not None:
+            fields = [self._meta.get_field(naam).attname for naam in fields]
+        self.origineel_vastleggen(fields)
+
+
 class WijnSoort(models.Model):
     """Represent a wine type with a Dutch description, optional English description,
     and a selectable CSS style class."""
@@ -37,6 +150,13 @@ class WijnSoort(models.Model):
     def __str__(self):
         return f"{self.omschrijving}"
 
+    def save(self, *args, **kwargs):
+        bestaand = self.pk is not None
+        super().save(*args, **kwargs)
+        if bestaand:
+            # the omschrijving is part of the search index of the wines
+            zoekindex.wijnen_bijwerken(Wijn.objects.filter(wijnsoort=self))
+
     class Meta:
         ordering = ["omschrijving"]
         verbose_name = "wijnsoort"
@@ -49,6 +169,12 @@ class DruivenSoort(models.Model):
     def __str__(self):
         return f"{self.omschrijving}"
 
+    def save(self, *args, **kwargs):
+        bestaand = self.pk is not None
+        super().save(*args, **kwargs)
+        if bestaand:
+            zoekindex.wijnen_bijwerken(Wijn.objects.filter(wijnDruivensoorten=self))
+
     class Meta:
         ordering = ["omschrijving"]
         verbose_name = "druivensoort"
@@ -103,10 +229,20 @@ class Deelnemer(models.Model):
         ordering = ["naam"]
 
 
-class Wijn(models.Model):
+class WijnQuerySet(QuerySet):
+    def fuzzy(self, fuzzy_selectie):
+        """Wines with fuzzy_selectie in one of their texts, see zoekindex.wijn_q."""
+        if not fuzzy_selectie:
+            return self
+        return self.filter(zoekindex.wijn_q(fuzzy_selectie))
+
+
+class Wijn(OrigineleStaatMixin, models.Model):
     """Model representing a wine with various attributes including type, year, origin,
     classification, and associated grape varieties."""
 
+    objects = WijnQuerySet.as_manager()
+
     def validate_jaartal(jaartal):  # pylint: disable=no-self-argument
         # Validator to ensure the year is between 1901 and 2499.
         if not 1900 < jaartal < 2500:
@@ -122,7 +258,7 @@ class Wijn(models.Model):
     wijnsoort = models.ForeignKey(WijnSoort, on_delete=models.PROTECT)
 
     jaar = models.PositiveSmallIntegerField(
-        null=True, blank=True, validators=[validate_jaartal]
+        null=True, blank=True, validators=[validate_jaartal], db_index=True
     )
     land = models.CharField(max_length=200, blank=True)
     streek = models.CharField(max_length=200, blank=True)
@@ -132,6 +268,10 @@ class Wijn(models.Model):
     foto = models.ImageField(upload_to="images/", null=True, blank=True)
     datumAangemaakt = models.DateTimeField(auto_now_add=True)
     datumAfgesloten = models.DateTimeField(null=True, blank=True)
+    # lower case text without accents of all fields in the fuzzy selection, kept up to
+    # date by save() and search_blob_bijwerken(). It is indexed by the FTS5 table
+    # zoekindex.WIJN_TABEL; a B-tree index can not serve a substring search.
+    search_blob = models.TextField(blank=True, default="", editable=False)
 
     wijnDruivensoorten = models.ManyToManyField(
         DruivenSoort,
@@ -151,6 +291,55 @@ class Wijn(models.Model):
     def __str__(self):
         return self.volle_naam
 
+    # the fields of the search text; druivensoorten and the wijnsoort description are
+    # kept up to date by search_blob_bijwerken()
+    ZOEK_VELDEN = (*zoekindex.WIJN_VELDEN, "wijnsoort_id")
+
+    def zoektekst_gewijzigd(self, update_fields=None):
+        """Whether a field of the search text changed since the wine was loaded (or
+        saved), only looking at update_fields when given."""
+        velden = self.ZOEK_VELDEN
+        if update_fields is not None:
+            velden = [
+                veld
+                for veld in velden
+                if veld in update_fields or veld.removesuffix("_id") in update_fields
+            ]
+        origineel = self.__dict__.get("_origineel")
+        if self.pk is None or not origineel:
+            return bool(velden)
+        return any(origineel.get(veld) != getattr(self, veld) for veld in velden)
+
+    def save(self, *args, **kwargs):
+        # e.g. the saves of check_afsluiten do not read the druivensoorten again
+        update_fields = kwargs.get("update_fields")
+        zoektekst = self.zoektekst_gewijzigd(update_fields)
+        if zoektekst:
+            self.search_blob = zoekindex.wijn_tekst(self)
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, "search_blob"}
+        super().save(*args, **kwargs)
+        if zoektekst:
+            zoekindex.wijn_bijwerken(self)
+        resultaatcache.verhoog_versie()
+
+    def search_blob_bijwerken(self):
+        """Recalculate search_blob after a change outside of the wine itself
+        (druivensoorten, wijnsoort) without a full save()."""
+        search_blob = zoekindex.wijn_tekst(self)
+        if search_blob != self.search_blob:
+            Wijn.objects.filter(pk=self.pk).update(search_blob=search_blob)
+            self.search_blob = search_blob
+            resultaatcache.verhoog_versie()
+        zoekindex.wijn_bijwerken(self)
+
+    def delete(self, *args, **kwargs):
+        wijn_id = self.pk
+        result = super().delete(*args, **kwargs)
+        zoekindex.wijn_verwijderen(wijn_id)
+        resultaatcache.verhoog_versie()
+        return result
+
     def check_afsluiten(self):
         vrd_aantal = WijnVoorraad.objects.filter(wijn=self).aggregate(
             aantal=Sum("aantal")
@@ -162,6 +351,45 @@ class Wijn(models.Model):
             self.datumAfgesloten = None
             self.save()
 
+    @staticmethod
+    def afsluiten_bijwerken(*wijn_ids):
+        """check_afsluiten for one or more wines in one UPDATE statement, without
+        loading them.
+
+        A wine that is already closed keeps its datumAfgesloten."""
+        heeft_voorraad = Exists(WijnVoorraad.objects.filter(wijn=OuterRef("pk")))
+        Wijn.objects.filter(pk__in=wijn_ids).update(
+            datumAfgesloten=Case(
+                When(heeft_voorraad, then=Value(None)),
+                default=Coalesce(F("datumAfgesloten"), Value(datetime.now())),
+                output_field=models.DateTimeField(),
+            )
+        )
+        # the closed state is shown (and filtered on) in the cached lists
+        resultaatcache.verhoog_versie()
+
+    @staticmethod
+    def afsluiten_na_commit(wijn_id):
+        """Close or reopen the wine when the current transaction commits.
+
+        The wines of all stock changes in one transaction are checked together with
+        one afsluiten_bijwerken, instead of once per change. Outside a transaction
+        the wine is checked immediately.
+        """
+        if not hasattr(_na_commit, "wijn_ids"):
+            _na_commit.wijn_ids = set()
+        _na_commit.wijn_ids.add(wijn_id)
+        # every call registers the callback, the first one that runs checks all wines;
+        # wines of a rolled back transaction are checked with the next commit
+        transaction.on_commit(Wijn._afsluiten_na_commit_uitvoeren)
+
+    @staticmethod
+    def _afsluiten_na_commit_uitvoeren():
+        wijn_ids = getattr(_na_commit, "wijn_ids", None)
+        if wijn_ids:
+            _na_commit.wijn_ids = set()
+            Wijn.afsluiten_bijwerken(*wijn_ids)
+
     def check_unique(self):
         o = Wijn.objects.filter(naam=self.naam, domein=self.domein, jaar=self.jaar)
         if o:
@@ -200,27 +428,6 @@ class Wijn(models.Model):
         else:
             raise ValidationError("Teveel kopieën reeds aanwezig")
 
-    def check_fuzzy_selectie(self, fuzzy_selectie):
-        """Check if the wine matches the fuzzy selection criteria."""
-        if not fuzzy_selectie:
-            return True
-        fs = fuzzy_selectie.lower()
-        fields = [
-            self.naam,
-            self.domein,
-            self.wijnsoort.omschrijving,
-            str(self.jaar),
-            self.land,
-            self.streek,
-            self.classificatie,
-            self.opmerking,
-        ]
-        if any(fs in (field or "").lower() for field in fields):
-            return True
-        if self.wijnDruivensoorten.filter(omschrijving__icontains=fs).exists():
-            return True
-        return False
-
     class Meta:
         ordering = [F("jaar").asc(nulls_last=True), Lower("domein"), Lower("naam")]
         verbose_name_plural = "wijnen"
@@ -246,6 +453,16 @@ class WijnDruivensoort(models.Model):
     def __str__(self):
         return f"{self.wijn.volle_naam} - {self.druivensoort.omschrijving}"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.wijn.search_blob_bijwerken()
+
+    def delete(self, *args, **kwargs):
+        wijn = self.wijn
+        result = super().delete(*args, **kwargs)
+        wijn.search_blob_bijwerken()
+        return result
+
     class Meta:
         ordering = ["wijn", "druivensoort"]
         verbose_name_plural = "Wijn druivensoorten"
@@ -257,14 +474,32 @@ class WijnDruivensoort(models.Model):
         ]
 
 
+class OntvangstQuerySet(QuerySet):
+    def fuzzy(self, fuzzy_selectie):
+        """Ontvangsten with fuzzy_selectie in their own texts or those of the wine."""
+        if not fuzzy_selectie:
+            return self
+        return self.filter(zoekindex.ontvangst_q(fuzzy_selectie))
+
+    def met_relaties(self):
+        """Loads deelnemer, wijn and wijnsoort with the ontvangsten."""
+        return self.select_related("deelnemer", "wijn__wijnsoort")
+
+
 class Ontvangst(models.Model):
+    objects = OntvangstQuerySet.as_manager()
     deelnemer = models.ForeignKey(Deelnemer, on_delete=models.PROTECT)
     wijn = models.ForeignKey(Wijn, on_delete=models.PROTECT)
     datumOntvangst = models.DateField(default=date.today)
     leverancier = models.CharField(max_length=200, blank=True)
     website = models.URLField(max_length=200, blank=True)
-    prijs = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
+    prijs = models.DecimalField(
+        max_digits=5, decimal_places=2, null=True, blank=True, db_index=True
+    )
     opmerking = models.CharField(max_length=4000, blank=True)
+    # lower case text without accents of leverancier and opmerking, kept up to date by
+    # save() and indexed by the FTS5 table zoekindex.ONTVANGST_TABEL
+    search_blob = models.TextField(blank=True, default="", editable=False)
 
     def __str__(self):
         return (
@@ -272,6 +507,19 @@ class Ontvangst(models.Model):
             f" - {self.datumOntvangst.strftime('%d-%m-%Y')}"
         )
 
+    def save(self, *args, **kwargs):
+        self.search_blob = zoekindex.ontvangst_tekst(self)
+        super().save(*args, **kwargs)
+        zoekindex.ontvangst_bijwerken(self)
+        resultaatcache.verhoog_versie()
+
+    def delete(self, *args, **kwargs):
+        ontvangst_id = self.pk
+        result = super().delete(*args, **kwargs)
+        zoekindex.ontvangst_verwijderen(ontvangst_id)
+        resultaatcache.verhoog_versie()
+        return result
+
     def create_copy(self):
         # orig_ontvangst_id = self.id
         nieuwe_ontvangst = self
@@ -280,27 +528,39 @@ class Ontvangst(models.Model):
         nieuwe_ontvangst.save()
         return nieuwe_ontvangst.id
 
-    def check_fuzzy_selectie(self, fuzzy_selectie):
-        if not fuzzy_selectie:
-            return True
-
-        fs = fuzzy_selectie.lower()
-        fields = [
-            self.leverancier,
-            self.opmerking,
-        ]
-        if any(fs in (field or "").lower() for field in fields):
-            return True
-
-        if self.wijn.check_fuzzy_selectie(fuzzy_selectie):
-            return True
-
     class Meta:
         ordering = ["-datumOntvangst", "deelnemer", "wijn"]
         verbose_name_plural = "ontvangsten"
 
 
-class VoorraadMutatie(models.Model):
+class Verplaatsing(NamedTuple):
+    """Move aantal bottles of an ontvangst from locatie_oud/vak_oud to
+    locatie_nieuw/vak_nieuw, see VoorraadMutatie.verplaatsen_lijst."""
+
+    ontvangst: "Ontvangst"
+    locatie_oud: "Locatie"
+    vak_oud: "Vak"
+    locatie_nieuw: "Locatie"
+    vak_nieuw: "Vak"
+    aantal: int
+
+
+class VoorraadMutatieQuerySet(QuerySet):
+    def fuzzy(self, fuzzy_selectie):
+        """Mutations with fuzzy_selectie in the omschrijving or the ontvangst."""
+        if not fuzzy_selectie:
+            return self
+        return self.filter(zoekindex.mutatie_q(fuzzy_selectie))
+
+    def met_relaties(self):
+        """Loads the objects shown with a mutatie (and used by __str__) in the same query."""
+        return self.select_related(
+            "ontvangst__wijn__wijnsoort", "ontvangst__deelnemer", "locatie", "vak"
+        )
+
+
+class VoorraadMutatie(OrigineleStaatMixin, models.Model):
+    objects = VoorraadMutatieQuerySet.as_manager()
     ontvangst = models.ForeignKey(Ontvangst, on_delete=models.PROTECT)
     locatie = models.ForeignKey(Locatie, on_delete=models.PROTECT)
     vak = models.ForeignKey(Vak, on_delete=models.PROTECT, null=True, blank=True)
@@ -341,40 +601,47 @@ class VoorraadMutatie(models.Model):
         )
 
     def clean(self, *args, **kwargs):
-        try:
-            old_mutatie = VoorraadMutatie.objects.get(pk=self.pk)
-        except VoorraadMutatie.DoesNotExist:
-            old_mutatie = None
+        old_mutatie = self.origineel()
         WijnVoorraad.check_voorraad_wijziging(self, old_mutatie)
         super().clean(*args, **kwargs)
 
-    def save(self, *args, **kwargs):
-        try:
-            old_mutatie = VoorraadMutatie.objects.get(pk=self.pk)
-        except VoorraadMutatie.DoesNotExist:
-            old_mutatie = None
-        super().save(*args, **kwargs)  # Call the "real" save() method.
-        WijnVoorraad.Bijwerken(self, old_mutatie)
+    def save(self, *args, controleren=False, **kwargs):
+        """With controleren a new UIT mutation is only saved when there is enough
+        stock. The check is part of the UPDATE of the stock (see
+        WijnVoorraad.aantal_afboeken), so two users can not take the same last bottle."""
+        old_mutatie = self.origineel()
+        with self.opslaan_in_transactie():
+            super().save(*args, **kwargs)  # Call the "real" save() method.
+            controle = controleren and old_mutatie is None and self.in_uit == self.UIT
+            if projectie.uitgesteld(self.pk):
+                # the projector updates the stock (see projectie.py)
+                if controle:
+                    projectie.controleren(
+                        [(self.ontvangst_id, self.locatie_id, self.vak_id)]
+                    )
+            elif controle:
+                WijnVoorraad.aantal_afboeken(
+                    self.ontvangst_id, self.locatie_id, self.vak_id, self.aantal
+                )
+            else:
+                WijnVoorraad.Bijwerken(self, old_mutatie)
+            VoorraadMomentopname.ongeldig_maken(
+                self.datum, old_mutatie.datum if old_mutatie else None
+            )
+        zoekindex.mutatie_bijwerken(self)
+        resultaatcache.verhoog_versie()
 
     def delete(self, *args, **kwargs):
-        try:
-            old_mutatie = VoorraadMutatie.objects.get(pk=self.pk)
-        except VoorraadMutatie.DoesNotExist:
-            old_mutatie = None
+        old_mutatie = self.origineel()
         WijnVoorraad.check_voorraad_wijziging(None, old_mutatie)
-        WijnVoorraad.Bijwerken(None, old_mutatie)
-        super().delete(*args, **kwargs)  # Call the "real" delete() method.
-
-    def check_fuzzy_selectie(self, fuzzy_selectie):
-        voldoet = False
-        if fuzzy_selectie:
-            if fuzzy_selectie.lower() in self.omschrijving.lower():
-                voldoet = True
-            elif self.ontvangst.check_fuzzy_selectie(fuzzy_selectie):
-                voldoet = True
-        else:
-            voldoet = True
-        return voldoet
+        mutatie_id = self.pk
+        with self.opslaan_in_transactie():
+            if not projectie.uitgesteld(mutatie_id):
+                WijnVoorraad.Bijwerken(None, old_mutatie)
+            VoorraadMomentopname.ongeldig_maken(old_mutatie.datum)
+            super().delete(*args, **kwargs)  # Call the "real" delete() method.
+        zoekindex.mutatie_verwijderen(mutatie_id)
+        resultaatcache.verhoog_versie()
 
     @staticmethod
     def drinken(ontvangst, locatie, vak=None):
@@ -388,8 +655,7 @@ class VoorraadMutatie(models.Model):
         mutatie.datum = datetime.now()
         mutatie.aantal = 1
         mutatie.omschrijving = "Drinken"
-        mutatie.clean()
-        mutatie.save()
+        mutatie.save(controleren=True)
 
     @staticmethod
     def voorraad_plus_1(ontvangst, locatie):
@@ -405,33 +671,50 @@ class VoorraadMutatie(models.Model):
 
     @staticmethod
     def verplaatsen(ontvangst, locatie_oud, vak_oud, locatie_nieuw, vak_nieuw, aantal):
-        mutatie = VoorraadMutatie()
-        mutatie.ontvangst = ontvangst
-        mutatie.locatie = locatie_oud
-        if vak_oud is not None:
-            mutatie.vak = vak_oud
-        mutatie.in_uit = "U"
-        mutatie.actie = "V"
-        mutatie.datum = datetime.now()
-        mutatie.aantal = aantal
-        mutatie.omschrijving = "Verplaatsing naar " + locatie_nieuw.omschrijving
-        if vak_nieuw is not None:
-            mutatie.omschrijving = mutatie.omschrijving + " - " + vak_nieuw.code
-        mutatie.save()
+        VoorraadMutatie.verplaatsen_lijst(
+            [
+                Verplaatsing(
+                    ontvangst, locatie_oud, vak_oud, locatie_nieuw, vak_nieuw, aantal
+                )
+            ]
+        )
 
-        mutatie = VoorraadMutatie()
-        mutatie.ontvangst = ontvangst
-        mutatie.locatie = locatie_nieuw
-        if vak_nieuw is not None:
-            mutatie.vak = vak_nieuw
-        mutatie.in_uit = "I"
-        mutatie.actie = "V"
-        mutatie.datum = datetime.now()
-        mutatie.aantal = aantal
-        mutatie.omschrijving = "Verplaatsing van " + locatie_oud.omschrijving
-        if vak_oud is not None:
-            mutatie.omschrijving = mutatie.omschrijving + " - " + vak_oud.code
-        mutatie.save()
+    @staticmethod
+    def verplaatsen_lijst(verplaatsingen):
+        """Execute a list of Verplaatsing in one transaction, all or nothing.
+
+        Every verplaatsing gives an UIT and an IN mutation (actie VERPLAATSING). They are
+        booked together with bulk_boeken: one read to check the stock of all
+        verplaatsingen and one statement per changed stock entry.
+        """
+        mutaties = []
+        for verplaatsing in verplaatsingen:
+            aantal = int(verplaatsing.aantal)
+            omschrijving_naar = (
+                "Verplaatsing naar " + verplaatsing.locatie_nieuw.omschrijving
+            )
+            if verplaatsing.vak_nieuw is not None:
+                omschrijving_naar += " - " + verplaatsing.vak_nieuw.code
+            omschrijving_van = "Verplaatsing van " + verplaatsing.locatie_oud.omschrijving
+            if verplaatsing.vak_oud is not None:
+                omschrijving_van += " - " + verplaatsing.vak_oud.code
+            for in_uit, locatie, vak, omschrijving in (
+                ("U", verplaatsing.locatie_oud, verplaatsing.vak_oud, omschrijving_naar),
+                ("I", verplaatsing.locatie_nieuw, verplaatsing.vak_nieuw, omschrijving_van),
+            ):
+                mutaties.append(
+                    VoorraadMutatie(
+                        ontvangst=verplaatsing.ontvangst,
+                        locatie=locatie,
+                        vak=vak,
+                        in_uit=in_uit,
+                        actie="V",
+                        datum=datetime.now(),
+                        aantal=aantal,
+                        omschrijving=omschrijving,
+                    )
+                )
+        return VoorraadMutatie.bulk_boeken(mutaties)
 
     @staticmethod
     def afboeken(ontvangst, locatie, vak, aantal):
@@ -445,8 +728,63 @@ class VoorraadMutatie(models.Model):
         mutatie.datum = datetime.now()
         mutatie.aantal = aantal
         mutatie.omschrijving = "Afboeken"
-        mutatie.clean()
-        mutatie.save()
+        mutatie.save(controleren=True)
+
+    @staticmethod
+    def bulk_boeken(mutaties):
+        """Book a list of new (unsaved) mutations at once, all or nothing.
+
+        The mutations are checked in the given order against one read of the current
+        stock, like clean() does for a single mutation, and inserted with bulk_create.
+        The stock is then updated with the net change per (ontvangst, locatie, vak), one
+        statement per entry. Raises ValidationError when the stock would become negative;
+        nothing is booked in that case.
+        """
+        mutaties = list(mutaties)
+        if not mutaties:
+            return mutaties
+        with transaction.atomic():
+            if projectie.actief():
+                voorraad = projectie.aantallen(
+                    (m.ontvangst_id, m.locatie_id, m.vak_id) for m in mutaties
+                )
+            else:
+                voorraad = {
+                    sleutel: vrd.aantal
+                    for sleutel, vrd in WijnVoorraad.objects.voor_sleutels(
+                        (m.ontvangst_id, m.locatie_id, m.vak_id) for m in mutaties
+                    ).items()
+                }
+            wijzigingen = {}
+            for mutatie in mutaties:
+                sleutel = (mutatie.ontvangst_id, mutatie.locatie_id, mutatie.vak_id)
+                wijziging = mutatie.aantal if mutatie.in_uit == "I" else -mutatie.aantal
+                if voorraad.get(sleutel, 0) + wijziging < 0:
+                    raise ValidationError(
+                        ("Onjuiste mutatie. Hiermee wordt de voorraad negatief!")
+                    )
+                voorraad[sleutel] = voorraad.get(sleutel, 0) + wijziging
+                wijzigingen[sleutel] = wijzigingen.get(sleutel, 0) + wijziging
+
+            VoorraadMutatie.objects.bulk_create(mutaties)
+            for mutatie in mutaties:
+                mutatie.origineel_vastleggen()
+            if projectie.uitgesteld(max(m.pk for m in mutaties)):
+                # the projector updates the stock, check again after the insert
+                projectie.controleren(
+                    sleutel for sleutel, wijziging in wijzigingen.items() if wijziging < 0
+                )
+                wijzigingen = {}
+            for sleutel, wijziging in wijzigingen.items():
+                if wijziging < 0:
+                    # checked again in the UPDATE, the stock may have changed since the read
+                    WijnVoorraad.aantal_afboeken(*sleutel, -wijziging)
+                elif wijziging > 0:
+                    WijnVoorraad.aantal_bijwerken(*sleutel, wijziging)
+            VoorraadMomentopname.ongeldig_maken(*(m.datum for m in mutaties))
+            zoekindex.mutaties_toevoegen(mutaties)
+        resultaatcache.verhoog_versie()
+        return mutaties
 
     @staticmethod
     def mutation_refer_to_same_voorraad(mutatuin_one, mutation_two):
@@ -454,9 +792,9 @@ class VoorraadMutatie(models.Model):
         if (
             mutatuin_one is None
             or mutation_two is None
-            or mutatuin_one.ontvangst != mutation_two.ontvangst
-            or mutatuin_one.locatie != mutation_two.locatie
-            or mutatuin_one.vak != mutation_two.vak
+            or mutatuin_one.ontvangst_id != mutation_two.ontvangst_id
+            or mutatuin_one.locatie_id != mutation_two.locatie_id
+            or mutatuin_one.vak_id != mutation_two.vak_id
         ):
             return False
         return True
@@ -465,10 +803,129 @@ class VoorraadMutatie(models.Model):
         ordering = ["ontvangst", "datum", "in_uit"]
         verbose_name = "voorraadmutatie"
         verbose_name_plural = "voorraadmutaties"
+        indexes = [
+            # keyset pagination of the mutation lists on (datum, id)
+            models.Index(fields=["datum", "id"], name="mutatie_datum_id_idx"),
+            models.Index(
+                fields=["in_uit", "datum", "id"], name="mutatie_inuit_datum_id_idx"
+            ),
+        ]
 
 
 class WijnVoorraadQuerySet(QuerySet, GroupByMixin):
-    pass
+    def fuzzy(self, fuzzy_selectie):
+        """Stock with fuzzy_selectie in the texts of the wine or the ontvangst."""
+        if not fuzzy_selectie:
+            return self
+        return self.filter(zoekindex.voorraad_q(fuzzy_selectie))
+
+    def met_relaties(self):
+        """Loads the objects shown with a voorraad (and used by __str__) in the same query."""
+        return self.select_related(
+            "wijn__wijnsoort", "deelnemer", "ontvangst", "locatie", "vak"
+        )
+
+    def per_sleutel(self):
+        """The voorraad by (ontvangst_id, locatie_id, vak_id), read with one query.
+
+        Used to look up the voorraad of many bestellingregels at once.
+        """
+        return {(v.ontvangst_id, v.locatie_id, v.vak_id): v for v in self}
+
+    def bestelbaar(self):
+        """Only the stock with bottles that are not reserved yet."""
+        return self.filter(aantal_beschikbaar__gt=0)
+
+    def voor_sleutels(self, sleutels):
+        """per_sleutel for the (ontvangst_id, locatie_id, vak_id) sleutels only.
+
+        One query, however many sleutels; a sleutel without voorraad is left out.
+        """
+        sleutels = set(sleutels)
+        if not sleutels:
+            return {}
+        voorraad = (
+            self.filter(
+                ontvangst_id__in={sleutel[0] for sleutel in sleutels},
+                locatie_id__in={sleutel[1] for sleutel in sleutels},
+            )
+            .order_by()
+            .per_sleutel()
+        )
+        return {
+            sleutel: vrd for sleutel, vrd in voorraad.items() if sleutel in sleutels
+        }
+
+    def overzicht(self, *volgorde):
+        """Voorraad summed per wijn, ontvangst, deelnemer and locatie in one query.
+
+        The rows contain the ids, the aantallen and the columns needed to show the
+        voorraad list, sorted on volgorde. VoorraadOverzichtRegel.van_rijen() turns them
+        into objects for the template.
+        """
+        return (
+            self.values(*VoorraadOverzichtRegel.VELDEN)
+            .annotate(
+                aantal=Sum("aantal"),
+                aantal_rsv=Sum("aantal_rsv"),
+                aantal_beschikbaar=Sum("aantal_beschikbaar"),
+            )
+            .order_by(*volgorde)
+        )
+
+
+class VoorraadOverzichtRegel:
+    """One row of WijnVoorraadQuerySet.overzicht(), with wijn, ontvangst, deelnemer and
+    locatie as (partially filled) model instances, so it can be used like a WijnVoorraad."""
+
+    VELDEN = (
+        "wijn",
+        "ontvangst",
+        "deelnemer",
+        "locatie",
+        "wijn__domein",
+        "wijn__naam",
+        "wijn__jaar",
+        "wijn__land",
+        "wijn__wijnsoort",
+        "wijn__wijnsoort__omschrijving",
+        "wijn__wijnsoort__style_css_class",
+        "ontvangst__datumOntvangst",
+        "ontvangst__prijs",
+    )
+
+    def __init__(self, rij):
+        wijnsoort = WijnSoort(
+            id=rij["wijn__wijnsoort"],
+            omschrijving=rij["wijn__wijnsoort__omschrijving"],
+            style_css_class=rij["wijn__wijnsoort__style_css_class"],
+        )
+        self.wijn = Wijn(
+            id=rij["wijn"],
+            domein=rij["wijn__domein"],
+            naam=rij["wijn__naam"],
+            jaar=rij["wijn__jaar"],
+            land=rij["wijn__land"],
+            wijnsoort=wijnsoort,
+        )
+        self.ontvangst = Ontvangst(
+            id=rij["ontvangst"],
+            wijn=self.wijn,
+            datumOntvangst=rij["ontvangst__datumOntvangst"],
+            prijs=rij["ontvangst__prijs"],
+        )
+        self.deelnemer = Deelnemer(id=rij["deelnemer"])
+        self.locatie = Locatie(id=rij["locatie"])
+        self.aantal = rij["aantal"]
+        self.aantal_rsv = rij["aantal_rsv"]
+        self.aantal_beschikbaar = rij["aantal_beschikbaar"]
+
+    @staticmethod
+    def van_rijen(rijen):
+        """Objects for the rows, with the druivensoorten of all wines in one extra query."""
+        regels = [VoorraadOverzichtRegel(rij) for rij in rijen]
+        prefetch_related_objects([r.wijn for r in regels], "wijnDruivensoorten")
+        return regels
 
 
 # AIUsage model tostore the AI usage
@@ -501,13 +958,68 @@ class AIUsage(models.Model):
         )
 
 
+class BestellingQuerySet(QuerySet):
+    def met_totalen(self):
+        """Loads the objects shown in the lists of bestellingen with the same query.
+
+        The totals are stored on Bestelling (see Bestelling.TOTALEN), so no regels are
+        read.
+        """
+        return self.select_related("deelnemer", "vanLocatie")
+
+    def totalen_herberekenen(self):
+        """Recompute the stored totals of these bestellingen from their regels, with
+        one grouped query. Returns the number of bestellingen that were corrected."""
+        aantal = Coalesce("aantal_correctie", "aantal")
+        totalen = {
+            rij["bestelling_id"]: rij
+            for rij in BestellingRegel.objects.filter(bestelling__in=self)
+            .order_by()
+            .values("bestelling_id")
+            .annotate(
+                tot_aantal=Sum(aantal, default=0),
+                aantal_verzameld=Sum(
+                    aantal, filter=Q(verwerkt="N", isVerzameld=True), default=0
+                ),
+                aantal_verwerkt=Sum(
+                    aantal,
+                    filter=Q(
+                        verwerkt__in=[
+                            BestellingRegel.AFGEBOEKT,
+                            BestellingRegel.VERPLAATST,
+                        ]
+                    ),
+                    default=0,
+                ),
+            )
+        }
+        gecorrigeerd = []
+        for bestelling in self.only("id", *Bestelling.TOTALEN):
+            rij = totalen.get(bestelling.id, {})
+            juist = {veld: rij.get(veld, 0) for veld in Bestelling.TOTALEN}
+            if any(getattr(bestelling, veld) != juist[veld] for veld in juist):
+                for veld, aantal in juist.items():
+                    setattr(bestelling, veld, aantal)
+                gecorrigeerd.append(bestelling)
+        Bestelling.objects.bulk_update(gecorrigeerd, Bestelling.TOTALEN, batch_size=500)
+        return len(gecorrigeerd)
+
+
 class Bestelling(models.Model):
+    objects = BestellingQuerySet.as_manager()
     deelnemer = models.ForeignKey(Deelnemer, on_delete=models.PROTECT)
     datumAangemaakt = models.DateField(default=date.today)
     vanLocatie = models.ForeignKey(Locatie, on_delete=models.PROTECT)
     opmerking = models.CharField(max_length=4000, blank=True)
     datumAfgesloten = models.DateTimeField(null=True, blank=True)
 
+    # totals of the regels, counting aantal_correctie when it is filled (like
+    # BestellingRegel.aantal_werkelijk); kept up to date by BestellingRegel
+    tot_aantal = models.IntegerField(default=0, editable=False)
+    aantal_verzameld = models.IntegerField(default=0, editable=False)
+    aantal_verwerkt = models.IntegerField(default=0, editable=False)
+    TOTALEN = ["tot_aantal", "aantal_verzameld", "aantal_verwerkt"]
+
     def __str__(self):
         return (
             f"{self.deelnemer} - "
@@ -515,12 +1027,83 @@ class Bestelling(models.Model):
             f"{self.vanLocatie}"
         )
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            # the totals are changed with UPDATE statements by BestellingRegel, so a
+            # bestelling loaded before that must not write its old totals back
+            kwargs["update_fields"] = [
+                veld.attname
+                for veld in self._meta.concrete_fields
+                if not veld.primary_key and veld.attname not in self.TOTALEN
+            ]
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def totalen_bijwerken(new_regel, old_regel):
+        """Apply the change from old_regel to new_regel (either can be None) on the
+        totals of their bestelling(en), with one UPDATE per bestelling."""
+        wijzigingen = {}
+        for regel, teken in ((old_regel, -1), (new_regel, 1)):
+            if regel is not None:
+                wijziging = wijzigingen.setdefault(
+                    regel.bestelling_id, dict.fromkeys(Bestelling.TOTALEN, 0)
+                )
+                for veld, aantal in regel.totalen().items():
+                    wijziging[veld] += teken * aantal
+        for bestelling_id, wijziging in wijzigingen.items():
+            velden = {
+                veld: F(veld) + aantal for veld, aantal in wijziging.items() if aantal
+            }
+            if velden:
+                Bestelling.objects.filter(pk=bestelling_id).update(**velden)
+
     def afboeken(self):
-        br = BestellingRegel.objects.filter(
-            bestelling=self, isVerzameld=True, verwerkt="N"
-        )
-        for regel in br:
-            regel.afboeken()
+        """Book off all collected regels that are not processed yet, at once.
+
+        The same as BestellingRegel.afboeken for each regel, but set-based in one
+        transaction: the AFBOEKING mutations are booked with bulk_boeken, the
+        reservations released with one UPDATE, the regels marked afgeboekt with one
+        UPDATE, followed by one close check of the bestelling.
+        """
+        with transaction.atomic():
+            regels = list(
+                BestellingRegel.objects.filter(
+                    bestelling=self, isVerzameld=True, verwerkt=BestellingRegel.NIET
+                )
+            )
+            if not regels:
+                return
+            nu = datetime.now()
+            rsv = {}
+            for regel in regels:
+                sleutel = (regel.ontvangst_id, self.vanLocatie_id, regel.vak_id)
+                rsv[sleutel] = rsv.get(sleutel, 0) - regel.aantal_werkelijk
+            # released first: an entry that is booked off to zero is deleted
+            WijnVoorraad.rsv_bijwerken(rsv)
+            VoorraadMutatie.bulk_boeken(
+                VoorraadMutatie(
+                    ontvangst_id=regel.ontvangst_id,
+                    locatie_id=self.vanLocatie_id,
+                    vak_id=regel.vak_id,
+                    in_uit="U",
+                    actie="A",
+                    datum=nu,
+                    aantal=regel.aantal_werkelijk,
+                    omschrijving="Afboeken",
+                )
+                for regel in regels
+                if regel.aantal_werkelijk > 0
+            )
+            BestellingRegel.objects.filter(
+                pk__in=[regel.pk for regel in regels]
+            ).update(verwerkt=BestellingRegel.AFGEBOEKT)
+            aantal = sum(regel.aantal_werkelijk for regel in regels)
+            Bestelling.objects.filter(pk=self.pk).update(
+                aantal_verzameld=F("aantal_verzameld") - aantal,
+                aantal_verwerkt=F("aantal_verwerkt") + aantal,
+            )
+            self.check_afsluiten()
+        resultaatcache.verhoog_versie()
 
     def check_afsluiten(self):
         br = BestellingRegel.objects.filter(bestelling=self, verwerkt="N")
@@ -536,7 +1119,38 @@ class Bestelling(models.Model):
         verbose_name_plural = "bestellingen"
 
 
-class BestellingRegel(models.Model):
+class BestellingRegelQuerySet(QuerySet):
+    def met_relaties(self):
+        """Loads the objects shown with a regel (and used by __str__) in the same query."""
+        return self.select_related(
+            "bestelling__deelnemer",
+            "bestelling__vanLocatie",
+            "ontvangst__wijn__wijnsoort",
+            "ontvangst__deelnemer",
+            "vak",
+        )
+
+    def per_sleutel(self):
+        """The regels by (ontvangst_id, vak_id), read with one query.
+
+        Meant for the regels of one bestelling, where the key is unique.
+        """
+        return {(regel.ontvangst_id, regel.vak_id): regel for regel in self}
+
+    def met_voorraad(self):
+        """The regels as a list, each with the WijnVoorraad it reserves on as
+        regel.voorraad (None when there is none). Two queries for all regels."""
+        regels = list(self.select_related("bestelling"))
+        voorraad = WijnVoorraad.objects.voor_sleutels(
+            regel.voorraad_sleutel for regel in regels
+        )
+        for regel in regels:
+            regel.voorraad = voorraad.get(regel.voorraad_sleutel)
+        return regels
+
+
+class BestellingRegel(OrigineleStaatMixin, models.Model):
+    objects = BestellingRegelQuerySet.as_manager()
     bestelling = models.ForeignKey(Bestelling, on_delete=models.PROTECT)
     ontvangst = models.ForeignKey(Ontvangst, on_delete=models.PROTECT)
     vak = models.ForeignKey(Vak, on_delete=models.PROTECT, null=True, blank=True)
@@ -558,6 +1172,11 @@ class BestellingRegel(models.Model):
     def __str__(self):
         return f"{self.bestelling} - {self.ontvangst.wijn}"
 
+    @property
+    def voorraad_sleutel(self):
+        """The (ontvangst_id, locatie_id, vak_id) of the WijnVoorraad of this regel."""
+        return (self.ontvangst_id, self.bestelling.vanLocatie_id, self.vak_id)
+
     # Add property regel_aantal_werkelijk to return the actual number of bottles to be processed
     @property
     def aantal_werkelijk(self):
@@ -569,34 +1188,45 @@ class BestellingRegel(models.Model):
             return self.aantal_correctie
         return self.aantal
 
+    def totalen(self):
+        """The share of this regel in the totals of its bestelling (see Bestelling)."""
+        aantal = self.aantal_werkelijk
+        return {
+            "tot_aantal": aantal,
+            "aantal_verzameld": (
+                aantal if self.verwerkt == self.NIET and self.isVerzameld else 0
+            ),
+            "aantal_verwerkt": (
+                aantal if self.verwerkt in (self.AFGEBOEKT, self.VERPLAATST) else 0
+            ),
+        }
+
     def clean(self, *args, **kwargs):
-        try:
-            old_regel = BestellingRegel.objects.get(pk=self.pk)
-        except BestellingRegel.DoesNotExist:
-            old_regel = None
+        old_regel = self.origineel()
         WijnVoorraad.check_voorraad_rsv(self, old_regel)
         super().clean(*args, **kwargs)
 
     def save(self, *args, **kwargs):
-        try:
-            old_regel = BestellingRegel.objects.get(pk=self.pk)
-        except BestellingRegel.DoesNotExist:
-            old_regel = None
-        super().save(*args, **kwargs)  # Call the "real" save() method.
-        WijnVoorraad.Bijwerken_rsv(self, old_regel)
-        self.bestelling.check_afsluiten()
+        old_regel = self.origineel()
+        # the row is only kept when the reservation fits (see rsv_reserveren)
+        with self.opslaan_in_transactie():
+            super().save(*args, **kwargs)  # Call the "real" save() method.
+            WijnVoorraad.Bijwerken_rsv(self, old_regel)
+            Bestelling.totalen_bijwerken(self, old_regel)
+            self.bestelling.check_afsluiten()
+        resultaatcache.verhoog_versie()
 
     def delete(self, *args, **kwargs):
         bestelling = self.bestelling
-        try:
-            old_regel = BestellingRegel.objects.get(pk=self.pk)
-        except BestellingRegel.DoesNotExist:
-            old_regel = None
+        old_regel = self.origineel()
 
         WijnVoorraad.check_voorraad_rsv(None, old_regel)
-        WijnVoorraad.Bijwerken_rsv(None, old_regel)
-        super().delete(*args, **kwargs)  # Call the "real" delete() method.
-        bestelling.check_afsluiten()
+        with self.opslaan_in_transactie():
+            WijnVoorraad.Bijwerken_rsv(None, old_regel)
+            super().delete(*args, **kwargs)  # Call the "real" delete() method.
+            Bestelling.totalen_bijwerken(None, old_regel)
+            bestelling.check_afsluiten()
+        resultaatcache.verhoog_versie()
 
     def afboeken(self):
         if self.verwerkt == "N":
@@ -613,15 +1243,37 @@ class BestellingRegel(models.Model):
 
     def verplaatsen(self, locatie_nieuw, vak_nieuw, aantal, bijwerken=True):
         if self.verwerkt == "N":
-            VoorraadMutatie.verplaatsen(
-                self.ontvangst,
-                self.bestelling.vanLocatie,
-                self.vak,
-                locatie_nieuw,
-                vak_nieuw,
-                aantal,
-            )
-            if bijwerken:
+            with transaction.atomic():
+                VoorraadMutatie.verplaatsen(
+                    self.ontvangst,
+                    self.bestelling.vanLocatie,
+                    self.vak,
+                    locatie_nieuw,
+                    vak_nieuw,
+                    aantal,
+                )
+                if bijwerken:
+                    self.verwerkt = "V"
+                    self.save()
+
+    def verplaatsen_naar_vakken(self, bestemmingen):
+        """Move the bottles of this regel to several (locatie, vak, aantal) bestemmingen
+        and mark it as verplaatst, in one transaction."""
+        if self.verwerkt == "N":
+            with transaction.atomic():
+                VoorraadMutatie.verplaatsen_lijst(
+                    [
+                        Verplaatsing(
+                            self.ontvangst,
+                            self.bestelling.vanLocatie,
+                            self.vak,
+                            locatie,
+                            vak,
+                            aantal,
+                        )
+                        for locatie, vak, aantal in bestemmingen
+                    ]
+                )
                 self.verwerkt = "V"
                 self.save()
 
@@ -646,6 +1298,12 @@ class WijnVoorraad(models.Model):
     vak = models.ForeignKey(Vak, on_delete=models.PROTECT, null=True, blank=True)
     aantal = models.IntegerField(default=0)
     aantal_rsv = models.IntegerField(default=0)
+    # the bottles that can still be ordered, computed by the database
+    aantal_beschikbaar = models.GeneratedField(
+        expression=F("aantal") - F("aantal_rsv"),
+        output_field=models.IntegerField(),
+        db_persist=True,
+    )
 
     def __str__(self):
         if self.vak:
@@ -662,20 +1320,19 @@ class WijnVoorraad(models.Model):
                 f"{self.locatie.omschrijving}"
             )
 
+    def save(self, *args, **kwargs):
+        # also direct changes, see WijnVoorraadService.BijwerkenVrdOntvangst and admin
+        super().save(*args, **kwargs)
+        resultaatcache.verhoog_versie()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        resultaatcache.verhoog_versie()
+        return result
+
     def drinken(self):
         VoorraadMutatie.drinken(self.ontvangst, self.locatie, self.vak)
 
-    def check_fuzzy_selectie(self, fuzzy_selectie):
-        voldoet = False
-        if fuzzy_selectie:
-            if self.wijn.check_fuzzy_selectie(fuzzy_selectie):
-                voldoet = True
-            elif self.ontvangst.check_fuzzy_selectie(fuzzy_selectie):
-                voldoet = True
-        else:
-            voldoet = True
-        return voldoet
-
     @staticmethod
     def Bijwerken(new_mutatie, old_mutatie):
         if old_mutatie is not None:
@@ -696,59 +1353,82 @@ class WijnVoorraad(models.Model):
     @staticmethod
     def Bijwerken_mutatie_IN(mutatie: VoorraadMutatie):
         """Update the wine stock based on an IN mutation."""
-        try:
-            # if there is stock entry for this wine, location, and vak, update it
-            vrd = WijnVoorraad.objects.get(
-                ontvangst=mutatie.ontvangst,
-                locatie=mutatie.locatie,
-                vak=mutatie.vak,
-            )
-            vrd.aantal = F("aantal") + mutatie.aantal
-        except WijnVoorraad.DoesNotExist:
-            # if not, create a new stock entry
-            vrd = WijnVoorraad(
-                wijn=mutatie.ontvangst.wijn,
-                deelnemer=mutatie.ontvangst.deelnemer,
-                ontvangst=mutatie.ontvangst,
-                locatie=mutatie.locatie,
-                vak=mutatie.vak,
-                aantal=mutatie.aantal,
+        WijnVoorraad.aantal_bijwerken(
+            mutatie.ontvangst_id, mutatie.locatie_id, mutatie.vak_id, mutatie.aantal
+        )
+
+    @staticmethod
+    def Bijwerken_mutatie_UIT(mutatie: VoorraadMutatie):
+        WijnVoorraad.aantal_bijwerken(
+            mutatie.ontvangst_id, mutatie.locatie_id, mutatie.vak_id, -mutatie.aantal
+        )
+
+    @staticmethod
+    def aantal_bijwerken(ontvangst_id, locatie_id, vak_id, delta):
+        """Add delta to the stock of an ontvangst on a locatie and vak.
+
+        One INSERT ... ON CONFLICT DO UPDATE creates the stock entry or updates it, and
+        returns the new aantal. Only when the entry appears or disappears (aantal back
+        to zero) the entry is deleted and the wine is checked when the transaction
+        commits (Wijn.afsluiten_na_commit).
+        """
+        tabel = connection.ops.quote_name(WijnVoorraad._meta.db_table)
+        ontvangst_tabel = connection.ops.quote_name(Ontvangst._meta.db_table)
+        if vak_id is None:
+            # NULLs are distinct in a unique index, see unique_wijnvoorraad_zonder_vak
+            conflict = "(ontvangst_id, locatie_id) WHERE vak_id IS NULL"
+        else:
+            conflict = "(ontvangst_id, locatie_id, vak_id)"
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {tabel} "
+                "(wijn_id, deelnemer_id, ontvangst_id, locatie_id, vak_id, aantal, aantal_rsv) "
+                "SELECT o.wijn_id, o.deelnemer_id, o.id, %s, %s, %s, 0 "
+                f"FROM {ontvangst_tabel} o WHERE o.id = %s "
+                f"ON CONFLICT {conflict} "
+                f"DO UPDATE SET aantal = {tabel}.aantal + excluded.aantal "
+                "RETURNING id, wijn_id, aantal",
+                [locatie_id, vak_id, delta, ontvangst_id],
             )
-        vrd.save()
-        vrd.refresh_from_db()
-        wijn = vrd.wijn
+            vrd_id, wijn_id, aantal = cursor.fetchone()
 
-        # if the stock is zero after the update, delete the stock entry
-        if vrd.aantal == 0:
-            vrd.delete()
-        # check if the wine can be closed or reopened
-        wijn.check_afsluiten()
+        if aantal == 0:
+            WijnVoorraad.objects.filter(pk=vrd_id, aantal=0).delete()
+            Wijn.afsluiten_na_commit(wijn_id)
+        elif aantal == delta:
+            # entries with aantal zero are deleted, so this is a new entry
+            Wijn.afsluiten_na_commit(wijn_id)
 
     @staticmethod
-    def Bijwerken_mutatie_UIT(mutatie: VoorraadMutatie):
-        try:
-            vrd = WijnVoorraad.objects.get(
-                ontvangst=mutatie.ontvangst,
-                locatie=mutatie.locatie,
-                vak=mutatie.vak,
+    def aantal_afboeken(ontvangst_id, locatie_id, vak_id, aantal):
+        """Lower the stock of an ontvangst on a locatie and vak by aantal, only when
+        there is enough stock.
+
+        Check and change are one conditional UPDATE, the database applies concurrent
+        updates of the same entry one after the other. Raises ValidationError when the
+        stock would become negative.
+        """
+        tabel = connection.ops.quote_name(WijnVoorraad._meta.db_table)
+        vak_conditie = "vak_id IS NULL" if vak_id is None else "vak_id = %s"
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {tabel} SET aantal = aantal - %s "
+                f"WHERE ontvangst_id = %s AND locatie_id = %s AND {vak_conditie} "
+                "AND aantal >= %s "
+                "RETURNING id, wijn_id, aantal",
+                [aantal, ontvangst_id, locatie_id]
+                + ([] if vak_id is None else [vak_id])
+                + [aantal],
             )
-            vrd.aantal = F("aantal") - mutatie.aantal
-        except WijnVoorraad.DoesNotExist:
-            vrd = WijnVoorraad(
-                wijn=mutatie.ontvangst.wijn,
-                deelnemer=mutatie.ontvangst.deelnemer,
-                ontvangst=mutatie.ontvangst,
-                locatie=mutatie.locatie,
-                vak=mutatie.vak,
-                aantal=-mutatie.aantal,
+            rij = cursor.fetchone()
+        if rij is None:
+            raise ValidationError(
+                ("Onjuiste mutatie. Hiermee wordt de voorraad negatief!")
             )
-
-        vrd.save()
-        vrd.refresh_from_db()
-        wijn = vrd.wijn
-        if vrd.aantal == 0:
-            vrd.delete()
-        wijn.check_afsluiten()
+        vrd_id, wijn_id, nieuw_aantal = rij
+        if nieuw_aantal == 0:
+            WijnVoorraad.objects.filter(pk=vrd_id, aantal=0).delete()
+            Wijn.afsluiten_na_commit(wijn_id)
 
     def verplaatsen(self, v_nieuwe_locatie, v_nieuwe_vak, v_aantal_verplaatsen):
         VoorraadMutatie.verplaatsen(
@@ -766,6 +1446,13 @@ class WijnVoorraad(models.Model):
     ):
 
         def find_and_check_voorraad(mutatie, wijziging_aantal):
+            if projectie.actief():
+                sleutel = (mutatie.ontvangst_id, mutatie.locatie_id, mutatie.vak_id)
+                if projectie.aantallen([sleutel])[sleutel] + wijziging_aantal < 0:
+                    raise ValidationError(
+                        ("Onjuiste mutatie. Hiermee wordt de voorraad negatief!")
+                    )
+                return
             try:
                 vrd = WijnVoorraad.objects.get(
                     ontvangst=mutatie.ontvangst,
@@ -872,7 +1559,7 @@ class WijnVoorraad(models.Model):
         # if it is an update to the same reservation,
         # the stock should be enough for the difference
         if is_update_to_same_not_processed_reservation():
-            if voorraad_old.aantal_rsv - aantal_old + aantal_new > voorraad_old.aantal:
+            if aantal_new - aantal_old > voorraad_old.aantal_beschikbaar:
                 raise ValidationError(
                     ("Onjuiste bestelling. Er is niet voldoende voorraad!")
                 )
@@ -880,13 +1567,27 @@ class WijnVoorraad(models.Model):
 
             if bestelling_regel is not None:
                 if voorraad_new is not None:
-                    if voorraad_new.aantal_rsv + aantal_new > voorraad_new.aantal:
+                    if aantal_new > voorraad_new.aantal_beschikbaar:
                         raise ValidationError(
                             ("Onjuiste bestelling. Er is niet voldoende voorraad!")
                         )
 
     @staticmethod
     def Bijwerken_rsv(new_regel: BestellingRegel, old_regel: BestellingRegel):
+        if (
+            old_regel is not None
+            and new_regel is not None
+            and old_regel.verwerkt == "N"
+            and new_regel.verwerkt == "N"
+            and old_regel.voorraad_sleutel == new_regel.voorraad_sleutel
+        ):
+            # a change of the same reservation: only the difference is reserved
+            WijnVoorraad.rsv_reserveren(
+                *new_regel.voorraad_sleutel,
+                new_regel.aantal_werkelijk - old_regel.aantal_werkelijk,
+            )
+            return
+
         if old_regel is not None:
             if old_regel.verwerkt == "N":
                 WijnVoorraad.Bijwerken_rsv_eraf(old_regel)
@@ -896,22 +1597,55 @@ class WijnVoorraad(models.Model):
                 WijnVoorraad.Bijwerken_rsv_erbij(new_regel)
 
     @staticmethod
-    def Bijwerken_rsv_erbij(regel: BestellingRegel):
-        try:
-            vrd = WijnVoorraad.objects.get(
-                ontvangst=regel.ontvangst,
-                locatie=regel.bestelling.vanLocatie,
-                vak=regel.vak,
+    def rsv_reserveren(ontvangst_id, locatie_id, vak_id, aantal):
+        """Reserve aantal bottles of a stock entry, only when they are available.
+
+        Check and change are one conditional UPDATE on aantal_beschikbaar, like
+        aantal_afboeken. Raises ValidationError when there is no stock entry or not
+        enough available stock. A negative aantal releases bottles without a check.
+        """
+        if not aantal:
+            return
+        voorraad = WijnVoorraad.objects.filter(
+            ontvangst_id=ontvangst_id, locatie_id=locatie_id, vak_id=vak_id
+        )
+        if aantal < 0:
+            voorraad.update(aantal_rsv=F("aantal_rsv") + aantal)
+            return
+        if voorraad.filter(aantal_beschikbaar__gte=aantal).update(
+            aantal_rsv=F("aantal_rsv") + aantal
+        ):
+            return
+        if voorraad.exists():
+            raise ValidationError(
+                ("Onjuiste bestelling. Er is niet voldoende voorraad!")
             )
+        raise ValidationError(("Onjuiste bestelling. Er is geen voorraad!"))
 
-            vrd.aantal_rsv = F("aantal_rsv") + regel.aantal_werkelijk
-            vrd.save()
-        except WijnVoorraad.DoesNotExist as e:
+    @staticmethod
+    def rsv_bijwerken(wijzigingen):
+        """Add the changes of aantal_rsv by (ontvangst_id, locatie_id, vak_id) with one
+        UPDATE. Like Bijwerken_rsv_eraf, a sleutel without stock entry is skipped."""
+        wijzigingen = {
+            sleutel: wijziging
+            for sleutel, wijziging in wijzigingen.items()
+            if wijziging
+        }
+        if not wijzigingen:
+            return
+        selectie = Q()
+        gevallen = []
+        for (ontvangst_id, locatie_id, vak_id), wijziging in wijzigingen.items():
+            sleutel = Q(ontvangst_id=ontvangst_id, locatie_id=locatie_id, vak_id=vak_id)
+            selectie |= sleutel
+            gevallen.append(When(sleutel, then=wijziging))
+        WijnVoorraad.objects.filter(selectie).update(
+            aantal_rsv=F("aantal_rsv") + Case(*gevallen)
+        )
 
-            if regel.aantal_werkelijk > 0:
-                raise ValidationError(
-                    ("Onjuiste bestelling. Er is geen voorraad!")
-                ) from e
+    @staticmethod
+    def Bijwerken_rsv_erbij(regel: BestellingRegel):
+        WijnVoorraad.rsv_reserveren(*regel.voorraad_sleutel, regel.aantal_werkelijk)
 
     @staticmethod
     def Bijwerken_rsv_eraf(regel: BestellingRegel):
@@ -930,9 +1664,176 @@ class WijnVoorraad(models.Model):
         ordering = ["wijn", "deelnemer", "locatie", "vak"]
         verbose_name = "Wijnvoorraad"
         verbose_name_plural = "wijnvoorraad"
+        indexes = [
+            # the orderable stock of a deelnemer on a locatie (bestelbaar)
+            models.Index(
+                fields=["deelnemer", "locatie", "aantal_beschikbaar"],
+                name="voorraad_beschikbaar_idx",
+            ),
+        ]
         constraints = [
             models.UniqueConstraint(
                 name="unique_wijnvoorraad",
                 fields=["ontvangst", "locatie", "vak"],
-            )
+            ),
+            models.UniqueConstraint(
+                name="unique_wijnvoorraad_zonder_vak",
+                fields=["ontvangst", "locatie"],
+                condition=Q(vak__isnull=True),
+            ),
+        ]
+
+
+class VoorraadMomentopname(models.Model):
+    """The stock per (ontvangst, locatie, vak) at the end of datum.
+
+    Written by the management command momentopname_vastleggen (monthly), so the stock
+    at an earlier date can be calculated from the nearest momentopname and the
+    mutations after it (see WijnVoorraadService.AantallenOpDatum). A momentopname is
+    always of a day in the past; when a mutation of that day or earlier is added,
+    changed or deleted, the momentopnamen from that day on are removed.
+    """
+
+    datum = models.DateField()
+    ontvangst = models.ForeignKey(Ontvangst, on_delete=models.CASCADE)
+    locatie = models.ForeignKey(Locatie, on_delete=models.CASCADE)
+    vak = models.ForeignKey(Vak, on_delete=models.CASCADE, null=True, blank=True)
+    aantal = models.IntegerField()
+
+    def __str__(self):
+        return f"{self.datum} - {self.ontvangst_id} - {self.locatie_id} - {self.aantal}"
+
+    @staticmethod
+    def ongeldig_maken(*datums):
+        """Remove the momentopnamen that include a mutation of one of the datums."""
+        datum_veld = VoorraadMutatie._meta.get_field("datum")
+        datums = [datum_veld.to_python(d) for d in datums if d is not None]
+        # mutations of today are never part of a momentopname, so no query for them
+        datums = [d for d in datums if d < date.today()]
+        if datums:
+            VoorraadMomentopname.objects.filter(datum__gte=min(datums)).delete()
+
+    class Meta:
+        ordering = ["datum", "ontvangst", "locatie", "vak"]
+        verbose_name_plural = "voorraadmomentopnamen"
+        indexes = [models.Index(fields=["datum"], name="momentopname_datum_idx")]
+
+
+class VoorraadMutatieArchiefQuerySet(QuerySet):
+    def fuzzy(self, fuzzy_selectie):
+        """As VoorraadMutatieQuerySet.fuzzy; the archive is not in the search index."""
+        if not fuzzy_selectie:
+            return self
+        return self.filter(
+            Q(omschrijving__in=zoekindex.omschrijvingen(self, fuzzy_selectie))
+            | zoekindex.ontvangst_q(fuzzy_selectie, "ontvangst__")
+        )
+
+    def met_relaties(self):
+        return self.select_related(
+            "ontvangst__wijn__wijnsoort", "ontvangst__deelnemer", "locatie", "vak"
+        )
+
+
+class VoorraadMutatieArchief(models.Model):
+    """A VoorraadMutatie of a wine that was closed long ago, moved out of the mutation
+    table by WijnVoorraadService.MutatiesArchiveren. The id is the id of the mutation.
+
+    The totals per ontvangst are kept in OntvangstArchief, so the checks do not have to
+    read the archive.
+    """
+
+    objects = VoorraadMutatieArchiefQuerySet.as_manager()
+    id = models.BigIntegerField(primary_key=True)
+    ontvangst = models.ForeignKey(Ontvangst, on_delete=models.PROTECT)
+    locatie = models.ForeignKey(Locatie, on_delete=models.PROTECT)
+    vak = models.ForeignKey(Vak, on_delete=models.PROTECT, null=True, blank=True)
+    in_uit = models.CharField(max_length=1, choices=VoorraadMutatie.in_uit_choices)
+    actie = models.CharField(max_length=1, choices=VoorraadMutatie.actie_choices)
+    datum = models.DateField()
+    aantal = models.IntegerField()
+    omschrijving = models.CharField(max_length=200, blank=True)
+
+    gearchiveerd = True
+
+    def __str__(self):
+        return f"{self.ontvangst_id} - {self.in_uit} - {self.datum} - {self.pk}"
+
+    class Meta:
+        ordering = ["ontvangst", "datum", "in_uit"]
+        verbose_name = "gearchiveerde voorraadmutatie"
+        verbose_name_plural = "gearchiveerde voorraadmutaties"
+        indexes = [
+            models.Index(fields=["datum", "id"], name="archief_datum_id_idx"),
         ]
+
+
+class OntvangstArchief(models.Model):
+    """Totals of the archived mutations (VoorraadMutatieArchief) of an ontvangst."""
+
+    ontvangst = models.OneToOneField(
+        Ontvangst, on_delete=models.PROTECT, primary_key=True
+    )
+    aantal_records_in = models.IntegerField(default=0)
+    aantal_in = models.IntegerField(default=0)
+    aantal_records_uit = models.IntegerField(default=0)
+    aantal_uit = models.IntegerField(default=0)
+    bijgewerkt = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.ontvangst_id}: in {self.aantal_in}, uit {self.aantal_uit}"
+
+    class Meta:
+        verbose_name_plural = "ontvangstarchieven"
+
+
+class VoorraadProjectie(models.Model):
+    """Checkpoint of the asynchronous stock projection (see projectie.py): the mutations
+    up to laatste_mutatie_id are applied on WijnVoorraad. There is at most one row."""
+
+    laatste_mutatie_id = models.BigIntegerField(default=0)
+    bijgewerkt = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.laatste_mutatie_id} ({self.bijgewerkt})"
+
+    class Meta:
+        verbose_name_plural = "voorraadprojecties"
+
+
+class ResultaatVersie(models.Model):
+    """Version number of the inventory for the cached result lists (see
+    resultaatcache.py). It is kept in the database so all processes of the web server
+    see the same version. There is at most one row."""
+
+    versie = models.BigIntegerField(default=1)
+
+    def __str__(self):
+        return str(self.versie)
+
+    class Meta:
+        verbose_name_plural = "resultaatversies"
+
+
+@receiver(m2m_changed, sender=Wijn.wijnDruivensoorten.through)
+def wijn_druivensoorten_gewijzigd(
+    sender, instance, action, reverse, pk_set, **kwargs
+):  # pylint: disable=unused-argument
+    """Keep the search index up to date when grapes are added to or removed from a wine.
+    add(), remove() and set() on wijnDruivensoorten do not call WijnDruivensoort.save().
+
+    clear() from the side of the grape gives no pk_set, so the wines of the grape are
+    remembered in pre_clear and updated in post_clear."""
+    if action == "pre_clear" and reverse:
+        wijnen = Wijn.objects.filter(wijnDruivensoorten=instance)
+        instance._wijn_ids_clear = list(wijnen.values_list("pk", flat=True))
+        return
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        instance.search_blob_bijwerken()
+        return
+    if action == "post_clear":
+        pk_set = instance.__dict__.pop("_wijn_ids_clear", None)
+    if pk_set:
+        zoekindex.wijnen_bijwerken(Wijn.objects.filter(pk__in=pk_set))
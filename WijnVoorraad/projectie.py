@@ -0,0 +1,278 @@
+"""Optional asynchronous projection of the mutations on the stock.
+
+Normally every VoorraadMutatie updates WijnVoorraad (and with it Wijn.datumAfgesloten)
+in the same transaction. With settings.VOORRAAD_PROJECTIE_ASYNC a new mutation is only
+inserted, and the projector, the management command ``projectie_verwerken``, applies
+the mutations later in batches, in the order of their ids. The checkpoint
+(VoorraadProjectie) holds the id of the last applied mutation.
+
+- Stock checks use the projected stock plus the mutations after the checkpoint
+  (aantallen), so a mutation is refused exactly as in the synchronous mode.
+- A change or delete of a mutation that is already projected is applied directly;
+  a mutation that is not projected yet is read by the projector as it is by then.
+- ProjectieMiddleware gives read-your-writes: a request of a user whose last mutation
+  is not projected yet, projects the open mutations first.
+- Reservations (WijnVoorraad.aantal_rsv) are still booked directly by BestellingRegel.
+
+Run ``projectie_opbouwen`` once before switching the mode on; it rebuilds WijnVoorraad
+from all mutations and sets the checkpoint. Before switching it off, run
+``projectie_verwerken`` until no mutations are left. On SQLite there is one writer at a
+time and ids are never reused (AUTOINCREMENT), so a mutation with an id at or below
+the checkpoint can not be committed after the checkpoint was set.
+"""
+
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Case, F, Max, Sum, When
+
+from . import resultaatcache
+
+BATCH_GROOTTE = 500
+
+# the last mutation left to the projector in this thread, see ProjectieMiddleware
+_uitgesteld = threading.local()
+
+
+def actief():
+    return getattr(settings, "VOORRAAD_PROJECTIE_ASYNC", False)
+
+
+def checkpoint():
+    """Id of the last projected mutation, None when the projection was never built."""
+    # pylint: disable=import-outside-toplevel
+    from .models import VoorraadProjectie
+
+    return (
+        VoorraadProjectie.objects.values_list("laatste_mutatie_id", flat=True)
+        .order_by()
+        .first()
+    )
+
+
+def uitgesteld(mutatie_id):
+    """Whether the stock change of the mutation is left to the projector.
+
+    Call it after the mutation is written, so the checkpoint can not move in between.
+    """
+    if not actief():
+        return False
+    laatste = checkpoint()
+    if laatste is None or mutatie_id <= laatste:
+        return False
+    _uitgesteld.mutatie_id = max(mutatie_id, getattr(_uitgesteld, "mutatie_id", 0) or 0)
+    return True
+
+
+def laatste_uitgesteld(vergeten=False):
+    """The last mutation left to the projector in this thread (and so this request)."""
+    mutatie_id = getattr(_uitgesteld, "mutatie_id", None)
+    if vergeten:
+        _uitgesteld.mutatie_id = None
+    return mutatie_id
+
+
+WIJZIGING = Case(When(in_uit="U", then=-F("aantal")), default=F("aantal"))
+
+
+def _wijzigingen(mutaties):
+    return {
+        (rij["ontvangst_id"], rij["locatie_id"], rij["vak_id"]): rij["wijziging"]
+        for rij in mutaties.order_by()
+        .values("ontvangst_id", "locatie_id", "vak_id")
+        .annotate(wijziging=Sum(WIJZIGING))
+    }
+
+
+def aantallen(sleutels):
+    """The stock by (ontvangst_id, locatie_id, vak_id) for sleutels: the projected
+    stock plus the mutations that are not projected yet."""
+    # pylint: disable=import-outside-toplevel
+    from .models import VoorraadMutatie, WijnVoorraad
+
+    sleutels = set(sleutels)
+    ontvangst_ids = {sleutel[0] for sleutel in sleutels}
+    locatie_ids = {sleutel[1] for sleutel in sleutels}
+    voorraad = WijnVoorraad.objects.voor_sleutels(sleutels)
+    openstaand = {}
+    laatste = checkpoint()
+    if laatste is not None:
+        openstaand = _wijzigingen(
+            VoorraadMutatie.objects.filter(
+                id__gt=laatste,
+                ontvangst_id__in=ontvangst_ids,
+                locatie_id__in=locatie_ids,
+            )
+        )
+    return {
+        sleutel: (voorraad[sleutel].aantal if sleutel in voorraad else 0)
+        + openstaand.get(sleutel, 0)
+        for sleutel in sleutels
+    }
+
+
+def controleren(sleutels):
+    """Raise a ValidationError when the stock of one of sleutels is negative,
+    including the mutations that are not projected yet."""
+    if any(aantal < 0 for aantal in aantallen(sleutels).values()):
+        raise ValidationError(("Onjuiste mutatie. Hiermee wordt de voorraad negatief!"))
+
+
+def openstaande_mutaties():
+    """The mutations that are not projected yet."""
+    # pylint: disable=import-outside-toplevel
+    from .models import VoorraadMutatie
+
+    if actief():
+        laatste = checkpoint()
+        if laatste is not None:
+            return VoorraadMutatie.objects.filter(id__gt=laatste)
+    return VoorraadMutatie.objects.none()
+
+
+def verwerkte(mutaties):
+    """Only the mutations that are part of the projected stock, to compare them with
+    WijnVoorraad (see WijnVoorraadService)."""
+    if actief():
+        laatste = checkpoint()
+        if laatste is not None:
+            return mutaties.filter(id__lte=laatste)
+    return mutaties
+
+
+def verwerken(batch_grootte=BATCH_GROOTTE):
+    """Apply the next batch of mutations on the stock and move the checkpoint.
+
+    The net change per stock entry is applied with WijnVoorraad.aantal_bijwerken, one
+    statement per entry. Returns the number of mutations applied.
+    """
+    # pylint: disable=import-outside-toplevel
+    from .models import VoorraadMutatie, VoorraadProjectie, WijnVoorraad
+
+    with transaction.atomic():
+        projectie = VoorraadProjectie.objects.select_for_update().order_by().first()
+        if projectie is None:
+            raise ValidationError("De projectie is nog niet opgebouwd")
+        ids = list(
+            VoorraadMutatie.objects.filter(id__gt=projectie.laatste_mutatie_id)
+            .order_by("id")
+            .values_list("id", flat=True)[:batch_grootte]
+        )
+        if not ids:
+            return 0
+        wijzigingen = _wijzigingen(VoorraadMutatie.objects.filter(id__in=ids))
+        for sleutel, wijziging in wijzigingen.items():
+            if wijziging:
+                WijnVoorraad.aantal_bijwerken(*sleutel, wijziging)
+        projectie.laatste_mutatie_id = ids[-1]
+        projectie.save()
+    resultaatcache.verhoog_versie()
+    return len(ids)
+
+
+def bijwerken_tot(mutatie_id, batch_grootte=BATCH_GROOTTE):
+    """Project until mutatie_id is applied, or no mutations are left."""
+    laatste = checkpoint()
+    while laatste is not None and laatste < mutatie_id:
+        if not verwerken(batch_grootte):
+            break
+        laatste = checkpoint()
+
+
+def opbouwen():
+    """Rebuild WijnVoorraad from all mutations and the open bestellingregels and set
+    the checkpoint to the last mutation. Returns the number of stock entries."""
+    # pylint: disable=import-outside-toplevel
+    from .models import (
+        BestellingRegel,
+        VoorraadMutatie,
+        VoorraadProjectie,
+        Wijn,
+        WijnVoorraad,
+    )
+
+    with transaction.atomic():
+        laatste = VoorraadMutatie.objects.aggregate(id=Max("id"))["id"] or 0
+        voorraad = {}
+        for rij in (
+            VoorraadMutatie.objects.filter(id__lte=laatste)
+            .order_by()
+            .values(
+                "ontvangst_id",
+                "ontvangst__wijn_id",
+                "ontvangst__deelnemer_id",
+                "locatie_id",
+                "vak_id",
+            )
+            .annotate(aantal=Sum(WIJZIGING))
+        ):
+            if rij["aantal"]:
+                sleutel = (rij["ontvangst_id"], rij["locatie_id"], rij["vak_id"])
+                voorraad[sleutel] = WijnVoorraad(
+                    wijn_id=rij["ontvangst__wijn_id"],
+                    deelnemer_id=rij["ontvangst__deelnemer_id"],
+                    ontvangst_id=rij["ontvangst_id"],
+                    locatie_id=rij["locatie_id"],
+                    vak_id=rij["vak_id"],
+                    aantal=rij["aantal"],
+                )
+        for rij in (
+            BestellingRegel.objects.filter(verwerkt="N")
+            .order_by()
+            .values("ontvangst_id", "bestelling__vanLocatie_id", "vak_id")
+            .annotate(
+                aantal_rsv=Sum(
+                    Case(
+                        When(aantal_correctie__isnull=False, then=F("aantal_correctie")),
+                        default=F("aantal"),
+                    )
+                )
+            )
+        ):
+            sleutel = (
+                rij["ontvangst_id"],
+                rij["bestelling__vanLocatie_id"],
+                rij["vak_id"],
+            )
+            # as in BijwerkenVrdOntvangst: no stock entry for a reservation only
+            if sleutel in voorraad:
+                voorraad[sleutel].aantal_rsv = rij["aantal_rsv"]
+
+        WijnVoorraad.objects.all().delete()
+        WijnVoorraad.objects.bulk_create(voorraad.values(), batch_size=500)
+        VoorraadProjectie.objects.all().delete()
+        VoorraadProjectie.objects.create(laatste_mutatie_id=laatste)
+
+        wijn_ids = list(Wijn.objects.order_by("pk").values_list("pk", flat=True))
+        for begin in range(0, len(wijn_ids), 500):
+            Wijn.afsluiten_bijwerken(*wijn_ids[begin : begin + 500])
+    resultaatcache.verhoog_versie()
+    return len(voorraad)
+
+
+class ProjectieMiddleware:
+    """Read-your-writes for the asynchronous projection.
+
+    The last mutation a user left to the projector is kept in the session; the next
+    request of that user first projects the open mutations up to it.
+    """
+
+    SESSIE_SLEUTEL = "projectie_mutatie_id"
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not actief():
+            return self.get_response(request)
+        mutatie_id = request.session.pop(self.SESSIE_SLEUTEL, None)
+        if mutatie_id is not None:
+            bijwerken_tot(mutatie_id)
+        laatste_uitgesteld(vergeten=True)
+        response = self.get_response(request)
+        mutatie_id = laatste_uitgesteld(vergeten=True)
+        if mutatie_id is not None:
+            request.session[self.SESSIE_SLEUTEL] = mutatie_id
+        return response
@@ -0,0 +1,63 @@
+"""Cache of the number of results of the paginated list views.
+
+The counts are stored per list and per filter state (deelnemer, locatie, wijnsoort,
+fuzzy selectie, sortering; see wijnvars.get_filter_status) together with a global
+version number of the inventory. Every write on wijnen, ontvangsten, mutaties, stock
+and bestellingregels increases that version, which makes all cached counts obsolete.
+A cached count replaces the COUNT query of the paginator, whatever the size of the
+list; the rows of a page are always read with the (indexed) queryset itself.
+
+The counts are kept in the Django cache, which can be a separate (local memory) cache
+per process. The version is kept in the database (ResultaatVersie), so a write in one
+process makes the counts cached by all other processes obsolete as well.
+"""
+
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.db.models import F
+
+RESULTAAT_TIMEOUT = 60 * 60
+
+
+def get_versie():
+    # pylint: disable=import-outside-toplevel
+    from .models import ResultaatVersie
+
+    return (
+        ResultaatVersie.objects.values_list("versie", flat=True).order_by().first()
+        or 1
+    )
+
+
+def verhoog_versie():
+    """Make all cached counts obsolete, called after every write that changes a list."""
+    # pylint: disable=import-outside-toplevel
+    from .models import ResultaatVersie
+
+    if not ResultaatVersie.objects.update(versie=F("versie") + 1):
+        # no version yet: any new value differs from the version 1 of get_versie
+        ResultaatVersie.objects.get_or_create(pk=1, defaults={"versie": 2})
+
+
+def resultaat_sleutel(lijst, filter_status, versie=None):
+    status = json.dumps(filter_status, sort_keys=True, default=str)
+    digest = hashlib.sha1(status.encode()).hexdigest()
+    if versie is None:
+        versie = get_versie()
+    return f"WijnVoorraad:aantal:{versie}:{lijst}:{digest}"
+
+
+def gecachte_aantal(lijst, filter_status, queryset):
+    """Number of rows of queryset, cached per list and filter state.
+
+    The COUNT query is only done on the first request for a filter state after a
+    write; the next pages and reloads only read the version.
+    """
+    sleutel = resultaat_sleutel(lijst, filter_status)
+    aantal = cache.get(sleutel)
+    if aantal is None:
+        aantal = queryset.count()
+        cache.set(sleutel, aantal, RESULTAAT_TIMEOUT)
+    return aantal
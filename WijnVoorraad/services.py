@@ -1,158 +1,211 @@
-from django.db.models import F, Sum, Count, Case, When
+from datetime import date, datetime
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import Exists, F, OuterRef, Q, Max, Sum, Count, Case, When
+
+from . import projectie, resultaatcache, zoekindex
 from .models import (
     AIUsage,
     Deelnemer,
     Locatie,
     Ontvangst,
+    OntvangstArchief,
     Vak,
     VoorraadMutatie,
+    VoorraadMutatieArchief,
     Wijn,
     WijnSoort,
     WijnVoorraad,
     Bestelling,
     BestellingRegel,
+    Verplaatsing,
+    VoorraadMomentopname,
+)
+
+# aantal_correctie when it is filled, otherwise aantal (BestellingRegel.aantal_werkelijk)
+AANTAL_WERKELIJK = Case(
+    When(aantal_correctie__isnull=False, then=F("aantal_correctie")),
+    default=F("aantal"),
 )
 
 
 class WijnVoorraadService:
 
     @staticmethod
-    def ControleerLocatie(locatie: Locatie):
-        vrd = WijnVoorraad.objects.filter(locatie=locatie).aggregate(
-            aantal_records=Count("id"),
-            tot_aantal_vrd=Sum("aantal"),
-            tot_aantal_rsv=Sum("aantal_rsv"),
-        )
-        mutaties_in = VoorraadMutatie.objects.filter(
-            locatie=locatie, in_uit="I"
-        ).aggregate(aantal_records=Count("id"), tot_aantal=Sum("aantal"))
-        mutaties_uit = VoorraadMutatie.objects.filter(
-            locatie=locatie, in_uit="U"
-        ).aggregate(
-            aantal_records=Count("id"),
-            tot_aantal=Sum("aantal"),
-        )
-        bestellingregels = BestellingRegel.objects.filter(
-            bestelling__vanLocatie=locatie,
-            verwerkt="N",
-        ).aggregate(
-            aantal_records=Count("id"),
-            tot_aantal=Sum(
-                Case(
-                    When(aantal_correctie__isnull=False, then=F("aantal_correctie")),
-                    default=F("aantal"),
-                )
-            ),
-        )
-
+    def _controle_vullen(obj, vrd, mutaties_in, mutaties_uit, bestellingregels):
+        """Sets the totals of the voorraad, mutaties and open bestellingregels on obj
+        (a Locatie or Ontvangst) and whether they match (klopt, klopt_rsv)."""
         # Always use 0 if None
-        locatie.aantal_records_vrd = vrd["aantal_records"] or 0
-        locatie.tot_aantal_vrd = vrd["tot_aantal_vrd"] or 0
-        locatie.tot_aantal_rsv = vrd["tot_aantal_rsv"] or 0
-        locatie.aantal_records_mut_in = mutaties_in["aantal_records"] or 0
-        locatie.tot_aantal_mut_in = mutaties_in["tot_aantal"] or 0
-        locatie.aantal_records_mut_uit = mutaties_uit["aantal_records"] or 0
-        locatie.tot_aantal_mut_uit = mutaties_uit["tot_aantal"] or 0
-        locatie.aantal_records_bst = bestellingregels["aantal_records"] or 0
-        locatie.tot_aantal_bst = bestellingregels["tot_aantal"] or 0
+        obj.aantal_records_vrd = vrd.get("aantal_records") or 0
+        obj.tot_aantal_vrd = vrd.get("tot_aantal_vrd") or 0
+        obj.tot_aantal_rsv = vrd.get("tot_aantal_rsv") or 0
+        obj.aantal_records_mut_in = mutaties_in.get("aantal_records") or 0
+        obj.tot_aantal_mut_in = mutaties_in.get("tot_aantal") or 0
+        obj.aantal_records_mut_uit = mutaties_uit.get("aantal_records") or 0
+        obj.tot_aantal_mut_uit = mutaties_uit.get("tot_aantal") or 0
+        obj.aantal_records_bst = bestellingregels.get("aantal_records") or 0
+        obj.tot_aantal_bst = bestellingregels.get("tot_aantal") or 0
 
         # Calculate difference
-        locatie.aantal_vrd_mut = locatie.tot_aantal_mut_in - locatie.tot_aantal_mut_uit
+        obj.aantal_vrd_mut = obj.tot_aantal_mut_in - obj.tot_aantal_mut_uit
 
-        # Determine if the location is correct
-        if locatie.tot_aantal_vrd == locatie.aantal_vrd_mut:
-            locatie.klopt = "Ja"
+        # Determine if the location or ontvangst is correct
+        if obj.tot_aantal_vrd == obj.aantal_vrd_mut:
+            obj.klopt = "Ja"
         else:
-            locatie.klopt = "Nee"
+            obj.klopt = "Nee"
 
-        if locatie.tot_aantal_rsv == locatie.tot_aantal_bst:
-            locatie.klopt_rsv = "Ja"
+        if obj.tot_aantal_rsv == obj.tot_aantal_bst:
+            obj.klopt_rsv = "Ja"
         else:
-            locatie.klopt_rsv = "Nee"
-
-        return locatie
+            obj.klopt_rsv = "Nee"
+        return obj
 
     @staticmethod
-    def ControleerAlleLocaties():
-        locaties = Locatie.objects.all()
-        locatie_list = []
-        for locatie in locaties:
-            WijnVoorraadService.ControleerLocatie(locatie)
-            if locatie.klopt == "Nee" or locatie.klopt_rsv == "Nee":
-                locatie_list.append(locatie)
-        return locatie_list
-
-    @staticmethod
-    def ControleerOntvangst(ontvangst: Ontvangst):
-        vrd = WijnVoorraad.objects.filter(ontvangst=ontvangst).aggregate(
-            aantal_records=Count("id"),
-            tot_aantal_vrd=Sum("aantal"),
-            tot_aantal_rsv=Sum("aantal_rsv"),
+    def _controle_totalen(voorraad, mutaties, bestellingregels):
+        """The aggregates of ControleerLocatie/ControleerOntvangst on the given querysets."""
+        # mutations that are not projected yet are not part of the voorraad
+        mutaties = projectie.verwerkte(mutaties)
+        return (
+            voorraad.aggregate(
+                aantal_records=Count("id"),
+                tot_aantal_vrd=Sum("aantal"),
+                tot_aantal_rsv=Sum("aantal_rsv"),
+            ),
+            mutaties.filter(in_uit="I").aggregate(
+                aantal_records=Count("id"), tot_aantal=Sum("aantal")
+            ),
+            mutaties.filter(in_uit="U").aggregate(
+                aantal_records=Count("id"), tot_aantal=Sum("aantal")
+            ),
+            bestellingregels.filter(verwerkt="N").aggregate(
+                aantal_records=Count("id"), tot_aantal=Sum(AANTAL_WERKELIJK)
+            ),
         )
-        mutaties_in = VoorraadMutatie.objects.filter(
-            ontvangst=ontvangst, in_uit="I"
-        ).aggregate(aantal_records=Count("id"), tot_aantal=Sum("aantal"))
-        mutaties_uit = VoorraadMutatie.objects.filter(
-            ontvangst=ontvangst, in_uit="U"
-        ).aggregate(
-            aantal_records=Count("id"),
-            tot_aantal=Sum("aantal"),
+
+    @staticmethod
+    def _archief_optellen(mutaties_in, mutaties_uit, archief: OntvangstArchief):
+        """The mutation totals of _controle_totalen plus the archived totals."""
+        if archief is None:
+            return mutaties_in, mutaties_uit
+        return (
+            {
+                "aantal_records": (mutaties_in.get("aantal_records") or 0)
+                + archief.aantal_records_in,
+                "tot_aantal": (mutaties_in.get("tot_aantal") or 0) + archief.aantal_in,
+            },
+            {
+                "aantal_records": (mutaties_uit.get("aantal_records") or 0)
+                + archief.aantal_records_uit,
+                "tot_aantal": (mutaties_uit.get("tot_aantal") or 0)
+                + archief.aantal_uit,
+            },
         )
-        bestellingregels = BestellingRegel.objects.filter(
-            ontvangst=ontvangst,
-            verwerkt="N",
-        ).aggregate(
-            aantal_records=Count("id"),
-            tot_aantal=Sum(
-                Case(
-                    When(aantal_correctie__isnull=False, then=F("aantal_correctie")),
-                    default=F("aantal"),
+
+    @staticmethod
+    def _alle_controleren(objecten, veld, bestellingregel_veld, archief=None):
+        """Checks all objecten with four grouped queries instead of four per object.
+
+        veld is the foreign key to the objecten on WijnVoorraad and VoorraadMutatie,
+        bestellingregel_veld the path to them from BestellingRegel. archief holds the
+        OntvangstArchief totals to add, by object id. Returns the objecten that do not
+        match.
+        """
+        vrd = {
+            rij[veld]: rij
+            for rij in WijnVoorraad.objects.values(veld)
+            .annotate(
+                aantal_records=Count("id"),
+                tot_aantal_vrd=Sum("aantal"),
+                tot_aantal_rsv=Sum("aantal_rsv"),
+            )
+            .order_by()
+        }
+        mutaties = {
+            (rij[veld], rij["in_uit"]): rij
+            for rij in projectie.verwerkte(VoorraadMutatie.objects.all())
+            .values(veld, "in_uit")
+            .annotate(aantal_records=Count("id"), tot_aantal=Sum("aantal"))
+            .order_by()
+        }
+        bestellingregels = {
+            rij[bestellingregel_veld]: rij
+            for rij in BestellingRegel.objects.filter(verwerkt="N")
+            .values(bestellingregel_veld)
+            .annotate(aantal_records=Count("id"), tot_aantal=Sum(AANTAL_WERKELIJK))
+            .order_by()
+        }
+        fout = []
+        for obj in objecten:
+            mutaties_in = mutaties.get((obj.id, "I"), {})
+            mutaties_uit = mutaties.get((obj.id, "U"), {})
+            if archief is not None:
+                mutaties_in, mutaties_uit = WijnVoorraadService._archief_optellen(
+                    mutaties_in, mutaties_uit, archief.get(obj.id)
                 )
+            WijnVoorraadService._controle_vullen(
+                obj,
+                vrd.get(obj.id, {}),
+                mutaties_in,
+                mutaties_uit,
+                bestellingregels.get(obj.id, {}),
+            )
+            if obj.klopt == "Nee" or obj.klopt_rsv == "Nee":
+                fout.append(obj)
+        return fout
+
+    @staticmethod
+    def ControleerLocatie(locatie: Locatie):
+        return WijnVoorraadService._controle_vullen(
+            locatie,
+            *WijnVoorraadService._controle_totalen(
+                WijnVoorraad.objects.filter(locatie=locatie),
+                VoorraadMutatie.objects.filter(locatie=locatie),
+                BestellingRegel.objects.filter(bestelling__vanLocatie=locatie),
             ),
         )
 
-        # Always use 0 if None
-        ontvangst.aantal_records_vrd = vrd["aantal_records"] or 0
-        ontvangst.tot_aantal_vrd = vrd["tot_aantal_vrd"] or 0
-        ontvangst.tot_aantal_rsv = vrd["tot_aantal_rsv"] or 0
-        ontvangst.aantal_records_mut_in = mutaties_in["aantal_records"] or 0
-        ontvangst.tot_aantal_mut_in = mutaties_in["tot_aantal"] or 0
-        ontvangst.aantal_records_mut_uit = mutaties_uit["aantal_records"] or 0
-        ontvangst.tot_aantal_mut_uit = mutaties_uit["tot_aantal"] or 0
-        ontvangst.aantal_records_bst = bestellingregels["aantal_records"] or 0
-        ontvangst.tot_aantal_bst = bestellingregels["tot_aantal"] or 0
-
-        # Calculate difference
-        ontvangst.aantal_vrd_mut = (
-            ontvangst.tot_aantal_mut_in - ontvangst.tot_aantal_mut_uit
+    @staticmethod
+    def ControleerAlleLocaties():
+        return WijnVoorraadService._alle_controleren(
+            Locatie.objects.all(), "locatie", "bestelling__vanLocatie"
         )
-        # Determine if the ontvangst is correct
-        if ontvangst.tot_aantal_vrd == ontvangst.aantal_vrd_mut:
-            ontvangst.klopt = "Ja"
-        else:
-            ontvangst.klopt = "Nee"
-
-        if ontvangst.tot_aantal_rsv == ontvangst.tot_aantal_bst:
-            ontvangst.klopt_rsv = "Ja"
-        else:
-            ontvangst.klopt_rsv = "Nee"
 
-        return ontvangst
+    @staticmethod
+    def ControleerOntvangst(ontvangst: Ontvangst, met_archief=False):
+        """With met_archief the archived mutations (OntvangstArchief) count too."""
+        vrd, mutaties_in, mutaties_uit, bestellingregels = (
+            WijnVoorraadService._controle_totalen(
+                WijnVoorraad.objects.filter(ontvangst=ontvangst),
+                VoorraadMutatie.objects.filter(ontvangst=ontvangst),
+                BestellingRegel.objects.filter(ontvangst=ontvangst),
+            )
+        )
+        if met_archief:
+            mutaties_in, mutaties_uit = WijnVoorraadService._archief_optellen(
+                mutaties_in,
+                mutaties_uit,
+                OntvangstArchief.objects.filter(ontvangst=ontvangst).first(),
+            )
+        return WijnVoorraadService._controle_vullen(
+            ontvangst, vrd, mutaties_in, mutaties_uit, bestellingregels
+        )
 
     @staticmethod
-    def ControleerAlleOntvangsten():
-        ontvangsten = Ontvangst.objects.all()
-        ontvangst_list = []
-        for ontvangst in ontvangsten:
-            WijnVoorraadService.ControleerOntvangst(ontvangst)
-            if ontvangst.klopt == "Nee" or ontvangst.klopt_rsv == "Nee":
-                ontvangst_list.append(ontvangst)
-        return ontvangst_list
+    def ControleerAlleOntvangsten(met_archief=False):
+        return WijnVoorraadService._alle_controleren(
+            Ontvangst.objects.met_relaties(),
+            "ontvangst",
+            "ontvangst",
+            OntvangstArchief.objects.in_bulk() if met_archief else None,
+        )
 
     @staticmethod
     def BijwerkenVrdOntvangst(ontvangst: Ontvangst):
+        mutaties = projectie.verwerkte(VoorraadMutatie.objects.all())
         locaties_en_vakken = (
-            VoorraadMutatie.objects.filter(ontvangst=ontvangst)
+            mutaties.filter(ontvangst=ontvangst)
             .values("locatie", "vak")
             .distinct()
         )
@@ -162,12 +215,12 @@ class WijnVoorraadService:
                 vak = Vak.objects.get(id=loc_en_vak["vak"])
             else:
                 vak = None
-            mut_in = VoorraadMutatie.objects.filter(
+            mut_in = mutaties.filter(
                 ontvangst=ontvangst, in_uit="I", locatie=locatie, vak=vak
             ).aggregate(
                 tot_aantal_mut_in=Sum("aantal", default=0),
             )
-            mut_uit = VoorraadMutatie.objects.filter(
+            mut_uit = mutaties.filter(
                 ontvangst=ontvangst,
                 in_uit="U",
                 locatie=locatie,
@@ -221,7 +274,389 @@ class WijnVoorraadService:
                         aantal_rsv=aantal_rsv,
                     )
             vrd.save()
-            vrd.refresh_from_db()
-            wijn = vrd.wijn
-            wijn.check_afsluiten()
+            Wijn.afsluiten_na_commit(vrd.wijn_id)
         return
+
+    @staticmethod
+    def AllesVerplaatsenSelectie(
+        van_locatie, naar_locatie, van_vak=None, naar_vak=None, deelnemer=None, wijnsoort=None
+    ):
+        """The stock entries moved by AllesVerplaatsen: all stock of van_locatie (or only
+        of van_vak), optionally of one deelnemer or wijnsoort. Entries that are already
+        on the target are left out."""
+        selectie = WijnVoorraad.objects.filter(locatie=van_locatie, aantal__gt=0)
+        if van_vak is not None:
+            selectie = selectie.filter(vak=van_vak)
+        if deelnemer is not None:
+            selectie = selectie.filter(deelnemer=deelnemer)
+        if wijnsoort is not None:
+            selectie = selectie.filter(wijn__wijnsoort=wijnsoort)
+        if naar_locatie == van_locatie:
+            selectie = selectie.exclude(vak=naar_vak)
+        return selectie
+
+    @staticmethod
+    def _alles_verplaatsen_controleren(voorraden, van_locatie, naar_locatie, naar_vak):
+        """Raise a ValidationError when the open reservations on the voorraden can not
+        follow the bottles."""
+        gereserveerd = [vrd for vrd in voorraden if vrd.aantal_rsv > 0]
+        if not gereserveerd:
+            return
+        if naar_locatie != van_locatie:
+            # a reservation is always on the vanLocatie of its bestelling
+            raise ValidationError(
+                "Er zijn flessen gereserveerd voor een bestelling. "
+                "Deze kunnen alleen binnen dezelfde locatie worden verplaatst!"
+            )
+        verplaatst = {(vrd.ontvangst_id, vrd.vak_id) for vrd in gereserveerd}
+        sleutels = set()
+        for regel in BestellingRegel.objects.filter(
+            bestelling__vanLocatie=van_locatie,
+            ontvangst_id__in={ontvangst_id for ontvangst_id, _ in verplaatst},
+        ).values("bestelling_id", "ontvangst_id", "vak_id", "verwerkt"):
+            vak_id = regel["vak_id"]
+            if regel["verwerkt"] == "N" and (regel["ontvangst_id"], vak_id) in verplaatst:
+                vak_id = naar_vak.id if naar_vak is not None else None
+            sleutel = (regel["bestelling_id"], regel["ontvangst_id"], vak_id)
+            if sleutel in sleutels:
+                raise ValidationError(
+                    "Een bestelling heeft deze wijn al op het nieuwe vak. "
+                    "Pas eerst de bestelling aan!"
+                )
+            sleutels.add(sleutel)
+
+    @staticmethod
+    def AllesVerplaatsenVoorbeeld(
+        van_locatie, naar_locatie, van_vak=None, naar_vak=None, deelnemer=None, wijnsoort=None
+    ):
+        """Preview of AllesVerplaatsen: the selected stock, the totals, the use of the
+        capacity of naar_vak and the reason (fout) when the move is not possible."""
+        voorraden = list(
+            WijnVoorraadService.AllesVerplaatsenSelectie(
+                van_locatie, naar_locatie, van_vak, naar_vak, deelnemer, wijnsoort
+            ).select_related("wijn", "deelnemer", "vak")
+        )
+        voorbeeld = {
+            "voorraden": voorraden,
+            "aantal_regels": len(voorraden),
+            "aantal_flessen": sum(vrd.aantal for vrd in voorraden),
+            "aantal_rsv": sum(vrd.aantal_rsv for vrd in voorraden),
+            "fout": None,
+        }
+        if naar_vak is not None:
+            in_gebruik = WijnVoorraad.objects.filter(vak=naar_vak).aggregate(
+                aantal=Sum("aantal", default=0)
+            )["aantal"]
+            voorbeeld["capaciteit"] = naar_vak.capaciteit
+            voorbeeld["in_gebruik"] = in_gebruik
+            voorbeeld["na_verplaatsen"] = in_gebruik + voorbeeld["aantal_flessen"]
+            voorbeeld["past"] = voorbeeld["na_verplaatsen"] <= naar_vak.capaciteit
+        try:
+            WijnVoorraadService._alles_verplaatsen_controleren(
+                voorraden, van_locatie, naar_locatie, naar_vak
+            )
+        except ValidationError as e:
+            voorbeeld["fout"] = e.message
+        return voorbeeld
+
+    @staticmethod
+    def AllesVerplaatsen(
+        van_locatie, naar_locatie, van_vak=None, naar_vak=None, deelnemer=None, wijnsoort=None
+    ):
+        """Move all selected stock (see AllesVerplaatsenSelectie) to naar_locatie and
+        naar_vak in one transaction and return the number of bottles moved.
+
+        The VERPLAATSING mutations are booked together with verplaatsen_lijst. Open
+        bestellingregels on the moved stock are re-pointed to naar_vak, together with
+        their reserved bottles.
+        """
+        with transaction.atomic():
+            voorraden = list(
+                WijnVoorraadService.AllesVerplaatsenSelectie(
+                    van_locatie, naar_locatie, van_vak, naar_vak, deelnemer, wijnsoort
+                ).select_related("ontvangst", "vak")
+            )
+            if not voorraden:
+                return 0
+            WijnVoorraadService._alles_verplaatsen_controleren(
+                voorraden, van_locatie, naar_locatie, naar_vak
+            )
+            VoorraadMutatie.verplaatsen_lijst(
+                [
+                    Verplaatsing(
+                        vrd.ontvangst,
+                        van_locatie,
+                        vrd.vak,
+                        naar_locatie,
+                        naar_vak,
+                        vrd.aantal,
+                    )
+                    for vrd in voorraden
+                ]
+            )
+            gereserveerd = [vrd for vrd in voorraden if vrd.aantal_rsv > 0]
+            if gereserveerd:
+                regels = Q()
+                for vrd in gereserveerd:
+                    regels |= Q(ontvangst_id=vrd.ontvangst_id, vak_id=vrd.vak_id)
+                BestellingRegel.objects.filter(
+                    regels, verwerkt="N", bestelling__vanLocatie=van_locatie
+                ).update(vak=naar_vak)
+                for vrd in gereserveerd:
+                    WijnVoorraad.objects.filter(
+                        ontvangst_id=vrd.ontvangst_id, locatie=naar_locatie, vak=naar_vak
+                    ).update(aantal_rsv=F("aantal_rsv") + vrd.aantal_rsv)
+        resultaatcache.verhoog_versie()
+        return sum(vrd.aantal for vrd in voorraden)
+
+    @staticmethod
+    def BestellingRegelsReserveren(bestelling: Bestelling, aantallen):
+        """Set the regels of bestelling to aantallen and return the number of regels
+        added, changed or deleted.
+
+        aantallen maps (ontvangst_id, vak_id) to the aantal to order, or None to
+        remove the regel; regels that are not in aantallen are left alone. The regels
+        are read once and the net change of aantal_rsv per stock entry is applied
+        first: released bottles with one UPDATE, each extra reservation with the
+        conditional UPDATE of WijnVoorraad.rsv_reserveren, which is the availability
+        check. Then the regels are written, in the same transaction, with one close
+        check of the bestelling at the end.
+        """
+        locatie_id = bestelling.vanLocatie_id
+        with transaction.atomic():
+            regels = BestellingRegel.objects.filter(bestelling=bestelling).per_sleutel()
+            nieuw, gewijzigd, verwijderd = [], [], []
+            rsv = {}
+            for (ontvangst_id, vak_id), aantal in aantallen.items():
+                regel = regels.get((ontvangst_id, vak_id))
+                if regel is None:
+                    if aantal is None:
+                        continue
+                    regel = BestellingRegel(
+                        bestelling=bestelling,
+                        ontvangst_id=ontvangst_id,
+                        vak_id=vak_id,
+                        aantal=aantal,
+                        opmerking="",
+                    )
+                    wijziging = regel.aantal_werkelijk
+                    nieuw.append(regel)
+                elif aantal == regel.aantal:
+                    continue
+                else:
+                    if regel.verwerkt != BestellingRegel.NIET:
+                        raise ValidationError(
+                            "Onjuiste bestelling. Afgeboekte of verwerkte bestelling "
+                            "kan niet worden aangepast!"
+                        )
+                    wijziging = -regel.aantal_werkelijk
+                    if aantal is None:
+                        verwijderd.append(regel)
+                    else:
+                        regel.aantal = aantal
+                        wijziging += regel.aantal_werkelijk
+                        gewijzigd.append(regel)
+                sleutel = (ontvangst_id, locatie_id, vak_id)
+                rsv[sleutel] = rsv.get(sleutel, 0) + wijziging
+
+            WijnVoorraad.rsv_bijwerken(
+                {
+                    sleutel: wijziging
+                    for sleutel, wijziging in rsv.items()
+                    if wijziging < 0
+                }
+            )
+            for sleutel, wijziging in rsv.items():
+                if wijziging > 0:
+                    WijnVoorraad.rsv_reserveren(*sleutel, wijziging)
+
+            BestellingRegel.objects.bulk_create(nieuw)
+            BestellingRegel.objects.bulk_update(gewijzigd, ["aantal"])
+            BestellingRegel.objects.filter(
+                pk__in=[regel.pk for regel in verwijderd]
+            ).delete()
+            Bestelling.objects.filter(pk=bestelling.pk).totalen_herberekenen()
+            bestelling.check_afsluiten()
+        resultaatcache.verhoog_versie()
+        return len(nieuw) + len(gewijzigd) + len(verwijderd)
+
+    @staticmethod
+    def AantallenOpDatum(datum, locatie=None, deelnemer=None):
+        """The stock at the end of datum by (ontvangst_id, locatie_id, vak_id).
+
+        Starts from the last VoorraadMomentopname on or before datum and adds the
+        mutations after it, so only the mutations since that momentopname are read.
+        """
+        selectie = Q()
+        if locatie is not None:
+            selectie &= Q(locatie=locatie)
+        if deelnemer is not None:
+            selectie &= Q(ontvangst__deelnemer=deelnemer)
+        basis = VoorraadMomentopname.objects.filter(datum__lte=datum).aggregate(
+            datum=Max("datum")
+        )["datum"]
+
+        aantallen = {}
+        periode = Q(datum__lte=datum)
+        if basis is not None:
+            for ontvangst_id, locatie_id, vak_id, aantal in (
+                VoorraadMomentopname.objects.filter(selectie, datum=basis)
+                .order_by()
+                .values_list("ontvangst_id", "locatie_id", "vak_id", "aantal")
+            ):
+                aantallen[(ontvangst_id, locatie_id, vak_id)] = aantal
+            periode &= Q(datum__gt=basis)
+        # archived mutations are part of the history as well
+        for mutaties in (VoorraadMutatie.objects, VoorraadMutatieArchief.objects):
+            for rij in (
+                mutaties.filter(selectie, periode)
+                .order_by()
+                .values("ontvangst_id", "locatie_id", "vak_id")
+                .annotate(
+                    aantal=Sum(
+                        Case(When(in_uit="U", then=-F("aantal")), default=F("aantal"))
+                    )
+                )
+            ):
+                sleutel = (rij["ontvangst_id"], rij["locatie_id"], rij["vak_id"])
+                aantallen[sleutel] = aantallen.get(sleutel, 0) + rij["aantal"]
+        return {sleutel: aantal for sleutel, aantal in aantallen.items() if aantal}
+
+    @staticmethod
+    def VoorraadOpDatum(datum, locatie=None, deelnemer=None):
+        """The stock at the end of datum as a list of dicts with ontvangst, locatie,
+        vak and aantal, sorted on wine."""
+        aantallen = WijnVoorraadService.AantallenOpDatum(datum, locatie, deelnemer)
+        ontvangsten = Ontvangst.objects.met_relaties().in_bulk(
+            {ontvangst_id for ontvangst_id, _, _ in aantallen}
+        )
+        locaties = Locatie.objects.in_bulk({locatie_id for _, locatie_id, _ in aantallen})
+        vakken = Vak.objects.in_bulk(
+            {vak_id for _, _, vak_id in aantallen if vak_id is not None}
+        )
+        regels = [
+            {
+                "ontvangst": ontvangsten[ontvangst_id],
+                "locatie": locaties[locatie_id],
+                "vak": vakken.get(vak_id),
+                "aantal": aantal,
+            }
+            for (ontvangst_id, locatie_id, vak_id), aantal in aantallen.items()
+        ]
+        regels.sort(
+            key=lambda r: (
+                r["ontvangst"].wijn.volle_naam,
+                r["ontvangst"].id,
+                r["locatie"].omschrijving,
+                r["vak"].code if r["vak"] else "",
+            )
+        )
+        return regels
+
+    @staticmethod
+    def MomentopnameVastleggen(datum):
+        """Write the VoorraadMomentopname of datum (a day in the past) and return the
+        number of rows. An existing momentopname of datum is replaced."""
+        if datum >= date.today():
+            raise ValidationError("Een momentopname kan alleen van een eerdere dag")
+        aantallen = WijnVoorraadService.AantallenOpDatum(datum)
+        with transaction.atomic():
+            VoorraadMomentopname.objects.filter(datum=datum).delete()
+            VoorraadMomentopname.objects.bulk_create(
+                [
+                    VoorraadMomentopname(
+                        datum=datum,
+                        ontvangst_id=ontvangst_id,
+                        locatie_id=locatie_id,
+                        vak_id=vak_id,
+                        aantal=aantal,
+                    )
+                    for (ontvangst_id, locatie_id, vak_id), aantal in aantallen.items()
+                ],
+                batch_size=500,
+            )
+        return len(aantallen)
+
+    @staticmethod
+    def MutatiesArchiveren(grens: date):
+        """Move the mutations of the ontvangsten of wines closed before grens to
+        VoorraadMutatieArchief, add their totals to OntvangstArchief and return the
+        number of ontvangsten and mutations archived.
+
+        All mutations of such an ontvangst are archived, so its stock per locatie and
+        vak stays zero in the mutation table. Ontvangsten with stock, or with mutations
+        that are not projected yet (see projectie.py), are skipped.
+        """
+        ontvangsten = (
+            Ontvangst.objects.filter(
+                wijn__datumAfgesloten__lt=datetime.combine(grens, datetime.min.time())
+            )
+            .exclude(Exists(WijnVoorraad.objects.filter(ontvangst=OuterRef("pk"))))
+            .exclude(
+                Exists(
+                    projectie.openstaande_mutaties().filter(ontvangst=OuterRef("pk"))
+                )
+            )
+        )
+        mutaties = VoorraadMutatie.objects.filter(ontvangst__in=ontvangsten).order_by()
+        velden = (
+            "id",
+            "ontvangst_id",
+            "locatie_id",
+            "vak_id",
+            "in_uit",
+            "actie",
+            "datum",
+            "aantal",
+            "omschrijving",
+        )
+        opties = VoorraadMutatieArchief._meta
+        kolommen = ", ".join(
+            connection.ops.quote_name(opties.get_field(veld).column) for veld in velden
+        )
+        with transaction.atomic():
+            totalen = list(
+                mutaties.values("ontvangst_id").annotate(
+                    aantal_records_in=Count("id", filter=Q(in_uit="I")),
+                    aantal_in=Sum("aantal", filter=Q(in_uit="I"), default=0),
+                    aantal_records_uit=Count("id", filter=Q(in_uit="U")),
+                    aantal_uit=Sum("aantal", filter=Q(in_uit="U"), default=0),
+                )
+            )
+            if not totalen:
+                return {"ontvangsten": 0, "mutaties": 0}
+            mutatie_ids = list(mutaties.values_list("id", flat=True))
+
+            # one INSERT ... SELECT, the mutations are not loaded
+            select, params = mutaties.values_list(*velden).query.sql_with_params()
+            archief_tabel = connection.ops.quote_name(opties.db_table)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {archief_tabel} ({kolommen}) {select}", params
+                )
+
+            bestaand = OntvangstArchief.objects.in_bulk(
+                [rij["ontvangst_id"] for rij in totalen]
+            )
+            nieuw = []
+            for rij in totalen:
+                archief = bestaand.get(rij["ontvangst_id"])
+                if archief is None:
+                    nieuw.append(OntvangstArchief(**rij))
+                    continue
+                archief.aantal_records_in += rij["aantal_records_in"]
+                archief.aantal_in += rij["aantal_in"]
+                archief.aantal_records_uit += rij["aantal_records_uit"]
+                archief.aantal_uit += rij["aantal_uit"]
+            OntvangstArchief.objects.bulk_create(nieuw)
+            OntvangstArchief.objects.bulk_update(
+                bestaand.values(),
+                ["aantal_records_in", "aantal_in", "aantal_records_uit", "aantal_uit"],
+            )
+
+            # QuerySet.delete() does not call VoorraadMutatie.delete(): the stock of
+            # these ontvangsten is zero and stays zero
+            mutaties.delete()
+            zoekindex.mutaties_verwijderen(mutatie_ids)
+        resultaatcache.verhoog_versie()
+        return {"ontvangsten": len(totalen), "mutaties": len(mutatie_ids)}
@@ -0,0 +1,38 @@
+// "Meer laden" for lists with keyset pagination: the next rows are fetched as an HTML
+// fragment (?partial=1) and appended to the table, on click or when the link scrolls
+// into view. Without javascript the link opens the next page.
+document.addEventListener('DOMContentLoaded', function () {
+    const link = document.getElementById('meer_laden');
+    if (!link) return;
+    const regels = document.getElementById(link.dataset.regels);
+    let bezig = false;
+    let observer = null;
+
+    function laden(event) {
+        if (event) event.preventDefault();
+        if (bezig || !regels) return;
+        bezig = true;
+        const url = new URL(link.href, window.location.href);
+        url.searchParams.set('partial', '1');
+        fetch(url, { headers: { 'X-Requested-With': 'XMLHttpRequest' } })
+            .then(r => r.json())
+            .then(data => {
+                regels.insertAdjacentHTML('beforeend', data.html);
+                if (data.volgende_url) {
+                    link.href = data.volgende_url;
+                } else {
+                    if (observer) observer.disconnect();
+                    link.remove();
+                }
+            })
+            .finally(() => { bezig = false; });
+    }
+
+    link.addEventListener('click', laden);
+    if ('IntersectionObserver' in window) {
+        observer = new IntersectionObserver(entries => {
+            if (entries.some(e => e.isIntersecting)) laden();
+        });
+        observer.observe(link);
+    }
+});
@@ -16,6 +16,7 @@ from WijnVoorraad.models import (
     DruivenSoort,
     Wijn,
     Ontvangst,
+    VoorraadMutatie,
 )
 
 
@@ -123,3 +124,19 @@ class SharedTestDataMixin:
         vak = Vak.objects.create(locatie=locatie, code=code, capaciteit=capaciteit)
         vak.save()
         return vak
+
+    def create_voorraad(self, aantal, ontvangst=None, locatie=None, vak=None):
+        """
+        Helper to book stock with an IN mutation, so the WijnVoorraad is updated as usual.
+        """
+        mutatie = VoorraadMutatie(
+            ontvangst=ontvangst or self.ontvangst,
+            locatie=locatie or self.locatie,
+            vak=vak,
+            in_uit="I",
+            actie="K",
+            datum=timezone.now().date(),
+            aantal=aantal,
+        )
+        mutatie.save()
+        return mutatie
@@ -1,13 +1,22 @@
 """unit tests for the Bestelling model."""
 
 import datetime
+from io import StringIO
 from unittest.mock import patch
 
+from django.core.management import call_command
+from django.core.exceptions import ValidationError
 from django.db import IntegrityError
 from django.test import TestCase
 from django.utils import timezone
 
-from WijnVoorraad.models import Bestelling, Deelnemer, Locatie
+from WijnVoorraad.models import (
+    Bestelling,
+    Deelnemer,
+    Locatie,
+    VoorraadMutatie,
+    WijnVoorraad,
+)
 from WijnVoorraad.tests.models.model_helper import SharedTestDataMixin
 
 
@@ -79,40 +88,55 @@ class TestBestelling(SharedTestDataMixin, TestCase):
         )
         self.assertEqual(str(bestelling), expected)
 
-    def test_afboeken_calls_afboeken_for_all_regels_verzameld(self):
-        """Test that afboeken calls afboeken for all regels in the bestelling."""
+    def test_afboeken_books_off_all_regels_verzameld(self):
+        """Test that afboeken books off the collected, unprocessed regels at once,
+        with the same result as BestellingRegel.afboeken for each of them."""
+        self.create_voorraad(10)
+        self.create_voorraad(4, vak=self.vak_a1)
         bestelling = self.create_bestelling(opmerking="Test bestelling")
+        verzameld = self.create_bestellingregel(
+            bestelling, aantal=2, is_verzameld=True
+        )
+        leeg = self.create_bestellingregel(
+            bestelling, vak=self.vak_a1, aantal=4, is_verzameld=True
+        )
+        niet_verzameld = self.create_bestelling(opmerking="Ander")
+        open_regel = self.create_bestellingregel(niet_verzameld, aantal=3)
 
-        # Create some regels for the bestelling
-        with (
-            patch("WijnVoorraad.models.BestellingRegel.afboeken") as mock_afboeken,
-            patch(
-                "WijnVoorraad.models.WijnVoorraad.Bijwerken_rsv_erbij",
-                return_value=None,
-            ),
-        ):
-            # Create some regels for the bestelling (mock is active here)
-            self.create_bestellingregel(
-                bestelling, ontvangst=self.ontvangst, aantal=2, is_verzameld=True
-            )
-            self.create_bestellingregel(
-                bestelling, ontvangst=self.ontvangst, aantal=4, is_verzameld=True
-            )
-            self.create_bestellingregel(
-                bestelling, ontvangst=self.ontvangst, aantal=2, is_verzameld=False
-            )
-            self.create_bestellingregel(
-                bestelling,
-                ontvangst=self.ontvangst,
-                aantal=4,
-                is_verzameld=True,
-                verwerkt="A",
-            )
+        with self.captureOnCommitCallbacks(execute=True):
+            bestelling.afboeken()
+
+        mutaties = VoorraadMutatie.objects.filter(actie="A").order_by("aantal")
+        self.assertEqual(
+            [(m.in_uit, m.vak_id, m.aantal, m.omschrijving) for m in mutaties],
+            [("U", None, 2, "Afboeken"), ("U", self.vak_a1.id, 4, "Afboeken")],
+        )
+        voorraad = WijnVoorraad.objects.get(ontvangst=self.ontvangst, vak=None)
+        self.assertEqual((voorraad.aantal, voorraad.aantal_rsv), (8, 3))
+        self.assertFalse(WijnVoorraad.objects.filter(vak=self.vak_a1).exists())
+        for regel, verwerkt in ((verzameld, "A"), (leeg, "A"), (open_regel, "N")):
+            regel.refresh_from_db()
+            self.assertEqual(regel.verwerkt, verwerkt)
+        bestelling.refresh_from_db()
+        self.assertIsNotNone(bestelling.datumAfgesloten)
+        self.assertEqual(
+            (bestelling.aantal_verzameld, bestelling.aantal_verwerkt), (0, 6)
+        )
+        self.assertEqual(Bestelling.objects.totalen_herberekenen(), 0)
 
-            # Call afboeken on the bestelling
+    def test_afboeken_with_too_little_stock_books_nothing(self):
+        """Test that afboeken is all or nothing."""
+        self.create_voorraad(2)
+        bestelling = self.create_bestelling()
+        regel = self.create_bestellingregel(bestelling, aantal=2, is_verzameld=True)
+        WijnVoorraad.objects.update(aantal=1)
+
+        with self.assertRaises(ValidationError):
             bestelling.afboeken()
-            # Check that afboeken was called for each regel
-            self.assertEqual(mock_afboeken.call_count, 2)
+
+        regel.refresh_from_db()
+        self.assertEqual(regel.verwerkt, "N")
+        self.assertEqual(WijnVoorraad.objects.get().aantal_rsv, 2)
 
     def test_bestellingen_with_regels_are_ordered(self):
         """Test that Bestellingen with regels are ordered by datumAangemaakt,
@@ -247,3 +271,86 @@ class TestBestelling(SharedTestDataMixin, TestCase):
 
         # Check that datumAfgesloten is set to today
         self.assertEqual(bestelling.datumAfgesloten, timezone.now().date())
+
+    @patch("WijnVoorraad.models.WijnVoorraad.Bijwerken_rsv_erbij", return_value=True)
+    def test_met_totalen_reads_stored_totals_in_one_query(self, _):
+        """Test that the totals are kept on Bestelling by its regels, so met_totalen
+        lists them with one query, counting aantal_correctie instead of aantal when it
+        is filled."""
+        bestelling = self.create_bestelling()
+        leeg = self.create_bestelling(opmerking="Zonder regels")
+        vak = self.create_vak("B1", 10)
+        self.create_bestellingregel(bestelling, aantal=3)
+        self.create_bestellingregel(
+            bestelling, vak=vak, aantal=4, aantal_correctie=2, is_verzameld=True
+        )
+        self.create_bestellingregel(
+            bestelling, vak=self.vak_a1, aantal=5, verwerkt="A", is_verzameld=True
+        )
+
+        with self.assertNumQueries(1):
+            totalen = {b.id: b for b in Bestelling.objects.met_totalen()}
+
+        self.assertEqual(totalen[bestelling.id].tot_aantal, 10)
+        self.assertEqual(totalen[bestelling.id].aantal_verzameld, 2)
+        self.assertEqual(totalen[bestelling.id].aantal_verwerkt, 5)
+        self.assertEqual(totalen[leeg.id].tot_aantal, 0)
+        self.assertEqual(totalen[leeg.id].aantal_verzameld, 0)
+        self.assertEqual(totalen[leeg.id].aantal_verwerkt, 0)
+
+    def totalen(self, bestelling):
+        return tuple(
+            Bestelling.objects.values_list(*Bestelling.TOTALEN).get(pk=bestelling.pk)
+        )
+
+    @patch("WijnVoorraad.models.WijnVoorraad.Bijwerken_rsv_erbij", return_value=True)
+    @patch("WijnVoorraad.models.WijnVoorraad.Bijwerken_rsv_eraf", return_value=True)
+    def test_totals_follow_changes_of_regels(self, *_):
+        """Test that changing, moving and deleting regels updates the stored totals,
+        also when the bestelling itself is saved with its old totals afterwards."""
+        bestelling = self.create_bestelling()
+        ander = self.create_bestelling(opmerking="Ander")
+        regel = self.create_bestellingregel(bestelling, aantal=4)
+        self.assertEqual(self.totalen(bestelling), (4, 0, 0))
+
+        regel.isVerzameld = True
+        regel.aantal_correctie = 3
+        regel.save()
+        self.assertEqual(self.totalen(bestelling), (3, 3, 0))
+
+        regel.verwerkt = "A"
+        regel.save()
+        self.assertEqual(self.totalen(bestelling), (3, 0, 3))
+
+        bestelling.opmerking = "Gewijzigd"
+        bestelling.save()
+        self.assertEqual(self.totalen(bestelling), (3, 0, 3))
+
+        regel.bestelling = ander
+        regel.save()
+        self.assertEqual(self.totalen(bestelling), (0, 0, 0))
+        self.assertEqual(self.totalen(ander), (3, 0, 3))
+
+        regel.delete()
+        self.assertEqual(self.totalen(ander), (0, 0, 0))
+
+    @patch("WijnVoorraad.models.WijnVoorraad.Bijwerken_rsv_erbij", return_value=True)
+    def test_totalen_herberekenen(self, _):
+        """Test that totalen_herberekenen repairs totals that are out of date."""
+        bestelling = self.create_bestelling()
+        goed = self.create_bestelling(opmerking="Goed")
+        self.create_bestellingregel(bestelling, aantal=3, is_verzameld=True)
+        Bestelling.objects.filter(pk=bestelling.pk).update(
+            tot_aantal=99, aantal_verzameld=0
+        )
+
+        out = StringIO()
+        call_command("bestelling_totalen_herstellen", stdout=out)
+
+        self.assertIn("1 bestellingen", out.getvalue())
+        bestelling.refresh_from_db()
+        self.assertEqual((bestelling.tot_aantal, bestelling.aantal_verzameld), (3, 3))
+        goed.refresh_from_db()
+        self.assertEqual(goed.tot_aantal, 0)
+        self.assertEqual(Bestelling.objects.totalen_herberekenen(), 0)
+
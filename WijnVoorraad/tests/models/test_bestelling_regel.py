@@ -352,6 +352,7 @@ class TestBestellingRegel(SharedTestDataMixin, TestCase):
     def test_regel_verplaatsen_updates_by_default(self, _):
         """Test that regel_verplaatsen updates the vak and calls Bijwerken_rsv."""
         bestelling = self.create_bestelling()
+        self.create_voorraad(5)
         regel = self.create_bestellingregel(bestelling=bestelling, aantal=5)
 
         nieuwe_vak = self.create_vak("B", 1)
@@ -365,6 +366,7 @@ class TestBestellingRegel(SharedTestDataMixin, TestCase):
     def test_regel_verplaatsen_updates_if_set(self, _):
         """Test that regel_verplaatsen updates the vak and calls Bijwerken_rsv."""
         bestelling = self.create_bestelling()
+        self.create_voorraad(5)
         regel = self.create_bestellingregel(bestelling=bestelling, aantal=5)
 
         nieuwe_vak = self.create_vak("B", 1)
@@ -378,6 +380,7 @@ class TestBestellingRegel(SharedTestDataMixin, TestCase):
     def test_regel_verplaatsen_does_not_update(self, _):
         """Test that regel_verplaatsen updates the vak and calls Bijwerken_rsv."""
         bestelling = self.create_bestelling()
+        self.create_voorraad(5)
         regel = self.create_bestellingregel(bestelling=bestelling, aantal=5)
 
         nieuwe_vak = self.create_vak("B", 1)
@@ -428,3 +431,69 @@ class TestBestellingRegel(SharedTestDataMixin, TestCase):
         )
 
         self.assertEqual(regel.aantal_werkelijk, None)
+
+
+@patch("WijnVoorraad.models.WijnVoorraad.Bijwerken_rsv", return_value=True)
+class TestBestellingRegelOrigineel(SharedTestDataMixin, TestCase):
+    """Tests for the remembered database version of a BestellingRegel."""
+
+    def test_origineel_of_loaded_regel_needs_no_query(self, _):
+        bestelling = self.create_bestelling()
+        regel = self.create_bestellingregel(bestelling=bestelling, aantal=2)
+        regel = BestellingRegel.objects.select_related("bestelling").get(pk=regel.pk)
+        regel.aantal = 5
+        with self.assertNumQueries(0):
+            oud = regel.origineel()
+            self.assertEqual(oud.aantal, 2)
+            self.assertEqual(oud.bestelling.vanLocatie_id, self.locatie.id)
+
+    def test_save_passes_the_remembered_version(self, bijwerken_rsv):
+        bestelling = self.create_bestelling()
+        regel = self.create_bestellingregel(bestelling=bestelling, aantal=2)
+        regel.aantal = 3
+        regel.save()
+        self.assertEqual(bijwerken_rsv.call_args.args[1].aantal, 2)
+        regel.aantal = 4
+        regel.save()
+        self.assertEqual(bijwerken_rsv.call_args.args[1].aantal, 3)
+
+    def test_new_regel_has_no_origineel(self, _):
+        bestelling = self.create_bestelling()
+        regel = BestellingRegel(bestelling=bestelling, ontvangst=self.ontvangst)
+        with self.assertNumQueries(0):
+            self.assertIsNone(regel.origineel())
+
+
+class TestBestellingRegelVoorraad(SharedTestDataMixin, TestCase):
+    """Tests for looking up the voorraad of many bestellingregels at once."""
+
+    def test_met_voorraad_reads_all_voorraad_with_one_query(self):
+        self.create_voorraad(5)
+        self.create_voorraad(3, vak=self.vak_a1)
+        bestelling = self.create_bestelling()
+        zonder_vak = self.create_bestellingregel(bestelling, aantal=2)
+        in_vak = self.create_bestellingregel(bestelling, vak=self.vak_a1, aantal=1)
+        zonder_voorraad = self.create_bestellingregel(
+            bestelling, vak=self.vak_a2, aantal=0
+        )
+
+        with self.assertNumQueries(2):
+            regels = {
+                regel.id: regel
+                for regel in BestellingRegel.objects.filter(
+                    bestelling=bestelling
+                ).met_voorraad()
+            }
+            voorraad = regels[zonder_vak.id].voorraad
+            self.assertEqual((voorraad.aantal, voorraad.aantal_rsv), (5, 2))
+            self.assertEqual(regels[in_vak.id].voorraad.vak_id, self.vak_a1.id)
+            self.assertIsNone(regels[zonder_voorraad.id].voorraad)
+
+    def test_per_sleutel(self):
+        self.create_voorraad(3, vak=self.vak_a1)
+        bestelling = self.create_bestelling()
+        regel = self.create_bestellingregel(bestelling, vak=self.vak_a1)
+        self.assertEqual(
+            BestellingRegel.objects.filter(bestelling=bestelling).per_sleutel(),
+            {(self.ontvangst.id, self.vak_a1.id): regel},
+        )
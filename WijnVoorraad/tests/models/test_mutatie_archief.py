@@ -0,0 +1,155 @@
+"""Unit tests for archiving the mutations of closed wines (MutatiesArchiveren)."""
+
+import datetime
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from WijnVoorraad import zoekindex
+from WijnVoorraad.models import (
+    OntvangstArchief,
+    VoorraadMutatie,
+    VoorraadMutatieArchief,
+    Wijn,
+)
+from WijnVoorraad.services import WijnVoorraadService
+from WijnVoorraad.tests.models.model_helper import SharedTestDataMixin
+
+DATUM = datetime.date(2020, 3, 1)
+UIT_DATUM = datetime.date(2020, 3, 10)
+
+
+class TestMutatiesArchiveren(SharedTestDataMixin, TestCase):
+    """Mutations of wines closed before the limit move to VoorraadMutatieArchief."""
+
+    def setUp(self):
+        self.mutatie_in = self.create_voorraad(3)
+        self.create_voorraad(2, vak=self.vak_a1)
+        with self.captureOnCommitCallbacks(execute=True):
+            VoorraadMutatie.afboeken(self.ontvangst, self.locatie, None, 3)
+            VoorraadMutatie.afboeken(self.ontvangst, self.locatie, self.vak_a1, 2)
+        VoorraadMutatie.objects.filter(in_uit="I").update(datum=DATUM)
+        VoorraadMutatie.objects.filter(in_uit="U").update(datum=UIT_DATUM)
+        Wijn.objects.filter(pk=self.wijn.pk).update(
+            datumAfgesloten=datetime.datetime(2020, 3, 11)
+        )
+
+    def archiveren(self, grens=datetime.date(2022, 1, 1)):
+        return WijnVoorraadService.MutatiesArchiveren(grens)
+
+    def test_mutations_are_moved(self):
+        ids = set(VoorraadMutatie.objects.values_list("id", flat=True))
+        self.assertEqual(self.archiveren(), {"ontvangsten": 1, "mutaties": 4})
+        self.assertFalse(VoorraadMutatie.objects.exists())
+        self.assertEqual(
+            set(VoorraadMutatieArchief.objects.values_list("id", flat=True)), ids
+        )
+        archief = VoorraadMutatieArchief.objects.get(pk=self.mutatie_in.pk)
+        self.assertEqual(
+            (archief.in_uit, archief.actie, archief.aantal, archief.datum),
+            ("I", "K", 3, DATUM),
+        )
+
+    def test_totals_are_kept(self):
+        self.archiveren()
+        archief = OntvangstArchief.objects.get(ontvangst=self.ontvangst)
+        self.assertEqual(
+            (
+                archief.aantal_records_in,
+                archief.aantal_in,
+                archief.aantal_records_uit,
+                archief.aantal_uit,
+            ),
+            (2, 5, 2, 5),
+        )
+
+    def test_archiving_again_adds_to_the_totals(self):
+        self.archiveren()
+        VoorraadMutatie.objects.bulk_create(
+            [
+                VoorraadMutatie(
+                    ontvangst=self.ontvangst,
+                    locatie=self.locatie,
+                    in_uit=in_uit,
+                    actie=actie,
+                    datum=DATUM,
+                    aantal=1,
+                )
+                for in_uit, actie in (("I", "K"), ("U", "D"))
+            ]
+        )
+        self.assertEqual(self.archiveren()["mutaties"], 2)
+        archief = OntvangstArchief.objects.get(ontvangst=self.ontvangst)
+        self.assertEqual((archief.aantal_records_in, archief.aantal_in), (3, 6))
+
+    def test_search_index_rows_are_removed(self):
+        if not zoekindex.index_beschikbaar():
+            self.skipTest("no search index")
+        ids = list(VoorraadMutatie.objects.values_list("id", flat=True))
+        self.archiveren()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT COUNT(*) FROM "{zoekindex.MUTATIE_TABEL}" WHERE rowid IN '
+                f"({', '.join(['%s'] * len(ids))})",
+                ids,
+            )
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_fuzzy_ignores_accents(self):
+        VoorraadMutatie.objects.filter(pk=self.mutatie_in.pk).update(
+            omschrijving="Cadeau van Château Margaux"
+        )
+        self.archiveren()
+        for term in ("chateau", "CHÂTEAU", "Château"):
+            self.assertEqual(
+                list(
+                    VoorraadMutatieArchief.objects.fuzzy(term).values_list(
+                        "id", flat=True
+                    )
+                ),
+                [self.mutatie_in.pk],
+            )
+        self.assertFalse(VoorraadMutatieArchief.objects.fuzzy("chataeu").exists())
+
+    def test_not_closed_before_limit(self):
+        self.assertEqual(self.archiveren(UIT_DATUM)["mutaties"], 0)
+        self.assertEqual(VoorraadMutatie.objects.count(), 4)
+
+    def test_ontvangst_with_stock_is_skipped(self):
+        self.create_voorraad(1)
+        self.assertEqual(self.archiveren()["ontvangsten"], 0)
+        self.assertFalse(VoorraadMutatieArchief.objects.exists())
+
+    def test_check_with_archive(self):
+        self.archiveren()
+        ontvangst = WijnVoorraadService.ControleerOntvangst(self.ontvangst)
+        self.assertEqual(
+            (ontvangst.tot_aantal_mut_in, ontvangst.tot_aantal_mut_uit), (0, 0)
+        )
+        ontvangst = WijnVoorraadService.ControleerOntvangst(
+            self.ontvangst, met_archief=True
+        )
+        self.assertEqual(
+            (ontvangst.tot_aantal_mut_in, ontvangst.tot_aantal_mut_uit), (5, 5)
+        )
+        self.assertEqual(ontvangst.klopt, "Ja")
+        self.assertEqual(
+            WijnVoorraadService.ControleerAlleOntvangsten(met_archief=True), []
+        )
+
+    def test_stock_at_date_includes_archive(self):
+        self.archiveren()
+        self.assertEqual(
+            WijnVoorraadService.AantallenOpDatum(DATUM),
+            {
+                (self.ontvangst.id, self.locatie.id, None): 3,
+                (self.ontvangst.id, self.locatie.id, self.vak_a1.id): 2,
+            },
+        )
+        self.assertEqual(WijnVoorraadService.AantallenOpDatum(UIT_DATUM), {})
+
+    def test_command(self):
+        out = StringIO()
+        call_command("mutaties_archiveren", "--maanden", "1", stdout=out)
+        self.assertIn("4 mutaties van 1 ontvangsten", out.getvalue())
@@ -1,7 +1,6 @@
 """module for unit test of ontvangst class"""
 
 import datetime
-from unittest.mock import patch
 
 from django.db import IntegrityError
 from django.core.exceptions import ValidationError
@@ -164,9 +163,9 @@ class TestOntvangst(SharedTestDataMixin, TestCase):
         ]
         self.assertEqual(ontvangsten, expected_order)
 
-    def test_check_fuzzy_selectie_various_fields(self):
-        # Test that check_fuzzy_selectie returns True if the search string matches
-        # leverancier, opmerking, or related wijn."""
+    def test_fuzzy_various_fields(self):
+        # Test that fuzzy() selects the ontvangst if the search string matches
+        # leverancier, opmerking, or related wijn.
         ontvangst = Ontvangst.objects.create(
             deelnemer=self.deelnemer,
             wijn=self.wijn,
@@ -175,17 +174,19 @@ class TestOntvangst(SharedTestDataMixin, TestCase):
         )
 
         # Should match on leverancier
-        self.assertTrue(ontvangst.check_fuzzy_selectie("leverancierx"))
+        self.assertEqual(list(Ontvangst.objects.fuzzy("leverancierx")), [ontvangst])
         # Should match on opmerking
-        self.assertTrue(ontvangst.check_fuzzy_selectie("speciale"))
+        self.assertEqual(list(Ontvangst.objects.fuzzy("speciale")), [ontvangst])
+        # Should match on the wijn
+        self.assertIn(ontvangst, Ontvangst.objects.fuzzy("wijnx"))
 
-        # Should return True if fuzzy_selectie is empty
-        self.assertTrue(ontvangst.check_fuzzy_selectie(""))
-        # Should return False for non-matching string
-        self.assertFalse(ontvangst.check_fuzzy_selectie("nonexistent"))
+        # Should return all ontvangsten if fuzzy_selectie is empty
+        self.assertIn(ontvangst, Ontvangst.objects.fuzzy(""))
+        # Should return nothing for non-matching string
+        self.assertFalse(Ontvangst.objects.fuzzy("nonexistent").exists())
 
-    def test_check_fuzzy_selectie_leverancier_and_empty(self):
-        """Test that check_fuzzy_selectie handles leverancier being None or empty string."""
+    def test_fuzzy_leverancier_empty(self):
+        """Test that fuzzy() handles leverancier being an empty string."""
 
         ontvangst_empty = Ontvangst.objects.create(
             deelnemer=self.deelnemer,
@@ -194,25 +195,16 @@ class TestOntvangst(SharedTestDataMixin, TestCase):
             opmerking="Nog een opmerking",
         )
         # Should not raise error and should match opmerking
-        self.assertTrue(ontvangst_empty.check_fuzzy_selectie("nog"))
-        # Should return False for non-matching string
-        self.assertFalse(ontvangst_empty.check_fuzzy_selectie("nonexistent"))
-
-    def test_check_fuzzy_selectie_should_call_wijn_check_fuzzy_selectie(self):
-        """Test that check_fuzzy_selectie calls the related wijn's check_fuzzy_selectie."""
-
-        # Mock the wijn's check_fuzzy_selectie method
-        with patch("WijnVoorraad.models.Wijn.check_fuzzy_selectie") as mock_check:
-            self.ontvangst.check_fuzzy_selectie("wijnnaam")
-            # assert mock is called with the correct argument
-            mock_check.assert_called_once_with("wijnnaam")
-
-    def test_check_fuzzy_selectie_should_not_call_wijn_check_when_ontvangst_matches(
-        self,
-    ):
-        # Test that check_fuzzy_selectie does not call the related wijn's check_fuzzy_selectie
-        self.ontvangst.opmerking = "leverancierx"
-        with patch("WijnVoorraad.models.Wijn.check_fuzzy_selectie") as mock_check:
-            self.ontvangst.check_fuzzy_selectie("leverancierx")
-            # assert mock is not called since the check should match on leverancier
-            mock_check.assert_not_called()
+        self.assertEqual(list(Ontvangst.objects.fuzzy("nog")), [ontvangst_empty])
+
+    def test_save_fills_search_blob_lower_case_without_accents(self):
+        """Test that save() stores leverancier and opmerking normalised in search_blob."""
+        ontvangst = Ontvangst.objects.create(
+            deelnemer=self.deelnemer,
+            wijn=self.wijn,
+            datumOntvangst=timezone.now().date(),
+            leverancier="Wijnhandel Crème",
+            opmerking="Cadeau",
+        )
+        ontvangst.refresh_from_db()
+        self.assertEqual(ontvangst.search_blob, "wijnhandel creme\ncadeau")
@@ -0,0 +1,114 @@
+"""Unit tests for the asynchronous stock projection (projectie.py)."""
+
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.exceptions import ValidationError
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from WijnVoorraad import projectie
+from WijnVoorraad.models import VoorraadMutatie, VoorraadProjectie, Wijn, WijnVoorraad
+from WijnVoorraad.tests.models.model_helper import SharedTestDataMixin
+
+
+@override_settings(VOORRAAD_PROJECTIE_ASYNC=True)
+class TestProjectie(SharedTestDataMixin, TestCase):
+    """With VOORRAAD_PROJECTIE_ASYNC the projector updates the stock."""
+
+    def setUp(self):
+        self.create_voorraad(5)
+        projectie.opbouwen()
+
+    def aantal(self, vak=None):
+        voorraad = WijnVoorraad.objects.filter(ontvangst=self.ontvangst, vak=vak).first()
+        return voorraad.aantal if voorraad else 0
+
+    def test_opbouwen(self):
+        bestelling = self.create_bestelling()
+        self.create_bestellingregel(bestelling, aantal=2)
+        WijnVoorraad.objects.update(aantal=99, aantal_rsv=0)
+        projectie.opbouwen()
+        voorraad = WijnVoorraad.objects.get(ontvangst=self.ontvangst)
+        self.assertEqual((voorraad.aantal, voorraad.aantal_rsv), (5, 2))
+        self.assertEqual(
+            VoorraadProjectie.objects.get().laatste_mutatie_id,
+            VoorraadMutatie.objects.latest("id").id,
+        )
+
+    def test_mutation_is_projected_later(self):
+        VoorraadMutatie.drinken(self.ontvangst, self.locatie)
+        self.create_voorraad(3, vak=self.vak_a1)
+        self.assertEqual(self.aantal(), 5)
+        self.assertEqual(self.aantal(self.vak_a1), 0)
+
+        self.assertEqual(projectie.verwerken(), 2)
+        self.assertEqual(self.aantal(), 4)
+        self.assertEqual(self.aantal(self.vak_a1), 3)
+        self.assertEqual(projectie.verwerken(), 0)
+
+    def test_projector_in_batches(self):
+        for _ in range(3):
+            VoorraadMutatie.drinken(self.ontvangst, self.locatie)
+        self.assertEqual(projectie.verwerken(batch_grootte=2), 2)
+        self.assertEqual(self.aantal(), 3)
+        self.assertEqual(projectie.verwerken(batch_grootte=2), 1)
+        self.assertEqual(self.aantal(), 2)
+
+    def test_check_includes_open_mutations(self):
+        for _ in range(5):
+            VoorraadMutatie.drinken(self.ontvangst, self.locatie)
+        with self.assertRaises(ValidationError):
+            VoorraadMutatie.drinken(self.ontvangst, self.locatie)
+        with self.assertRaises(ValidationError):
+            VoorraadMutatie.verplaatsen(
+                self.ontvangst, self.locatie, None, self.locatie, self.vak_a1, 1
+            )
+        self.assertEqual(VoorraadMutatie.objects.filter(in_uit="U").count(), 5)
+
+    def test_open_mutation_can_be_used(self):
+        self.create_voorraad(2, vak=self.vak_a1)
+        VoorraadMutatie.drinken(self.ontvangst, self.locatie, self.vak_a1)
+        projectie.verwerken()
+        self.assertEqual(self.aantal(self.vak_a1), 1)
+
+    def test_change_of_projected_mutation_is_applied_directly(self):
+        mutatie = VoorraadMutatie.objects.get()
+        mutatie.aantal = 7
+        mutatie.save()
+        self.assertEqual(self.aantal(), 7)
+        self.assertEqual(projectie.verwerken(), 0)
+
+    def test_delete_of_open_mutation(self):
+        VoorraadMutatie.drinken(self.ontvangst, self.locatie)
+        VoorraadMutatie.objects.get(in_uit="U").delete()
+        projectie.verwerken()
+        self.assertEqual(self.aantal(), 5)
+
+    def test_wine_closed_by_the_projector(self):
+        VoorraadMutatie.afboeken(self.ontvangst, self.locatie, None, 5)
+        self.assertIsNone(Wijn.objects.get(pk=self.wijn.pk).datumAfgesloten)
+        with self.captureOnCommitCallbacks(execute=True):
+            projectie.verwerken()
+        self.assertEqual(self.aantal(), 0)
+        self.assertIsNotNone(Wijn.objects.get(pk=self.wijn.pk).datumAfgesloten)
+
+    def test_read_your_writes(self):
+        request = RequestFactory().get("/")
+        request.session = SessionStore()
+
+        def drinken(request):  # pylint: disable=unused-argument
+            VoorraadMutatie.drinken(self.ontvangst, self.locatie)
+            return HttpResponse()
+
+        projectie.ProjectieMiddleware(drinken)(request)
+        self.assertEqual(self.aantal(), 5)
+        self.assertIn(projectie.ProjectieMiddleware.SESSIE_SLEUTEL, request.session)
+
+        projectie.ProjectieMiddleware(lambda request: HttpResponse())(request)
+        self.assertEqual(self.aantal(), 4)
+        self.assertNotIn(projectie.ProjectieMiddleware.SESSIE_SLEUTEL, request.session)
+
+    def test_synchronous_without_checkpoint(self):
+        VoorraadProjectie.objects.all().delete()
+        VoorraadMutatie.drinken(self.ontvangst, self.locatie)
+        self.assertEqual(self.aantal(), 4)
+        with self.assertRaises(ValidationError):
+            projectie.verwerken()
@@ -0,0 +1,129 @@
+"""Unit tests for the cache of the result counts (resultaatcache)."""
+
+from django.core.cache import cache
+from django.db.models import F
+from django.test import TestCase
+from django.utils import timezone
+from WijnVoorraad import resultaatcache
+from WijnVoorraad.models import ResultaatVersie, VoorraadMutatie, Wijn, WijnVoorraad
+from WijnVoorraad.tests.models.model_helper import SharedTestDataMixin
+
+FILTER_STATUS = {
+    "deelnemer_id": None,
+    "locatie_id": None,
+    "wijnsoort_id": None,
+    "fuzzy_selectie": "wijn",
+    "sortering": "WO",
+}
+
+
+class TestResultaatCache(SharedTestDataMixin, TestCase):
+    """Unit tests for the result cache and the version number of the inventory."""
+
+    def setUp(self):
+        cache.clear()
+
+    def create_mutatie(self):
+        mutatie = VoorraadMutatie(
+            ontvangst=self.ontvangst,
+            locatie=self.locatie,
+            in_uit="I",
+            actie="K",
+            datum=timezone.now().date(),
+            aantal=1,
+        )
+        mutatie.save()
+        return mutatie
+
+    def test_verhoog_versie_increases_version(self):
+        versie = resultaatcache.get_versie()
+        resultaatcache.verhoog_versie()
+        self.assertEqual(resultaatcache.get_versie(), versie + 1)
+
+    def test_verhoog_versie_without_version_row(self):
+        ResultaatVersie.objects.all().delete()
+        versie = resultaatcache.get_versie()
+        resultaatcache.verhoog_versie()
+        self.assertNotEqual(resultaatcache.get_versie(), versie)
+        self.assertEqual(ResultaatVersie.objects.count(), 1)
+
+    def test_version_is_shared_by_processes(self):
+        """Another process (with its own local cache) sees the new version."""
+        versie = resultaatcache.get_versie()
+        ResultaatVersie.objects.update(versie=F("versie") + 1)
+        cache.clear()
+        self.assertEqual(resultaatcache.get_versie(), versie + 1)
+
+    def test_closing_a_wine_increases_version(self):
+        versie = resultaatcache.get_versie()
+        Wijn.afsluiten_bijwerken(self.wijn.id)
+        self.assertGreater(resultaatcache.get_versie(), versie)
+
+    def test_writes_increase_version(self):
+        versie = resultaatcache.get_versie()
+        mutatie = self.create_mutatie()
+        self.assertGreater(resultaatcache.get_versie(), versie)
+
+        versie = resultaatcache.get_versie()
+        regel = self.create_bestellingregel(self.create_bestelling())
+        self.assertGreater(resultaatcache.get_versie(), versie)
+
+        versie = resultaatcache.get_versie()
+        self.wijn.opmerking = "Gewijzigd"
+        self.wijn.save()
+        self.assertGreater(resultaatcache.get_versie(), versie)
+
+        versie = resultaatcache.get_versie()
+        regel.delete()
+        mutatie.delete()
+        self.assertGreater(resultaatcache.get_versie(), versie)
+
+    def test_direct_stock_writes_increase_version(self):
+        """WijnVoorraad rows written without a mutation, as BijwerkenVrdOntvangst and
+        the admin do, make the cached results obsolete as well."""
+        versie = resultaatcache.get_versie()
+        voorraad = WijnVoorraad.objects.create(
+            wijn=self.wijn,
+            deelnemer=self.deelnemer,
+            ontvangst=self.ontvangst,
+            locatie=self.locatie,
+            aantal=1,
+        )
+        self.assertGreater(resultaatcache.get_versie(), versie)
+
+        versie = resultaatcache.get_versie()
+        voorraad.delete()
+        self.assertGreater(resultaatcache.get_versie(), versie)
+
+    def test_count_is_served_from_cache(self):
+        aantal = resultaatcache.gecachte_aantal(
+            "wijnlist", FILTER_STATUS, Wijn.objects.all()
+        )
+        self.assertEqual(aantal, 1)
+        # only the version is read, the COUNT is not repeated
+        with self.assertNumQueries(1):
+            aantal = resultaatcache.gecachte_aantal(
+                "wijnlist", FILTER_STATUS, Wijn.objects.none()
+            )
+        self.assertEqual(aantal, 1)
+
+    def test_write_makes_cached_count_obsolete(self):
+        resultaatcache.gecachte_aantal("wijnlist", FILTER_STATUS, Wijn.objects.all())
+        Wijn.objects.create(domein="N", naam="Nieuw", wijnsoort=self.wijnsoort)
+        aantal = resultaatcache.gecachte_aantal(
+            "wijnlist", FILTER_STATUS, Wijn.objects.all()
+        )
+        self.assertEqual(aantal, 2)
+
+    def test_other_filter_status_is_counted_separately(self):
+        resultaatcache.gecachte_aantal("wijnlist", FILTER_STATUS, Wijn.objects.none())
+        self.assertEqual(
+            resultaatcache.gecachte_aantal(
+                "wijnlist", {**FILTER_STATUS, "wijnsoort_id": 1}, Wijn.objects.all()
+            ),
+            1,
+        )
+        aantal = resultaatcache.gecachte_aantal(
+            "ontvangstlist", FILTER_STATUS, Wijn.objects.all()
+        )
+        self.assertEqual(aantal, 1)
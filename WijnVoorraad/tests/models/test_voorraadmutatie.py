@@ -4,10 +4,11 @@ from unittest.mock import patch
 from django.test import TestCase
 from django.utils import timezone
 
-from django.db import IntegrityError
+from django.db import IntegrityError, connection
+from django.test.utils import CaptureQueriesContext
 from django.core.exceptions import ValidationError
 
-from WijnVoorraad.models import Ontvangst, VoorraadMutatie
+from WijnVoorraad.models import Ontvangst, VoorraadMutatie, WijnVoorraad
 from WijnVoorraad.tests.models.model_helper import SharedTestDataMixin
 
 
@@ -191,7 +192,9 @@ class TestVoorraadMutatie(SharedTestDataMixin, TestCase):
             datum=timezone.now().date(),
             locatie=self.locatie,
         )
-        with patch("WijnVoorraad.models.WijnVoorraad.Bijwerken") as mock_bijwerken:
+        with patch(
+            "WijnVoorraad.models.WijnVoorraad.aantal_afboeken"
+        ) as mock_aantal_afboeken:
             voorraad_mutatie.drinken(self.ontvangst, self.locatie)
             # Check that a new VoorraadMutatie was created
             self.assertEqual(VoorraadMutatie.objects.count(), 2)
@@ -200,7 +203,9 @@ class TestVoorraadMutatie(SharedTestDataMixin, TestCase):
             self.assertEqual(new_mutatie.actie, "D")
             self.assertEqual(new_mutatie.aantal, 1)
             self.assertEqual(new_mutatie.datum, timezone.now().date())
-            mock_bijwerken.assert_called_once_with(new_mutatie, None)
+            mock_aantal_afboeken.assert_called_once_with(
+                self.ontvangst.id, self.locatie.id, None, 1
+            )
 
     def test_drinken_should_copy_vak_from_call(self):
         """Test that drinken copies the vak from the call."""
@@ -255,6 +260,7 @@ class TestVoorraadMutatie(SharedTestDataMixin, TestCase):
             datum=timezone.now().date(),
             locatie=self.locatie,
         )
+        self.create_voorraad(2, vak=self.vak_a1)
         voorraad_mutatie.verplaatsen(
             self.ontvangst,
             locatie_oud=self.locatie,
@@ -264,7 +270,7 @@ class TestVoorraadMutatie(SharedTestDataMixin, TestCase):
             vak_nieuw=self.vak_a2,
         )
         # Check that a new VoorraadMutatie was created
-        self.assertEqual(VoorraadMutatie.objects.count(), 3)
+        self.assertEqual(VoorraadMutatie.objects.count(), 4)
         # get the outgoing U mutatie
         try:
             new_mutatie = VoorraadMutatie.objects.get(
@@ -300,13 +306,9 @@ class TestVoorraadMutatie(SharedTestDataMixin, TestCase):
             datum=timezone.now().date(),
             locatie=self.locatie,
         )
-        with (
-            patch("WijnVoorraad.models.WijnVoorraad.Bijwerken") as mock_bijwerken,
-            patch(
-                "WijnVoorraad.models.WijnVoorraad.check_voorraad_wijziging",
-                return_value=None,
-            ),
-        ):
+        with patch(
+            "WijnVoorraad.models.WijnVoorraad.aantal_afboeken"
+        ) as mock_aantal_afboeken:
 
             voorraad_mutatie.afboeken(self.ontvangst, self.locatie, aantal=1, vak=None)
             # Check that a new VoorraadMutatie was created
@@ -316,18 +318,14 @@ class TestVoorraadMutatie(SharedTestDataMixin, TestCase):
             self.assertEqual(new_mutatie.actie, "A")
             self.assertEqual(new_mutatie.aantal, 1)
             self.assertEqual(new_mutatie.datum, timezone.now().date())
-            mock_bijwerken.assert_called_once_with(new_mutatie, None)
+            mock_aantal_afboeken.assert_called_once_with(
+                self.ontvangst.id, self.locatie.id, None, 1
+            )
 
     def test_afboeken_should_copy_vak_from_call(self):
         """Test that afboeken copies the vak from the call."""
 
-        with (
-            patch("WijnVoorraad.models.WijnVoorraad.Bijwerken"),
-            patch(
-                "WijnVoorraad.models.WijnVoorraad.check_voorraad_wijziging",
-                return_value=None,
-            ),
-        ):
+        with patch("WijnVoorraad.models.WijnVoorraad.aantal_afboeken"):
             VoorraadMutatie.afboeken(
                 self.ontvangst, self.locatie, aantal=1, vak=self.vak_a1
             )
@@ -335,10 +333,8 @@ class TestVoorraadMutatie(SharedTestDataMixin, TestCase):
             new_mutatie = VoorraadMutatie.objects.last()
             self.assertEqual(new_mutatie.vak, self.vak_a1)
 
-    def test_check_fuzzy_selectie_should_return_true_if_fuzzy_selectie_matches_omschrijving(
-        self,
-    ):
-        # Test that check_fuzzy_selectie returns True
+    def test_fuzzy_should_select_mutatie_if_fuzzy_selectie_matches(self):
+        # Test that fuzzy() selects the mutatie
         # if fuzzy_selectie matches omschrijving or ontvangst.
         voorraad_mutatie = VoorraadMutatie.objects.create(
             ontvangst=self.ontvangst,
@@ -348,45 +344,11 @@ class TestVoorraadMutatie(SharedTestDataMixin, TestCase):
             locatie=self.locatie,
             omschrijving="Test omschrijving",
         )
-        self.assertTrue(voorraad_mutatie.check_fuzzy_selectie("Test"))
-        self.assertTrue(voorraad_mutatie.check_fuzzy_selectie("omschrijving"))
-        self.assertTrue(voorraad_mutatie.check_fuzzy_selectie("Test omschrijving"))
-
-    def test_check_fuzzy_selectie_should_call_ontvangst_check_fuzzy_selectie(
-        self,
-    ):
-        """Test that check_fuzzy_selectie calls ontvangst.check_fuzzy_selectie."""
-        voorraad_mutatie = VoorraadMutatie.objects.create(
-            ontvangst=self.ontvangst,
-            aantal=10,
-            actie="toevoegen",
-            datum=timezone.now().date(),
-            locatie=self.locatie,
-        )
-        with patch.object(
-            voorraad_mutatie.ontvangst, "check_fuzzy_selectie", return_value=True
-        ) as mock_check:
-            voorraad_mutatie.check_fuzzy_selectie("Test")
-            mock_check.assert_called_once_with("Test")
-
-    def test_check_fuzzy_selectie_should_not_call_ontvangst_check_if_match_on_mutatie(
-        self,
-    ):
-        # Test that check_fuzzy_selectie does not call ontvangst.check_fuzzy_selectie
-        # if match on mutatie."""
-        voorraad_mutatie = VoorraadMutatie.objects.create(
-            ontvangst=self.ontvangst,
-            aantal=10,
-            actie="toevoegen",
-            datum=timezone.now().date(),
-            locatie=self.locatie,
-            omschrijving="Test omschrijving",
-        )
-        with patch.object(
-            voorraad_mutatie.ontvangst, "check_fuzzy_selectie"
-        ) as mock_check:
-            voorraad_mutatie.check_fuzzy_selectie("Test omschrijving")
-            mock_check.assert_not_called()
+        for term in ("Test", "omschrijving", "Test omschrijving", "wijnx"):
+            self.assertEqual(
+                list(VoorraadMutatie.objects.fuzzy(term)), [voorraad_mutatie], term
+            )
+        self.assertFalse(VoorraadMutatie.objects.fuzzy("nonexistent").exists())
 
 
 class TestMutationReferToSameVoorraad(SharedTestDataMixin, TestCase):
@@ -449,3 +411,157 @@ class TestMutationReferToSameVoorraad(SharedTestDataMixin, TestCase):
         mut1 = self.make_mutatie(self.ontvangst, self.locatie, self.vak_a1)
         mut2 = self.make_mutatie(ontvangst2, self.locatie, self.vak_a2)
         self.assertFalse(VoorraadMutatie.mutation_refer_to_same_voorraad(mut1, mut2))
+
+
+class TestBulkBoeken(SharedTestDataMixin, TestCase):
+    """Unit tests for VoorraadMutatie.bulk_boeken."""
+
+    def mutatie(self, in_uit, aantal, vak=None):
+        return VoorraadMutatie(
+            ontvangst=self.ontvangst,
+            locatie=self.locatie,
+            vak=vak,
+            in_uit=in_uit,
+            actie="V",
+            datum=timezone.now().date(),
+            aantal=aantal,
+            omschrijving="Bulk",
+        )
+
+    def voorraad(self, vak):
+        return WijnVoorraad.objects.get(
+            ontvangst=self.ontvangst, locatie=self.locatie, vak=vak
+        ).aantal
+
+    def test_books_mutations_and_net_stock(self):
+        mutaties = VoorraadMutatie.bulk_boeken(
+            [
+                self.mutatie("I", 6, self.vak_a1),
+                self.mutatie("U", 2, self.vak_a1),
+                self.mutatie("I", 2, self.vak_a2),
+            ]
+        )
+        self.assertTrue(all(m.pk for m in mutaties))
+        self.assertEqual(VoorraadMutatie.objects.count(), 3)
+        self.assertEqual(self.voorraad(self.vak_a1), 4)
+        self.assertEqual(self.voorraad(self.vak_a2), 2)
+
+    def test_validates_in_order_and_books_nothing_on_error(self):
+        VoorraadMutatie.bulk_boeken([self.mutatie("I", 1, self.vak_a1)])
+        with self.assertRaises(ValidationError):
+            VoorraadMutatie.bulk_boeken(
+                [
+                    self.mutatie("U", 2, self.vak_a1),
+                    self.mutatie("I", 5, self.vak_a1),
+                ]
+            )
+        self.assertEqual(VoorraadMutatie.objects.count(), 1)
+        self.assertEqual(self.voorraad(self.vak_a1), 1)
+
+    def test_statements_do_not_depend_on_number_of_mutations(self):
+        VoorraadMutatie.bulk_boeken([self.mutatie("I", 50, self.vak_a1)])
+        # savepoint, stock read, insert of the mutations, stock upsert,
+        # search index, version of the result cache and release of the savepoint
+        with self.assertNumQueries(7):
+            VoorraadMutatie.bulk_boeken(
+                [self.mutatie("U", 1, self.vak_a1) for _ in range(20)]
+            )
+        self.assertEqual(self.voorraad(self.vak_a1), 30)
+
+
+class TestVoorraadMutatieOrigineel(SharedTestDataMixin, TestCase):
+    """Tests for the remembered database version of a VoorraadMutatie."""
+
+    def test_change_of_loaded_mutatie_does_not_read_it_again(self):
+        mutatie = VoorraadMutatie(
+            ontvangst=self.ontvangst,
+            locatie=self.locatie,
+            vak=self.vak_a1,
+            in_uit="I",
+            actie="K",
+            datum=timezone.now().date(),
+            aantal=5,
+        )
+        mutatie.save()
+        mutatie = VoorraadMutatie.objects.select_related(
+            "ontvangst", "locatie", "vak"
+        ).get(pk=mutatie.pk)
+        mutatie.aantal = 3
+
+        with CaptureQueriesContext(connection) as queries:
+            mutatie.clean()
+            mutatie.save()
+        self.assertFalse(
+            [
+                q["sql"]
+                for q in queries.captured_queries
+                if q["sql"].startswith("SELECT")
+                and 'FROM "WijnVoorraad_voorraadmutatie"' in q["sql"]
+            ]
+        )
+        voorraad = WijnVoorraad.objects.get(
+            ontvangst=self.ontvangst, locatie=self.locatie, vak=self.vak_a1
+        )
+        self.assertEqual(voorraad.aantal, 3)
+
+    def test_rejected_new_mutatie_can_be_saved_again(self):
+        """A rolled back save leaves the object new, so a retry books the full
+        amount instead of a difference with a row that was never stored."""
+        self.create_voorraad(2, vak=self.vak_a1)
+        mutatie = VoorraadMutatie(
+            ontvangst=self.ontvangst,
+            locatie=self.locatie,
+            vak=self.vak_a1,
+            in_uit="U",
+            actie="D",
+            datum=timezone.now().date(),
+            aantal=3,
+        )
+        with self.assertRaises(ValidationError):
+            mutatie.save(controleren=True)
+        self.assertIsNone(mutatie.pk)
+        self.assertTrue(mutatie._state.adding)  # pylint: disable=protected-access
+
+        mutatie.aantal = 2
+        mutatie.save(controleren=True)
+        self.assertEqual(VoorraadMutatie.objects.filter(in_uit="U").count(), 1)
+        self.assertFalse(
+            WijnVoorraad.objects.filter(
+                ontvangst=self.ontvangst, vak=self.vak_a1
+            ).exists()
+        )
+
+    def test_rolled_back_change_keeps_original(self):
+        mutatie = self.create_voorraad(4, vak=self.vak_a1)
+        mutatie.aantal = 6
+        with patch(
+            "WijnVoorraad.models.VoorraadMomentopname.ongeldig_maken",
+            side_effect=ValidationError("Fout"),
+        ):
+            with self.assertRaises(ValidationError):
+                mutatie.save()
+        self.assertEqual(mutatie.origineel().aantal, 4)
+        mutatie.save()
+        voorraad = WijnVoorraad.objects.get(ontvangst=self.ontvangst, vak=self.vak_a1)
+        self.assertEqual(voorraad.aantal, 6)
+
+    def test_origineel_falls_back_to_database_without_snapshot(self):
+        mutatie = VoorraadMutatie.objects.create(
+            ontvangst=self.ontvangst,
+            locatie=self.locatie,
+            in_uit="I",
+            actie="K",
+            datum=timezone.now().date(),
+            aantal=2,
+        )
+        kopie = VoorraadMutatie(
+            pk=mutatie.pk,
+            ontvangst=self.ontvangst,
+            locatie=self.locatie,
+            in_uit="I",
+            actie="K",
+            datum=timezone.now().date(),
+            aantal=7,
+        )
+        with self.assertNumQueries(1):
+            self.assertEqual(kopie.origineel().aantal, 2)
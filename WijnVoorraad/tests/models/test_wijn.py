@@ -156,8 +156,8 @@ class TestWijn(SharedTestDataMixin, TestCase):
             wijn.check_afsluiten()
             self.assertIsNone(wijn.datumAfgesloten)
 
-    def test_check_fuzzy_selectie_various_fields(self):
-        """Test that check_fuzzy_selectie returns True if the search string
+    def test_fuzzy_various_fields(self):
+        """Test that fuzzy() selects the wine if the search string
         matches any relevant field."""
         wijn = Wijn.objects.create(
             domein="Chateau Test",
@@ -169,39 +169,50 @@ class TestWijn(SharedTestDataMixin, TestCase):
             classificatie="AOC",
             opmerking="Zeer fruitig",
         )
-        # druif = DruivenSoort.objects.create(omschrijving="Merlot")
         wijn.wijnDruivensoorten.add(self.druif)
 
-        # Should match on naam
-        self.assertTrue(wijn.check_fuzzy_selectie("testwijn"))
-        # Should match on domein
-        self.assertTrue(wijn.check_fuzzy_selectie("chateau"))
-        # Should match on wijnsoort
-        self.assertTrue(wijn.check_fuzzy_selectie(self.wijnsoort.omschrijving.lower()))
-        # Should match on jaar
-        self.assertTrue(wijn.check_fuzzy_selectie("2021"))
-        # Should match on land
-        self.assertTrue(wijn.check_fuzzy_selectie("frankrijk"))
-        # Should match on streek
-        self.assertTrue(wijn.check_fuzzy_selectie("bordeaux"))
-        # Should match on classificatie
-        self.assertTrue(wijn.check_fuzzy_selectie("aoc"))
-        # Should match on opmerking
-        self.assertTrue(wijn.check_fuzzy_selectie("fruitig"))
-        # Should match on druivensoort
-        self.assertTrue(wijn.check_fuzzy_selectie("merlot"))
-        # Should return True if fuzzy_selectie is empty
-        self.assertTrue(wijn.check_fuzzy_selectie(""))
-        # Should return False for non-matching string
-        self.assertFalse(wijn.check_fuzzy_selectie("nonexistent"))
-
-        # Should be able to handle None values gracefully
-        wijn.classificatie = None
-        self.assertFalse(wijn.check_fuzzy_selectie("abc"))
-
-        # Should be able to handle empty values gracefully
-        wijn.classificatie = ""
-        self.assertFalse(wijn.check_fuzzy_selectie("abc"))
-
-        # should return true if search query is empty
-        self.assertTrue(wijn.check_fuzzy_selectie(""))
+        # naam, domein, wijnsoort, jaar, land, streek, classificatie, opmerking and
+        # druivensoort
+        for term in (
+            "testwijn",
+            "chateau",
+            self.wijnsoort.omschrijving.lower(),
+            "2021",
+            "frankrijk",
+            "bordeaux",
+            "aoc",
+            "fruitig",
+            "merlot",
+        ):
+            self.assertIn(wijn, Wijn.objects.fuzzy(term), term)
+        # Should return all wines if fuzzy_selectie is empty
+        self.assertIn(wijn, Wijn.objects.fuzzy(""))
+        # Should return nothing for non-matching string
+        self.assertFalse(Wijn.objects.fuzzy("nonexistent").exists())
+
+    def test_save_fills_search_blob_lower_case_without_accents(self):
+        """Test that save() stores the normalised search text in search_blob."""
+        wijn = Wijn.objects.create(
+            domein="Château Léoville", naam="Clos", wijnsoort=self.wijnsoort, jaar=2016
+        )
+        wijn.refresh_from_db()
+        self.assertIn("chateau leoville", wijn.search_blob)
+        self.assertIn("2016", wijn.search_blob)
+        self.assertIn(self.wijnsoort.omschrijving.lower(), wijn.search_blob)
+
+    def test_search_blob_follows_druivensoorten(self):
+        """Test that search_blob is updated when grapes are added or removed."""
+        wijn = Wijn.objects.create(domein="D", naam="N", wijnsoort=self.wijnsoort)
+        wijn.wijnDruivensoorten.add(self.druif2)
+        wijn.refresh_from_db()
+        self.assertIn("cabernet sauvignon", wijn.search_blob)
+        wijn.wijnDruivensoorten.remove(self.druif2)
+        wijn.refresh_from_db()
+        self.assertNotIn("cabernet", wijn.search_blob)
+
+    def test_search_blob_follows_wijnsoort_omschrijving(self):
+        """Test that search_blob is updated when the wijnsoort is renamed."""
+        self.wijnsoort.omschrijving = "Rosé"
+        self.wijnsoort.save()
+        self.wijn.refresh_from_db()
+        self.assertIn("rose", self.wijn.search_blob)
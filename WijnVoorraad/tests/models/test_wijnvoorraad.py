@@ -12,7 +12,9 @@ from WijnVoorraad.models import (
     Ontvangst,
     Locatie,
     Vak,
+    VoorraadOverzichtRegel,
 )
+from WijnVoorraad.wijnvars import VOORRAAD_VOLGORDE, SorteringEnum
 
 
 class TestWijnVoorraad(TestCase):
@@ -131,69 +133,23 @@ class TestWijnVoorraad(TestCase):
         wijnvoorraad.drinken()
         mock_drinken.assert_called_once_with(self.ontvangst, self.locatie, self.vak)
 
-    def test_check_fuzzy_selectie_lazy_true_on_wijn(self):
-        """Test that check_fuzzy_selectie returns True if wijn matches.
-        and Ontvangst is not called.
-        """
-        # create a WijnVoorraad instance
-        wijnvoorraad = WijnVoorraad(
-            wijn=self.wijn,
-            deelnemer=self.deelnemer,
-            ontvangst=self.ontvangst,
-            locatie=self.locatie,
-            vak=self.vak,
-        )
-        # setup mocks
-
-        wijnvoorraad.wijn.check_fuzzy_selectie = MagicMock(return_value=True)
-        wijnvoorraad.ontvangst.check_fuzzy_selectie = MagicMock()
-        wijnvoorraad.wijn.check_fuzzy_selectie.return_value = True
-
-        # Call the method under test
-        result = wijnvoorraad.check_fuzzy_selectie("foo")
-        self.assertTrue(result)
-        wijnvoorraad.ontvangst.check_fuzzy_selectie.assert_not_called()
-
-    def test_check_fuzzy_selectie_true_on_ontvangst(self):
-        wijnvoorraad = WijnVoorraad(
-            wijn=self.wijn,
-            deelnemer=self.deelnemer,
-            ontvangst=self.ontvangst,
-            locatie=self.locatie,
-            vak=self.vak,
-        )
-        wijnvoorraad.wijn.check_fuzzy_selectie = MagicMock(return_value=False)
-        wijnvoorraad.ontvangst.check_fuzzy_selectie = MagicMock(return_value=True)
-
-        result = wijnvoorraad.check_fuzzy_selectie("foo")
-        self.assertTrue(result)
-        wijnvoorraad.ontvangst.check_fuzzy_selectie.assert_called_once_with("foo")
-
-    def test_check_fuzzy_selectie_false_on_both(self):
-        wijnvoorraad = WijnVoorraad(
+    def test_fuzzy_matches_on_wijn_or_ontvangst(self):
+        """Test that fuzzy() selects the voorraad if the wijn or ontvangst matches."""
+        wijnvoorraad = WijnVoorraad.objects.create(
             wijn=self.wijn,
             deelnemer=self.deelnemer,
             ontvangst=self.ontvangst,
             locatie=self.locatie,
             vak=self.vak,
         )
-        wijnvoorraad.wijn.check_fuzzy_selectie = MagicMock(return_value=False)
-        wijnvoorraad.ontvangst.check_fuzzy_selectie = MagicMock(return_value=False)
+        self.ontvangst.leverancier = "Gulpener"
+        self.ontvangst.save()
 
-        result = wijnvoorraad.check_fuzzy_selectie("foo")
-        self.assertFalse(result)
-        wijnvoorraad.ontvangst.check_fuzzy_selectie.assert_called_once_with("foo")
-
-    def test_check_fuzzy_selectie_true_on_empty_param(self):
-        wijnvoorraad = WijnVoorraad(
-            wijn=self.wijn,
-            deelnemer=self.deelnemer,
-            ontvangst=self.ontvangst,
-            locatie=self.locatie,
-            vak=self.vak,
-        )
-        result = wijnvoorraad.check_fuzzy_selectie("")
-        self.assertTrue(result)
+        for term in ("wijnx", "gulpener", ""):
+            self.assertEqual(
+                list(WijnVoorraad.objects.fuzzy(term)), [wijnvoorraad], term
+            )
+        self.assertFalse(WijnVoorraad.objects.fuzzy("foo").exists())
 
     #  WijnVoorraad.verplaatsen should call VoorraadMutatie.verplaatsen
     @patch("WijnVoorraad.models.VoorraadMutatie.verplaatsen")
@@ -289,138 +245,185 @@ class TestWijnVoorraadMutatieMethods(TestCase):
         )
         self.vak = Vak.objects.create(locatie=self.locatie, code="A1", capaciteit=10)
 
-    @patch("WijnVoorraad.models.Wijn.check_afsluiten")
-    def test_bijwerken_mutatie_in_updates_existing(self, mock_check_afsluiten):
-        """IN: voorraad found, updated, check_afsluiten called."""
-        # create existing WijnVoorraad
-        vrd = WijnVoorraad.objects.create(
+    def _voorraad(self, aantal, vak=None):
+        return WijnVoorraad.objects.create(
             wijn=self.wijn,
             deelnemer=self.deelnemer,
             ontvangst=self.ontvangst,
             locatie=self.locatie,
-            vak=self.vak,
-            aantal=5,
+            vak=vak,
+            aantal=aantal,
         )
-        # create a mock mutatie
-        mutatie = MagicMock()
-        mutatie.ontvangst = self.ontvangst
-        mutatie.locatie = self.locatie
-        mutatie.vak = self.vak
-        mutatie.aantal = 3
-        mutatie.ontvangst.wijn = self.wijn
-        mutatie.ontvangst.deelnemer = self.deelnemer
 
-        WijnVoorraad.Bijwerken_mutatie_IN(mutatie)
+    def _mutatie(self, aantal, vak=None):
+        # not saved, Bijwerken_mutatie_IN/UIT only use the ids and the aantal
+        return VoorraadMutatie(
+            ontvangst=self.ontvangst, locatie=self.locatie, vak=vak, aantal=aantal
+        )
+
+    @patch("WijnVoorraad.models.Wijn.afsluiten_na_commit")
+    def test_bijwerken_mutatie_in_updates_existing(self, mock_afsluiten_na_commit):
+        """IN: voorraad found and updated, the wine is not checked."""
+        vrd = self._voorraad(5, self.vak)
+
+        WijnVoorraad.Bijwerken_mutatie_IN(self._mutatie(3, self.vak))
         vrd.refresh_from_db()
-        # voorraad should be updated
         self.assertEqual(vrd.aantal, 8)
-        # check_afsluiten should be called
-        mock_check_afsluiten.assert_called_once_with()
-
-    @patch("WijnVoorraad.models.Wijn.check_afsluiten")
-    def test_bijwerken_mutatie_in_creates_new(self, mock_check_afsluiten):
-        """IN: voorraad not found, new record created, check_afsluiten called."""
-        mutatie = MagicMock()
-        mutatie.ontvangst = self.ontvangst
-        mutatie.locatie = self.locatie
-        mutatie.vak = self.vak
-        mutatie.aantal = 4
-        mutatie.ontvangst.wijn = self.wijn
-        mutatie.ontvangst.deelnemer = self.deelnemer
-
-        WijnVoorraad.Bijwerken_mutatie_IN(mutatie)
+        mock_afsluiten_na_commit.assert_not_called()
+
+    @patch("WijnVoorraad.models.Wijn.afsluiten_na_commit")
+    def test_bijwerken_mutatie_in_creates_new(self, mock_afsluiten_na_commit):
+        """IN: voorraad not found, new record created, the wine is checked."""
+        WijnVoorraad.Bijwerken_mutatie_IN(self._mutatie(4, self.vak))
         vrd = WijnVoorraad.objects.get(
             ontvangst=self.ontvangst, locatie=self.locatie, vak=self.vak
         )
         self.assertEqual(vrd.aantal, 4)
-        mock_check_afsluiten.assert_called_once_with()
+        self.assertEqual(vrd.wijn, self.wijn)
+        self.assertEqual(vrd.deelnemer, self.deelnemer)
+        mock_afsluiten_na_commit.assert_called_once_with(self.wijn.id)
 
     def test_bijwerken_mutatie_in_deletes_on_zero(self):
         """IN: voorraad updated to 0, record deleted"""
-        vrd = WijnVoorraad.objects.create(
-            wijn=self.wijn,
-            deelnemer=self.deelnemer,
-            ontvangst=self.ontvangst,
-            locatie=self.locatie,
-            vak=self.vak,
-            aantal=-2,
-        )
-        mutatie = MagicMock()
-        mutatie.ontvangst = self.ontvangst
-        mutatie.locatie = self.locatie
-        mutatie.vak = self.vak
-        mutatie.aantal = 2
-        mutatie.ontvangst.wijn = self.wijn
-        mutatie.ontvangst.deelnemer = self.deelnemer
+        vrd = self._voorraad(-2, self.vak)
 
-        WijnVoorraad.Bijwerken_mutatie_IN(mutatie)
+        WijnVoorraad.Bijwerken_mutatie_IN(self._mutatie(2, self.vak))
         self.assertFalse(WijnVoorraad.objects.filter(pk=vrd.pk).exists())
 
-    # We do not need to check mock_check_afsluiten here, was already tested above
-
-    @patch("WijnVoorraad.models.Wijn.check_afsluiten")
-    def test_bijwerken_mutatie_uit_updates_existing(self, mock_check_afsluiten):
-        """UIT: voorraad found, updated, check_afsluiten called."""
-        vrd = WijnVoorraad.objects.create(
-            wijn=self.wijn,
-            deelnemer=self.deelnemer,
-            ontvangst=self.ontvangst,
-            locatie=self.locatie,
-            vak=self.vak,
-            aantal=10,
-        )
-        mutatie = MagicMock()
-        mutatie.ontvangst = self.ontvangst
-        mutatie.locatie = self.locatie
-        mutatie.vak = self.vak
-        mutatie.aantal = 4
-        mutatie.ontvangst.wijn = self.wijn
-        mutatie.ontvangst.deelnemer = self.deelnemer
+    @patch("WijnVoorraad.models.Wijn.afsluiten_na_commit")
+    def test_bijwerken_mutatie_uit_updates_existing(self, mock_afsluiten_na_commit):
+        """UIT: voorraad found and updated, the wine is not checked."""
+        vrd = self._voorraad(10, self.vak)
 
-        WijnVoorraad.Bijwerken_mutatie_UIT(mutatie)
+        WijnVoorraad.Bijwerken_mutatie_UIT(self._mutatie(4, self.vak))
         vrd.refresh_from_db()
         self.assertEqual(vrd.aantal, 6)
-        mock_check_afsluiten.assert_called_once_with()
-
-    @patch("WijnVoorraad.models.Wijn.check_afsluiten")
-    def test_bijwerken_mutatie_uit_creates_new(self, mock_check_afsluiten):
-        """UIT: voorraad not found, new record created with negative aantal, check_afsluiten called."""
-        mutatie = MagicMock()
-        mutatie.ontvangst = self.ontvangst
-        mutatie.locatie = self.locatie
-        mutatie.vak = self.vak
-        mutatie.aantal = 3
-        mutatie.ontvangst.wijn = self.wijn
-        mutatie.ontvangst.deelnemer = self.deelnemer
-
-        WijnVoorraad.Bijwerken_mutatie_UIT(mutatie)
+        mock_afsluiten_na_commit.assert_not_called()
+
+    @patch("WijnVoorraad.models.Wijn.afsluiten_na_commit")
+    def test_bijwerken_mutatie_uit_creates_new(self, mock_afsluiten_na_commit):
+        """UIT: voorraad not found, new record created with negative aantal, the wine is checked."""
+        WijnVoorraad.Bijwerken_mutatie_UIT(self._mutatie(3, self.vak))
         vrd = WijnVoorraad.objects.get(
             ontvangst=self.ontvangst, locatie=self.locatie, vak=self.vak
         )
         self.assertEqual(vrd.aantal, -3)
-        mock_check_afsluiten.assert_called_once_with()
+        mock_afsluiten_na_commit.assert_called_once_with(self.wijn.id)
 
-    def test_bijwerken_mutatie_uit_deletes_on_zero(self):
-        """UIT: voorraad updated to 0, record deleted."""
-        vrd = WijnVoorraad.objects.create(
-            wijn=self.wijn,
-            deelnemer=self.deelnemer,
+    @patch("WijnVoorraad.models.Wijn.afsluiten_na_commit")
+    def test_bijwerken_mutatie_uit_deletes_on_zero(self, mock_afsluiten_na_commit):
+        """UIT: voorraad updated to 0, record deleted, the wine is checked."""
+        vrd = self._voorraad(2, self.vak)
+
+        WijnVoorraad.Bijwerken_mutatie_UIT(self._mutatie(2, self.vak))
+        self.assertFalse(WijnVoorraad.objects.filter(pk=vrd.pk).exists())
+        mock_afsluiten_na_commit.assert_called_once_with(self.wijn.id)
+
+    def test_bijwerken_mutatie_without_vak_updates_existing(self):
+        """Without a vak the existing entry is updated, not duplicated."""
+        vrd = self._voorraad(5)
+
+        WijnVoorraad.Bijwerken_mutatie_IN(self._mutatie(2))
+        WijnVoorraad.Bijwerken_mutatie_UIT(self._mutatie(1))
+        vrd.refresh_from_db()
+        self.assertEqual(vrd.aantal, 6)
+        self.assertEqual(WijnVoorraad.objects.filter(ontvangst=self.ontvangst).count(), 1)
+
+    def test_bijwerken_mutatie_uit_statements(self):
+        """Drinking a bottle is one statement, the last bottle two and the
+        closing of the wine when the transaction commits."""
+        self._voorraad(2, self.vak)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            with self.assertNumQueries(1):
+                WijnVoorraad.Bijwerken_mutatie_UIT(self._mutatie(1, self.vak))
+        self.assertEqual(callbacks, [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            # upsert and delete of the empty entry
+            with self.assertNumQueries(2):
+                WijnVoorraad.Bijwerken_mutatie_UIT(self._mutatie(1, self.vak))
+        self.wijn.refresh_from_db()
+        self.assertIsNotNone(self.wijn.datumAfgesloten)
+
+    def test_bijwerken_mutatie_in_reopens_wine(self):
+        """A new stock entry reopens a closed wine, a closed wine keeps its date."""
+        self.wijn.datumAfgesloten = datetime.datetime(2024, 1, 1)
+        self.wijn.save()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            WijnVoorraad.Bijwerken_mutatie_IN(self._mutatie(1))
+        self.wijn.refresh_from_db()
+        self.assertIsNone(self.wijn.datumAfgesloten)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            WijnVoorraad.Bijwerken_mutatie_UIT(self._mutatie(1))
+        self.wijn.refresh_from_db()
+        afgesloten = self.wijn.datumAfgesloten
+        self.assertIsNotNone(afgesloten)
+        Wijn.afsluiten_bijwerken(self.wijn.id)
+        self.wijn.refresh_from_db()
+        self.assertEqual(self.wijn.datumAfgesloten, afgesloten)
+
+    def test_aantal_afboeken_lowers_stock(self):
+        vrd = self._voorraad(3, self.vak)
+        with self.assertNumQueries(1):
+            WijnVoorraad.aantal_afboeken(
+                self.ontvangst.id, self.locatie.id, self.vak.id, 2
+            )
+        vrd.refresh_from_db()
+        self.assertEqual(vrd.aantal, 1)
+
+    def test_aantal_afboeken_not_enough_stock_raises_error(self):
+        vrd = self._voorraad(1)
+        with self.assertRaises(ValidationError):
+            WijnVoorraad.aantal_afboeken(self.ontvangst.id, self.locatie.id, None, 2)
+        with self.assertRaises(ValidationError):
+            # no stock in this vak
+            WijnVoorraad.aantal_afboeken(
+                self.ontvangst.id, self.locatie.id, self.vak.id, 1
+            )
+        vrd.refresh_from_db()
+        self.assertEqual(vrd.aantal, 1)
+
+    def test_drinken_last_bottle_twice(self):
+        """The second drink of the last bottle fails and saves no mutation."""
+        VoorraadMutatie(
             ontvangst=self.ontvangst,
             locatie=self.locatie,
-            vak=self.vak,
-            aantal=2,
+            in_uit="I",
+            actie="K",
+            datum=datetime.date.today(),
+            aantal=1,
+        ).save()
+        VoorraadMutatie.drinken(self.ontvangst, self.locatie)
+        with self.assertRaises(ValidationError):
+            VoorraadMutatie.drinken(self.ontvangst, self.locatie)
+        self.assertFalse(WijnVoorraad.objects.filter(ontvangst=self.ontvangst).exists())
+        self.assertEqual(VoorraadMutatie.objects.filter(actie="D").count(), 1)
+
+    def test_wines_are_checked_once_per_transaction(self):
+        """All wines touched in one transaction are checked with one statement."""
+        wijn2 = Wijn.objects.create(domein="DomeinY", naam="WijnY", wijnsoort_id=1)
+        ontvangst2 = Ontvangst.objects.create(
+            deelnemer=self.deelnemer, wijn=wijn2, datumOntvangst="2024-01-01"
         )
-        mutatie = MagicMock()
-        mutatie.ontvangst = self.ontvangst
-        mutatie.locatie = self.locatie
-        mutatie.vak = self.vak
-        mutatie.aantal = 2
-        mutatie.ontvangst.wijn = self.wijn
-        mutatie.ontvangst.deelnemer = self.deelnemer
-
-        WijnVoorraad.Bijwerken_mutatie_UIT(mutatie)
-        self.assertFalse(WijnVoorraad.objects.filter(pk=vrd.pk).exists())
-        # no need to check check_afsluiten here, was already tested above
+        mutaties = [
+            VoorraadMutatie(ontvangst=ontvangst, locatie=self.locatie, aantal=1)
+            for ontvangst in (self.ontvangst, ontvangst2, self.ontvangst)
+        ]
+        with self.captureOnCommitCallbacks() as callbacks:
+            for mutatie in mutaties:
+                WijnVoorraad.Bijwerken_mutatie_IN(mutatie)
+            WijnVoorraad.Bijwerken_mutatie_UIT(mutaties[0])
+        # the UPDATE of the wines and the version of the result cache
+        with self.assertNumQueries(2):
+            for callback in callbacks:
+                callback()
+        self.wijn.refresh_from_db()
+        wijn2.refresh_from_db()
+        self.assertIsNone(self.wijn.datumAfgesloten)
+        self.assertIsNone(wijn2.datumAfgesloten)
 
     # given an existing mutation (old_mutation), type I with amount 4 and for the same location, vak and ontvangst
     # is stock level 8, check_voorraad_wijziging without mutation should give no warning
@@ -980,3 +983,95 @@ class TestWijnVoorraadMutatieMethods(TestCase):
         ):
             with self.assertRaises(ValidationError):
                 WijnVoorraad.check_voorraad_wijziging(new_mutatie, None)
+
+
+class TestWijnVoorraadOverzicht(TestCase):
+    """Tests for WijnVoorraadQuerySet.overzicht and VoorraadOverzichtRegel."""
+
+    def setUp(self):
+        self.locatie = Locatie.objects.create(omschrijving="Kelder", aantal_kolommen=1)
+        self.deelnemer = Deelnemer.objects.create(naam="Jan")
+        self.rood = WijnSoort.objects.create(omschrijving="Rood")
+        self.wit = WijnSoort.objects.create(omschrijving="Wit")
+        self.vak1 = Vak.objects.create(locatie=self.locatie, code="A1", capaciteit=10)
+        self.vak2 = Vak.objects.create(locatie=self.locatie, code="A2", capaciteit=10)
+        self.wijn_oud = Wijn.objects.create(
+            domein="B", naam="Oud", wijnsoort=self.wit, jaar=2010
+        )
+        self.wijn_jong = Wijn.objects.create(
+            domein="A", naam="Jong", wijnsoort=self.rood, jaar=2020
+        )
+        self.ontvangst_oud = self.create_ontvangst(self.wijn_oud, "2024-03-01", 30)
+        self.ontvangst_jong = self.create_ontvangst(self.wijn_jong, "2024-01-01", 10)
+        self.create_voorraad(self.ontvangst_oud, self.vak1, 2, 1)
+        self.create_voorraad(self.ontvangst_oud, self.vak2, 3, 0)
+        self.create_voorraad(self.ontvangst_jong, self.vak1, 4, 2)
+
+    def create_ontvangst(self, wijn, datum, prijs):
+        return Ontvangst.objects.create(
+            deelnemer=self.deelnemer,
+            wijn=wijn,
+            datumOntvangst=datetime.date.fromisoformat(datum),
+            prijs=prijs,
+        )
+
+    def create_voorraad(self, ontvangst, vak, aantal, aantal_rsv):
+        WijnVoorraad.objects.create(
+            wijn=ontvangst.wijn,
+            deelnemer=self.deelnemer,
+            ontvangst=ontvangst,
+            locatie=self.locatie,
+            vak=vak,
+            aantal=aantal,
+            aantal_rsv=aantal_rsv,
+        )
+
+    def overzicht(self, sortering):
+        return list(WijnVoorraad.objects.overzicht(*VOORRAAD_VOLGORDE[sortering]))
+
+    def test_overzicht_sums_aantal_and_aantal_rsv_over_vakken(self):
+        rijen = {r["ontvangst"]: r for r in self.overzicht(SorteringEnum.WIJNONTVANGST)}
+        self.assertEqual(len(rijen), 2)
+        self.assertEqual(rijen[self.ontvangst_oud.id]["aantal"], 5)
+        self.assertEqual(rijen[self.ontvangst_oud.id]["aantal_rsv"], 1)
+        self.assertEqual(rijen[self.ontvangst_jong.id]["aantal"], 4)
+
+    def test_overzicht_sorts_in_sql(self):
+        def wijnen(sortering):
+            return [r["wijn"] for r in self.overzicht(sortering)]
+
+        oud, jong = self.wijn_oud.id, self.wijn_jong.id
+        self.assertEqual(wijnen(SorteringEnum.WIJNONTVANGST), [oud, jong])
+        self.assertEqual(wijnen(SorteringEnum.ONTVANGSTWIJN), [jong, oud])
+        self.assertEqual(wijnen(SorteringEnum.ONTVANGSTDESCWIJN), [oud, jong])
+        self.assertEqual(wijnen(SorteringEnum.JAARWIJN), [oud, jong])
+        self.assertEqual(wijnen(SorteringEnum.PRIJSWIJN), [oud, jong])
+        self.assertEqual(wijnen(SorteringEnum.WIJNSOORTWIJN), [jong, oud])
+
+    def test_overzicht_uses_one_query_and_one_for_druivensoorten(self):
+        with self.assertNumQueries(2):
+            regels = VoorraadOverzichtRegel.van_rijen(
+                WijnVoorraad.objects.overzicht("wijn")
+            )
+            for regel in regels:
+                _ = (
+                    regel.wijn.volle_naam,
+                    regel.wijn.wijnsoort.style_css_class,
+                    list(regel.wijn.wijnDruivensoorten.all()),
+                    regel.locatie.id,
+                    regel.ontvangst.id,
+                )
+        self.assertEqual(regels[0].wijn.volle_naam, self.wijn_oud.volle_naam)
+        self.assertEqual(regels[0].wijn.wijnsoort.omschrijving, "Wit")
+
+    def test_voor_sleutels_returns_only_the_keys_asked_for(self):
+        sleutels = [
+            (self.ontvangst_oud.id, self.locatie.id, self.vak1.id),
+            (self.ontvangst_jong.id, self.locatie.id, self.vak2.id),
+        ]
+        with self.assertNumQueries(1):
+            voorraad = WijnVoorraad.objects.voor_sleutels(sleutels)
+        self.assertEqual(list(voorraad), sleutels[:1])
+        self.assertEqual(voorraad[sleutels[0]].aantal, 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(WijnVoorraad.objects.voor_sleutels([]), {})
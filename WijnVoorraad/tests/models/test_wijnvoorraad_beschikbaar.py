@@ -0,0 +1,104 @@
+"""Unit tests for the available stock (WijnVoorraad.aantal_beschikbaar)."""
+
+from django.core.exceptions import ValidationError
+from django.test import TestCase
+from WijnVoorraad.models import (
+    Bestelling,
+    BestellingRegel,
+    VoorraadMutatie,
+    WijnVoorraad,
+)
+from WijnVoorraad.tests.models.model_helper import SharedTestDataMixin
+
+
+class TestAantalBeschikbaar(SharedTestDataMixin, TestCase):
+    """aantal_beschikbaar is aantal minus aantal_rsv, and reservations check it."""
+
+    def setUp(self):
+        self.create_voorraad(5)
+        self.create_voorraad(2, vak=self.vak_a1)
+        self.bestelling = self.create_bestelling()
+
+    def voorraad(self, vak=None):
+        return WijnVoorraad.objects.get(ontvangst=self.ontvangst, vak=vak)
+
+    def reserveren(self, aantal, vak=None):
+        WijnVoorraad.rsv_reserveren(self.ontvangst.id, self.locatie.id, vak, aantal)
+
+    def test_generated_column(self):
+        self.create_bestellingregel(self.bestelling, aantal=2)
+        self.assertEqual(self.voorraad().aantal_beschikbaar, 3)
+        VoorraadMutatie.drinken(self.ontvangst, self.locatie)
+        self.assertEqual(self.voorraad().aantal_beschikbaar, 2)
+
+    def test_bestelbaar(self):
+        self.create_bestellingregel(self.bestelling, vak=self.vak_a1, aantal=2)
+        self.assertEqual(
+            list(WijnVoorraad.objects.bestelbaar().values_list("vak", flat=True)),
+            [None],
+        )
+
+    def test_reserveren(self):
+        self.reserveren(5)
+        self.assertEqual(self.voorraad().aantal_rsv, 5)
+        self.reserveren(-2)
+        self.assertEqual(self.voorraad().aantal_rsv, 3)
+
+    def test_reserveren_not_enough_stock(self):
+        self.reserveren(1, self.vak_a1.id)
+        with self.assertRaisesMessage(ValidationError, "niet voldoende voorraad"):
+            self.reserveren(2, self.vak_a1.id)
+        self.assertEqual(self.voorraad(self.vak_a1).aantal_rsv, 1)
+
+    def test_reserveren_no_stock(self):
+        vak = self.create_vak("B1", 10)
+        with self.assertRaisesMessage(ValidationError, "geen voorraad"):
+            self.reserveren(1, vak.id)
+
+    def test_regel_saved_after_stock_is_drunk(self):
+        """Only the difference is reserved, so an unchanged reservation still fits."""
+        regel = self.create_bestellingregel(self.bestelling, aantal=4)
+        VoorraadMutatie.drinken(self.ontvangst, self.locatie)
+        regel.opmerking = "later"
+        regel.save()
+        regel.aantal = 5
+        with self.assertRaises(ValidationError):
+            regel.save()
+        regel.aantal = 3
+        regel.save()
+        self.assertEqual(self.voorraad().aantal_rsv, 3)
+        self.assertEqual(BestellingRegel.objects.get().aantal, 3)
+
+    def test_rejected_save_is_rolled_back(self):
+        """A correction above the available stock leaves the regel, the reservation
+        and the totals of the bestelling as they were."""
+        self.create_voorraad(1, vak=self.vak_a1)
+        regel = self.create_bestellingregel(self.bestelling, vak=self.vak_a1, aantal=2)
+        regel.aantal_correctie = 5
+        regel.isVerzameld = True
+        with self.assertRaisesMessage(ValidationError, "niet voldoende voorraad"):
+            regel.save()
+        opgeslagen = BestellingRegel.objects.get()
+        self.assertEqual(
+            (opgeslagen.aantal_correctie, opgeslagen.isVerzameld), (None, False)
+        )
+        self.assertEqual(self.voorraad(self.vak_a1).aantal_rsv, 2)
+        bestelling = Bestelling.objects.get(pk=self.bestelling.pk)
+        self.assertEqual((bestelling.tot_aantal, bestelling.aantal_verzameld), (2, 0))
+
+        regel.aantal_correctie = 3
+        regel.save()
+        self.assertEqual(self.voorraad(self.vak_a1).aantal_rsv, 3)
+
+    def test_rejected_new_regel_is_not_saved(self):
+        regel = BestellingRegel(
+            bestelling=self.bestelling,
+            ontvangst=self.ontvangst,
+            vak=self.vak_a1,
+            aantal=3,
+        )
+        with self.assertRaises(ValidationError):
+            regel.save()
+        self.assertIsNone(regel.pk)
+        self.assertFalse(BestellingRegel.objects.exists())
+        self.assertEqual(Bestelling.objects.get(pk=self.bestelling.pk).tot_aantal, 0)
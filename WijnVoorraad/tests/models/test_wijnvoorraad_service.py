@@ -0,0 +1,297 @@
+"""Unit tests for the checks, the bulk move, the stock at a date and the reservations of
+WijnVoorraadService."""
+
+from datetime import date, timedelta
+
+from django.core.exceptions import ValidationError
+from django.test import TestCase
+from WijnVoorraad.models import (
+    BestellingRegel,
+    Ontvangst,
+    VoorraadMomentopname,
+    VoorraadMutatie,
+    WijnSoort,
+    WijnVoorraad,
+)
+from WijnVoorraad.services import WijnVoorraadService
+from WijnVoorraad.tests.models.model_helper import SharedTestDataMixin
+
+VELDEN = (
+    "aantal_records_vrd",
+    "tot_aantal_vrd",
+    "tot_aantal_rsv",
+    "aantal_records_mut_in",
+    "tot_aantal_mut_in",
+    "aantal_records_mut_uit",
+    "tot_aantal_mut_uit",
+    "aantal_records_bst",
+    "tot_aantal_bst",
+    "aantal_vrd_mut",
+    "klopt",
+    "klopt_rsv",
+)
+
+
+class TestWijnVoorraadServiceControle(SharedTestDataMixin, TestCase):
+    """ControleerAlle* must give the same result as the checks per object."""
+
+    def setUp(self):
+        # voorraad without mutaties: does not match
+        WijnVoorraad.objects.bulk_create(
+            [
+                WijnVoorraad(
+                    wijn=self.wijn,
+                    deelnemer=self.deelnemer,
+                    ontvangst=self.ontvangst,
+                    locatie=self.locatie,
+                    aantal=2,
+                )
+            ]
+        )
+        self.goed = Ontvangst.objects.create(
+            deelnemer=self.deelnemer,
+            wijn=self.wijn,
+            datumOntvangst=self.ontvangst.datumOntvangst,
+        )
+
+    def test_controleer_alle_ontvangsten(self):
+        with self.assertNumQueries(4):
+            fout = WijnVoorraadService.ControleerAlleOntvangsten()
+        self.assertEqual(fout, [self.ontvangst])
+        verwacht = WijnVoorraadService.ControleerOntvangst(
+            Ontvangst.objects.get(pk=self.ontvangst.pk)
+        )
+        for veld in VELDEN:
+            self.assertEqual(getattr(fout[0], veld), getattr(verwacht, veld), veld)
+
+    def test_controleer_alle_locaties(self):
+        fout = WijnVoorraadService.ControleerAlleLocaties()
+        self.assertEqual(fout, [self.locatie])
+        verwacht = WijnVoorraadService.ControleerLocatie(self.locatie)
+        for veld in VELDEN:
+            self.assertEqual(getattr(fout[0], veld), getattr(verwacht, veld), veld)
+        self.assertEqual(fout[0].tot_aantal_vrd, 2)
+        self.assertEqual(fout[0].klopt, "Nee")
+
+
+class TestWijnVoorraadServiceAllesVerplaatsen(SharedTestDataMixin, TestCase):
+    """AllesVerplaatsen moves all selected stock and its open reservations at once."""
+
+    def setUp(self):
+        self.create_voorraad(3, vak=self.vak_a1)
+        self.ander = Ontvangst.objects.create(
+            deelnemer=self.deelnemer,
+            wijn=self.wijn,
+            datumOntvangst=self.ontvangst.datumOntvangst,
+        )
+        self.create_voorraad(2, ontvangst=self.ander, vak=self.vak_a1)
+
+    def aantallen(self, vak):
+        return dict(
+            WijnVoorraad.objects.filter(vak=vak).values_list("ontvangst_id", "aantal")
+        )
+
+    def test_all_stock_of_a_vak_is_moved(self):
+        aantal = WijnVoorraadService.AllesVerplaatsen(
+            self.locatie, self.locatie, van_vak=self.vak_a1, naar_vak=self.vak_a2
+        )
+        self.assertEqual(aantal, 5)
+        self.assertEqual(self.aantallen(self.vak_a1), {})
+        self.assertEqual(
+            self.aantallen(self.vak_a2), {self.ontvangst.id: 3, self.ander.id: 2}
+        )
+        self.assertEqual(VoorraadMutatie.objects.filter(actie="V").count(), 4)
+
+    def test_open_reservations_follow_the_bottles(self):
+        bestelling = self.create_bestelling()
+        regel = self.create_bestellingregel(bestelling, vak=self.vak_a1, aantal=2)
+        WijnVoorraadService.AllesVerplaatsen(
+            self.locatie, self.locatie, van_vak=self.vak_a1, naar_vak=self.vak_a2
+        )
+        regel = BestellingRegel.objects.get(pk=regel.pk)
+        self.assertEqual(regel.vak, self.vak_a2)
+        self.assertEqual(
+            WijnVoorraad.objects.get(ontvangst=self.ontvangst, vak=self.vak_a2).aantal_rsv,
+            2,
+        )
+
+    def test_reserved_stock_stays_within_the_locatie(self):
+        bestelling = self.create_bestelling()
+        self.create_bestellingregel(bestelling, vak=self.vak_a1, aantal=1)
+        zolder = self.create_locatie("Zolder")
+        voorbeeld = WijnVoorraadService.AllesVerplaatsenVoorbeeld(self.locatie, zolder)
+        self.assertIsNotNone(voorbeeld["fout"])
+        with self.assertRaises(ValidationError):
+            WijnVoorraadService.AllesVerplaatsen(self.locatie, zolder)
+        self.assertEqual(
+            self.aantallen(self.vak_a1), {self.ontvangst.id: 3, self.ander.id: 2}
+        )
+
+    def test_preview_shows_the_capacity_of_the_new_vak(self):
+        self.create_voorraad(4, vak=self.vak_a2)
+        voorbeeld = WijnVoorraadService.AllesVerplaatsenVoorbeeld(
+            self.locatie, self.locatie, van_vak=self.vak_a1, naar_vak=self.vak_a2
+        )
+        self.assertEqual(voorbeeld["aantal_regels"], 2)
+        self.assertEqual(voorbeeld["aantal_flessen"], 5)
+        self.assertEqual(voorbeeld["in_gebruik"], 4)
+        self.assertEqual(voorbeeld["na_verplaatsen"], 9)
+        self.assertTrue(voorbeeld["past"])
+        self.assertIsNone(voorbeeld["fout"])
+
+    def test_selection_by_wijnsoort(self):
+        wit = WijnSoort.objects.create(omschrijving="Wit")
+        selectie = WijnVoorraadService.AllesVerplaatsenSelectie(
+            self.locatie, self.locatie, naar_vak=self.vak_a2, wijnsoort=wit
+        )
+        self.assertFalse(selectie.exists())
+
+
+class TestWijnVoorraadServiceOpDatum(SharedTestDataMixin, TestCase):
+    """AantallenOpDatum gives the same stock with and without a momentopname."""
+
+    def setUp(self):
+        self.vandaag = date.today()
+        self.boeken("I", 6, 30)
+        self.boeken("U", 2, 20, vak=None)
+        self.boeken("I", 4, 10, vak=self.vak_a1)
+        self.boeken("U", 1, 5, vak=self.vak_a1)
+
+    def boeken(self, in_uit, aantal, dagen_geleden, vak=None):
+        mutatie = VoorraadMutatie(
+            ontvangst=self.ontvangst,
+            locatie=self.locatie,
+            vak=vak,
+            in_uit=in_uit,
+            actie="K" if in_uit == "I" else "D",
+            datum=self.vandaag - timedelta(days=dagen_geleden),
+            aantal=aantal,
+        )
+        mutatie.save()
+        return mutatie
+
+    def op(self, dagen_geleden):
+        return WijnVoorraadService.AantallenOpDatum(
+            self.vandaag - timedelta(days=dagen_geleden)
+        )
+
+    def test_stock_at_date_from_the_mutations(self):
+        self.assertEqual(self.op(40), {})
+        self.assertEqual(self.op(20), {(self.ontvangst.id, self.locatie.id, None): 4})
+        self.assertEqual(
+            self.op(0),
+            {
+                (self.ontvangst.id, self.locatie.id, None): 4,
+                (self.ontvangst.id, self.locatie.id, self.vak_a1.id): 3,
+            },
+        )
+
+    def test_momentopname_gives_the_same_stock(self):
+        verwacht = {dagen: self.op(dagen) for dagen in (40, 20, 8, 5, 0)}
+        WijnVoorraadService.MomentopnameVastleggen(self.vandaag - timedelta(days=8))
+        self.assertEqual(VoorraadMomentopname.objects.count(), 2)
+        for dagen, aantallen in verwacht.items():
+            self.assertEqual(self.op(dagen), aantallen)
+
+    def test_only_mutations_after_the_momentopname_are_read(self):
+        WijnVoorraadService.MomentopnameVastleggen(self.vandaag - timedelta(days=8))
+        VoorraadMutatie.objects.filter(
+            datum__lte=self.vandaag - timedelta(days=8)
+        ).update(aantal=100)
+        self.assertEqual(
+            self.op(0)[(self.ontvangst.id, self.locatie.id, self.vak_a1.id)], 3
+        )
+
+    def test_earlier_mutation_removes_later_momentopnamen(self):
+        WijnVoorraadService.MomentopnameVastleggen(self.vandaag - timedelta(days=25))
+        WijnVoorraadService.MomentopnameVastleggen(self.vandaag - timedelta(days=8))
+        self.boeken("U", 1, 15)
+        self.assertEqual(
+            list(VoorraadMomentopname.objects.values_list("datum", flat=True).distinct()),
+            [self.vandaag - timedelta(days=25)],
+        )
+        self.assertEqual(self.op(0)[(self.ontvangst.id, self.locatie.id, None)], 3)
+
+    def test_mutation_of_today_keeps_the_momentopnamen(self):
+        WijnVoorraadService.MomentopnameVastleggen(self.vandaag - timedelta(days=8))
+        with self.assertNumQueries(0):
+            VoorraadMomentopname.ongeldig_maken(self.vandaag)
+        self.boeken("U", 1, 0, vak=self.vak_a1)
+        self.assertEqual(VoorraadMomentopname.objects.count(), 2)
+
+    def test_no_momentopname_of_today(self):
+        with self.assertRaises(ValidationError):
+            WijnVoorraadService.MomentopnameVastleggen(self.vandaag)
+
+
+class TestWijnVoorraadServiceReserveren(SharedTestDataMixin, TestCase):
+    """BestellingRegelsReserveren: all regels of a selection in one transaction."""
+
+    def setUp(self):
+        self.create_voorraad(5)
+        self.create_voorraad(3, vak=self.vak_a1)
+        self.bestelling = self.create_bestelling()
+
+    def reserveren(self, aantallen):
+        return WijnVoorraadService.BestellingRegelsReserveren(
+            self.bestelling, aantallen
+        )
+
+    def rsv(self, vak=None):
+        return WijnVoorraad.objects.get(ontvangst=self.ontvangst, vak=vak).aantal_rsv
+
+    def test_insert_update_and_delete(self):
+        regel = self.create_bestellingregel(self.bestelling, vak=self.vak_a1, aantal=1)
+        self.assertEqual(self.reserveren({(self.ontvangst.id, None): 4}), 1)
+        self.assertEqual(self.rsv(), 4)
+        self.assertEqual(
+            self.reserveren(
+                {
+                    (self.ontvangst.id, None): 2,
+                    (self.ontvangst.id, self.vak_a1.id): None,
+                }
+            ),
+            2,
+        )
+        self.assertEqual((self.rsv(), self.rsv(self.vak_a1)), (2, 0))
+        self.assertFalse(BestellingRegel.objects.filter(pk=regel.pk).exists())
+        self.bestelling.refresh_from_db()
+        self.assertEqual(self.bestelling.tot_aantal, 2)
+        self.assertIsNone(self.bestelling.datumAfgesloten)
+
+    def test_unchanged_regels_are_not_written(self):
+        self.create_bestellingregel(self.bestelling, aantal=2)
+        self.assertEqual(
+            self.reserveren(
+                {
+                    (self.ontvangst.id, None): 2,
+                    (self.ontvangst.id, self.vak_a1.id): None,
+                }
+            ),
+            0,
+        )
+        self.assertEqual(self.rsv(), 2)
+
+    def test_not_enough_stock_writes_nothing(self):
+        with self.assertRaises(ValidationError):
+            self.reserveren(
+                {(self.ontvangst.id, None): 2, (self.ontvangst.id, self.vak_a1.id): 4}
+            )
+        self.assertFalse(BestellingRegel.objects.exists())
+        self.assertEqual(self.rsv(), 0)
+
+    def test_no_stock(self):
+        with self.assertRaises(ValidationError):
+            self.reserveren({(self.ontvangst.id, self.vak_a2.id): 1})
+
+    def test_processed_regel_can_not_be_changed(self):
+        self.create_bestellingregel(self.bestelling, aantal=2, verwerkt="A")
+        with self.assertRaises(ValidationError):
+            self.reserveren({(self.ontvangst.id, None): 3})
+
+    def test_closes_bestelling_when_no_regels_are_left(self):
+        self.create_bestellingregel(self.bestelling, aantal=2)
+        self.reserveren({(self.ontvangst.id, None): None})
+        self.bestelling.refresh_from_db()
+        self.assertIsNotNone(self.bestelling.datumAfgesloten)
+        self.assertEqual(self.rsv(), 0)
@@ -0,0 +1,372 @@
+"""Unit tests for the full-text search index (zoekindex)."""
+
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from WijnVoorraad import zoekindex
+from WijnVoorraad.forms import WijnWidget
+from WijnVoorraad.models import (
+    DruivenSoort,
+    Ontvangst,
+    VoorraadMutatie,
+    Wijn,
+    WijnDruivensoort,
+    WijnSoort,
+    WijnVoorraad,
+)
+from WijnVoorraad.tests.models.model_helper import SharedTestDataMixin
+
+
+class TestZoekindex(SharedTestDataMixin, TestCase):
+    """Unit tests for the search index and the fuzzy filters based on it."""
+
+    def zoek_wijnen(self, term):
+        return set(Wijn.objects.filter(zoekindex.wijn_q(term)))
+
+    def create_mutatie(self, omschrijving="", ontvangst=None):
+        mutatie = VoorraadMutatie(
+            ontvangst=ontvangst or self.ontvangst,
+            locatie=self.locatie,
+            in_uit="I",
+            actie="K",
+            datum=timezone.now().date(),
+            aantal=1,
+            omschrijving=omschrijving,
+        )
+        mutatie.save()
+        return mutatie
+
+    def test_wijn_is_found_on_substring_case_insensitive(self):
+        wijn = Wijn.objects.create(
+            domein="Château Margaux", naam="Pavillon", wijnsoort=self.wijnsoort
+        )
+        self.assertEqual(self.zoek_wijnen("MARGA"), {wijn})
+        self.assertEqual(self.zoek_wijnen("pav"), {wijn})
+
+    def test_short_term_is_found_without_trigram_match(self):
+        wijn = Wijn.objects.create(
+            domein="Qz", naam="Abc", wijnsoort=self.wijnsoort, jaar=2019
+        )
+        self.assertEqual(self.zoek_wijnen("qz"), {wijn})
+
+    def test_wijn_is_found_on_jaar_and_wijnsoort(self):
+        wit = WijnSoort.objects.create(omschrijving="Witte bourgogne")
+        wijn = Wijn.objects.create(domein="D", naam="N", wijnsoort=wit, jaar=2015)
+        self.assertEqual(self.zoek_wijnen("2015"), {wijn})
+        self.assertEqual(self.zoek_wijnen("bourgogne"), {wijn})
+
+    def test_wijnsoort_change_updates_index(self):
+        wit = WijnSoort.objects.create(omschrijving="Wit")
+        wijn = Wijn.objects.create(domein="D", naam="N", wijnsoort=wit)
+        wit.omschrijving = "Mousserend"
+        wit.save()
+        self.assertEqual(self.zoek_wijnen("mousserend"), {wijn})
+
+    def test_druivensoort_added_via_m2m_updates_index(self):
+        wijn = Wijn.objects.create(domein="D", naam="N", wijnsoort=self.wijnsoort)
+        syrah = DruivenSoort.objects.create(omschrijving="Syrah")
+        wijn.wijnDruivensoorten.add(syrah)
+        self.assertEqual(self.zoek_wijnen("syrah"), {wijn})
+        wijn.wijnDruivensoorten.remove(syrah)
+        self.assertEqual(self.zoek_wijnen("syrah"), set())
+
+    def test_druivensoort_cleared_from_grape_side_updates_index(self):
+        wijn = Wijn.objects.create(domein="D", naam="N", wijnsoort=self.wijnsoort)
+        syrah = DruivenSoort.objects.create(omschrijving="Syrah")
+        syrah.wijn_set.add(wijn)
+        self.assertEqual(self.zoek_wijnen("syrah"), {wijn})
+        syrah.wijn_set.clear()
+        self.assertEqual(self.zoek_wijnen("syrah"), set())
+        wijn.refresh_from_db()
+        self.assertNotIn("syrah", wijn.search_blob)
+
+    def test_druivensoort_added_via_through_model_updates_index(self):
+        wijn = Wijn.objects.create(domein="D", naam="N", wijnsoort=self.wijnsoort)
+        WijnDruivensoort.objects.create(wijn=wijn, druivensoort=self.druif2)
+        self.assertEqual(self.zoek_wijnen("sauvignon"), {wijn})
+
+    def test_save_without_text_change_keeps_search_text(self):
+        """Saves like those of check_afsluiten do not read the druivensoorten."""
+        wijn = Wijn.objects.get(pk=self.wijn.pk)
+        wijn.datumAfgesloten = timezone.now()
+        with CaptureQueriesContext(connection) as queries:
+            wijn.save()
+        self.assertFalse(
+            [q["sql"] for q in queries.captured_queries if "druivensoort" in q["sql"]]
+        )
+
+    def test_save_with_update_fields_stores_search_text(self):
+        wijn = Wijn.objects.get(pk=self.wijn.pk)
+        wijn.naam = "Hernoemd"
+        wijn.save(update_fields=["naam"])
+        wijn.refresh_from_db()
+        self.assertIn("hernoemd", wijn.search_blob)
+        self.assertEqual(self.zoek_wijnen("hernoemd"), {wijn})
+
+    def test_deleted_wijn_is_removed_from_index(self):
+        wijn = Wijn.objects.create(domein="Weg", naam="Ermee", wijnsoort=self.wijnsoort)
+        wijn.delete()
+        self.assertEqual(self.zoek_wijnen("ermee"), set())
+
+    def test_term_with_quotes_does_not_break_match(self):
+        wijn = Wijn.objects.create(
+            domein='Le "Clos"', naam="N", wijnsoort=self.wijnsoort
+        )
+        self.assertEqual(self.zoek_wijnen('"clos"'), {wijn})
+
+    def test_ontvangst_is_found_on_own_fields_and_wijn(self):
+        ontvangst = Ontvangst.objects.create(
+            deelnemer=self.deelnemer,
+            wijn=self.wijn,
+            datumOntvangst=timezone.now().date(),
+            leverancier="Wijnhandel Okhuysen",
+        )
+        self.assertEqual(
+            set(Ontvangst.objects.filter(zoekindex.ontvangst_q("okhuysen"))),
+            {ontvangst},
+        )
+        self.assertEqual(
+            set(Ontvangst.objects.filter(zoekindex.ontvangst_q("domeinx"))),
+            {self.ontvangst, ontvangst},
+        )
+
+    def test_mutatie_filter(self):
+        piet = self.create_mutatie("Verjaardag Piet")
+        etentje = self.create_mutatie("Etentje")
+        for term, verwacht in (
+            ("piet", {piet}),
+            ("etentje", {etentje}),
+            ("domeinx", {piet, etentje}),
+            ("xyz", set()),
+        ):
+            self.assertEqual(
+                set(VoorraadMutatie.objects.filter(zoekindex.mutatie_q(term))),
+                verwacht,
+                term,
+            )
+
+    def test_fuzzy_on_voorraad(self):
+        self.create_mutatie("Test")
+        voorraad = WijnVoorraad.objects.all()
+        self.assertEqual(set(voorraad.fuzzy("wijnx")), set(voorraad))
+        self.assertFalse(voorraad.fuzzy("onbekend").exists())
+
+    def test_accents_are_ignored(self):
+        wijn = Wijn.objects.create(
+            domein="Château Pétrus", naam="N", wijnsoort=self.wijnsoort
+        )
+        self.assertEqual(self.zoek_wijnen("petrus"), {wijn})
+        self.assertEqual(self.zoek_wijnen("CHÂTEAU"), {wijn})
+
+    def test_search_blob_vullen_recalculates_blob_and_index(self):
+        wijn = Wijn.objects.create(domein="D", naam="Opnieuw", wijnsoort=self.wijnsoort)
+        Wijn.objects.filter(pk=wijn.pk).update(search_blob="")
+        zoekindex.wijn_verwijderen(wijn.pk)
+        call_command("search_blob_vullen", chunk=1, stdout=StringIO())
+        wijn.refresh_from_db()
+        self.assertIn("opnieuw", wijn.search_blob)
+        self.assertEqual(self.zoek_wijnen("opnieuw"), {wijn})
+
+    def test_opbouwen_rebuilds_index(self):
+        wijn = Wijn.objects.create(domein="D", naam="Herbouw", wijnsoort=self.wijnsoort)
+        zoekindex.wijn_verwijderen(wijn.pk)
+        self.assertEqual(self.zoek_wijnen("herbouw"), set())
+        zoekindex.opbouwen()
+        self.assertEqual(self.zoek_wijnen("herbouw"), {wijn})
+
+
+class TestFuzzyQuerySet(SharedTestDataMixin, TestCase):
+    """The fuzzy() queryset methods select the same objects with and without search
+    index, comparing text without case and accents."""
+
+    # term: (wijnen, ontvangsten, mutaties) that match it, by the keys of setUpTestData;
+    # a WijnVoorraad matches when its ontvangst does
+    VERWACHT = {
+        "domeinx": ("x", "x", "x"),
+        "WIJNX": ("x", "x", "x"),
+        "rood": ("x rhone", "x rhone", "x fete"),
+        "merlot": ("x blanc", "x blanc", "x blanc"),
+        "2018": ("blanc", "blanc", "blanc"),
+        "gulp": ("", "blanc", "blanc"),
+        "bordeaux": ("blanc", "blanc", "blanc"),
+        "levering": ("", "", "x blanc"),
+        "xyz": ("", "", ""),
+    }
+    # accented terms and data: both paths compare normalised text
+    VERWACHT_ACCENTEN = {
+        "cotes": ("rhone", "rhone", "fete"),
+        "CÔTES": ("rhone", "rhone", "fete"),
+        "rhône": ("rhone", "rhone", "fete"),
+        "sélection": ("rhone", "rhone", "fete"),
+        "fete": ("", "", "fete"),
+        "grenaché": ("rhone", "rhone", "fete"),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        wit = WijnSoort.objects.create(omschrijving="Wit")
+        blanc = Wijn.objects.create(
+            domein="Chateau Y", naam="Blanc", wijnsoort=wit, jaar=2018, streek="Bordeaux"
+        )
+        blanc.wijnDruivensoorten.add(cls.druif1, cls.druif2)
+        cls.wijn.wijnDruivensoorten.add(cls.druif1)
+        ontvangst_blanc = Ontvangst.objects.create(
+            deelnemer=cls.deelnemer,
+            wijn=blanc,
+            datumOntvangst=timezone.now().date(),
+            leverancier="Gulpener",
+        )
+        grenache = DruivenSoort.objects.create(omschrijving="Grenache")
+        rhone = Wijn.objects.create(
+            domein="Domaine Côté",
+            naam="Côtes du Rhône",
+            wijnsoort=cls.wijnsoort,
+            classificatie="Selection",
+        )
+        rhone.wijnDruivensoorten.add(grenache)
+        ontvangst_rhone = Ontvangst.objects.create(
+            deelnemer=cls.deelnemer, wijn=rhone, datumOntvangst=timezone.now().date()
+        )
+        cls.wijnen = {"x": cls.wijn, "blanc": blanc, "rhone": rhone}
+        cls.ontvangsten = {
+            "x": cls.ontvangst,
+            "blanc": ontvangst_blanc,
+            "rhone": ontvangst_rhone,
+        }
+        cls.mutaties = {}
+        for sleutel, ontvangst, omschrijving in (
+            ("fete", ontvangst_rhone, "Fête"),
+            ("x", cls.ontvangst, "Levering"),
+            ("blanc", ontvangst_blanc, "Levering"),
+        ):
+            cls.mutaties[sleutel] = VoorraadMutatie(
+                ontvangst=ontvangst,
+                locatie=cls.locatie,
+                in_uit="I",
+                actie="K",
+                datum=timezone.now().date(),
+                aantal=1,
+                omschrijving=omschrijving,
+            )
+            cls.mutaties[sleutel].save()
+
+    def assert_fuzzy(self, model, term, verwacht):
+        resultaat = list(model.objects.fuzzy(term))
+        self.assertEqual(len(resultaat), len(set(resultaat)), term)
+        self.assertEqual(set(resultaat), verwacht, f"{model.__name__}: {term}")
+
+    def assert_fuzzy_verwacht(self, verwachtingen):
+        for term, (wijnen, ontvangsten, mutaties) in verwachtingen.items():
+            ontvangsten = {self.ontvangsten[s] for s in ontvangsten.split()}
+            self.assert_fuzzy(Wijn, term, {self.wijnen[s] for s in wijnen.split()})
+            self.assert_fuzzy(Ontvangst, term, ontvangsten)
+            self.assert_fuzzy(
+                VoorraadMutatie, term, {self.mutaties[s] for s in mutaties.split()}
+            )
+            self.assert_fuzzy(
+                WijnVoorraad,
+                term,
+                set(WijnVoorraad.objects.filter(ontvangst__in=ontvangsten)),
+            )
+
+    def test_fuzzy(self):
+        self.assert_fuzzy_verwacht(self.VERWACHT)
+
+    @patch("WijnVoorraad.zoekindex.index_beschikbaar", return_value=False)
+    def test_fuzzy_without_index(self, _mock):
+        self.assert_fuzzy_verwacht(self.VERWACHT)
+
+    def test_accented_terms(self):
+        self.assert_fuzzy_verwacht(self.VERWACHT_ACCENTEN)
+
+    @patch("WijnVoorraad.zoekindex.index_beschikbaar", return_value=False)
+    def test_accented_terms_without_index(self, _mock):
+        self.assert_fuzzy_verwacht(self.VERWACHT_ACCENTEN)
+
+    @patch("WijnVoorraad.zoekindex.index_beschikbaar", return_value=False)
+    def test_fuzzy_without_index_uses_search_blob(self, _mock):
+        self.assertEqual(set(Wijn.objects.fuzzy("CABERNET")), {self.wijnen["blanc"]})
+
+    def test_fuzzy_without_term_returns_queryset_unchanged(self):
+        self.assertEqual(Wijn.objects.fuzzy("").count(), Wijn.objects.count())
+
+    def test_fuzzy_is_lazy_and_chainable(self):
+        with self.assertNumQueries(0):
+            queryset = VoorraadMutatie.objects.fuzzy("gulp").filter(in_uit="I")
+        with self.assertNumQueries(1):
+            self.assertEqual(queryset.count(), 1)
+
+
+class TestWijnAutocomplete(SharedTestDataMixin, TestCase):
+    """Ranked and typo tolerant lookup of wines for the WijnWidget."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.wit = WijnSoort.objects.create(omschrijving="Wit")
+        cls.margaux = Wijn.objects.create(
+            domein="Château Margaux", naam="Pavillon Rouge", wijnsoort=cls.wijnsoort,
+            jaar=2015,
+        )
+        cls.margaux_2018 = Wijn.objects.create(
+            domein="Château Margaux", naam="Pavillon Rouge", wijnsoort=cls.wijnsoort,
+            jaar=2018,
+        )
+        cls.blanc = Wijn.objects.create(
+            domein="Château Margaux", naam="Pavillon Blanc", wijnsoort=cls.wit,
+            jaar=2018,
+        )
+        cls.ander = Wijn.objects.create(
+            domein="Domaine Tempier", naam="Bandol", wijnsoort=cls.wijnsoort, jaar=2015
+        )
+
+    def test_normaliseer_removes_accents(self):
+        self.assertEqual(zoekindex.normaliseer("Château Élevé"), "chateau eleve")
+
+    def test_accents_are_ignored(self):
+        ids = zoekindex.zoek_wijnen("chateau margaux")
+        self.assertEqual(
+            set(ids[:3]), {self.margaux.pk, self.margaux_2018.pk, self.blanc.pk}
+        )
+
+    def test_misspelled_term_is_found(self):
+        ids = zoekindex.zoek_wijnen("tempeir bandl")
+        self.assertEqual(ids[0], self.ander.pk)
+
+    def test_jaar_is_weighed(self):
+        ids = zoekindex.zoek_wijnen("margaux 2018")
+        self.assertEqual(set(ids[:2]), {self.margaux_2018.pk, self.blanc.pk})
+
+    def test_wijnsoort_is_weighed(self):
+        ids = zoekindex.zoek_wijnen("pavillon wit")
+        self.assertEqual(ids[0], self.blanc.pk)
+
+    def test_index_follows_wijn_save(self):
+        self.ander.naam = "Cuvée Cabassaou"
+        self.ander.save()
+        self.assertEqual(zoekindex.zoek_wijnen("cabassou")[0], self.ander.pk)
+
+    def test_short_term_returns_none(self):
+        self.assertIsNone(zoekindex.zoek_wijnen("ch"))
+
+    def test_widget_orders_on_rank(self):
+        widget = WijnWidget()
+        widget.queryset = Wijn.objects.all()
+        resultaat = list(widget.filter_queryset(None, "bandol 2015"))
+        self.assertEqual(resultaat[0], self.ander)
+
+    def test_widget_falls_back_to_search_fields(self):
+        widget = WijnWidget()
+        widget.queryset = Wijn.objects.all()
+        self.assertEqual(list(widget.filter_queryset(None, "Ba")), [self.ander])
+
+    def test_widget_without_match_returns_nothing(self):
+        widget = WijnWidget()
+        widget.queryset = Wijn.objects.all()
+        self.assertFalse(widget.filter_queryset(None, "qqqzzz").exists())
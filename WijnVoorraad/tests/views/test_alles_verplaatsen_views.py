@@ -0,0 +1,46 @@
+"""Tests for moving all stock of a locatie or vak at once."""
+
+from django.test import TestCase
+from django.urls import reverse
+from WijnVoorraad.models import WijnVoorraad
+from WijnVoorraad.tests.models.model_helper import SharedTestDataMixin
+
+
+class TestVoorraadAllesVerplaatsen(SharedTestDataMixin, TestCase):
+    """VoorraadAllesVerplaatsen shows a preview first and moves on Verplaatsen."""
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.create_voorraad(3, vak=self.vak_a1)
+        self.url = reverse("WijnVoorraad:allesverplaatsen")
+
+    def gegevens(self, **extra):
+        return {
+            "van_locatie": self.locatie.id,
+            "van_vak": self.vak_a1.id,
+            "naar_locatie": self.locatie.id,
+            "naar_vak": self.vak_a2.id,
+            **extra,
+        }
+
+    def test_preview_does_not_move(self):
+        response = self.client.post(self.url, self.gegevens(Voorbeeld="Voorbeeld"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["voorbeeld"]["aantal_flessen"], 3)
+        self.assertContains(response, 'name="Verplaatsen"')
+        self.assertTrue(WijnVoorraad.objects.filter(vak=self.vak_a1).exists())
+
+    def test_move(self):
+        response = self.client.post(self.url, self.gegevens(Verplaatsen="Verplaatsen"))
+        self.assertRedirects(response, reverse("WijnVoorraad:voorraadlist"))
+        self.assertEqual(WijnVoorraad.objects.get(vak=self.vak_a2).aantal, 3)
+        self.assertFalse(WijnVoorraad.objects.filter(vak=self.vak_a1).exists())
+
+    def test_vak_of_another_locatie_is_refused(self):
+        zolder = self.create_locatie("Zolder")
+        response = self.client.post(
+            self.url, self.gegevens(naar_locatie=zolder.id, Verplaatsen="Verplaatsen")
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context["form"].errors["naar_vak"])
+        self.assertTrue(WijnVoorraad.objects.filter(vak=self.vak_a1).exists())
@@ -0,0 +1,83 @@
+"""Tests for posting the selection of bestellingregels."""
+
+from django.test import TestCase
+from django.urls import reverse
+from WijnVoorraad.models import BestellingRegel, WijnVoorraad
+from WijnVoorraad.tests.models.model_helper import SharedTestDataMixin
+
+
+class TestBestellingRegelsSelecteren(SharedTestDataMixin, TestCase):
+    """BestellingRegelsSelecteren saves all rows with BestellingRegelsReserveren."""
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.create_voorraad(5)
+        self.create_voorraad(3, vak=self.vak_a1)
+        self.bestelling = self.create_bestelling()
+        self.url = reverse(
+            "WijnVoorraad:bestellingregelsselecteren",
+            kwargs=dict(bestelling_id=self.bestelling.id),
+        )
+
+    def posten(self, *aantallen):
+        gegevens = {"bestelling_id": self.bestelling.id, "aantal_vrd": len(aantallen)}
+        for i, (voorraad, aantal) in enumerate(aantallen, start=1):
+            gegevens[f"voorraad_id{i}"] = voorraad.id
+            gegevens[f"aantal_bestellen{i}"] = aantal
+        return self.client.post(self.url, gegevens)
+
+    def test_rows_are_saved(self):
+        zonder_vak = WijnVoorraad.objects.get(vak=None)
+        in_vak = WijnVoorraad.objects.get(vak=self.vak_a1)
+        response = self.posten((zonder_vak, "2"), (in_vak, ""))
+        detail = reverse(
+            "WijnVoorraad:bestellingdetail", kwargs=dict(pk=self.bestelling.id)
+        )
+        self.assertRedirects(response, detail)
+        regel = BestellingRegel.objects.get()
+        self.assertEqual((regel.vak, regel.aantal), (None, 2))
+        zonder_vak.refresh_from_db()
+        self.assertEqual(zonder_vak.aantal_rsv, 2)
+
+    def test_not_enough_stock_returns_to_selection(self):
+        in_vak = WijnVoorraad.objects.get(vak=self.vak_a1)
+        response = self.posten((in_vak, "4"))
+        self.assertRedirects(response, self.url)
+        self.assertFalse(BestellingRegel.objects.exists())
+
+    def test_stock_removed_since_the_page_was_shown(self):
+        zonder_vak = WijnVoorraad.objects.get(vak=None)
+        in_vak = WijnVoorraad.objects.get(vak=self.vak_a1)
+        WijnVoorraad.objects.filter(pk=in_vak.pk).delete()
+
+        response = self.posten((zonder_vak, "2"), (in_vak, "1"))
+        self.assertRedirects(response, self.url)
+        self.assertFalse(BestellingRegel.objects.exists())
+
+        response = self.posten((zonder_vak, "2"), (in_vak, ""))
+        detail = reverse(
+            "WijnVoorraad:bestellingdetail", kwargs=dict(pk=self.bestelling.id)
+        )
+        self.assertRedirects(response, detail)
+        self.assertEqual(BestellingRegel.objects.get().aantal, 2)
+
+    def test_only_orderable_stock(self):
+        """With ?bestelbaar=1 stock without available bottles is left out, unless
+        the bestelling reserves on it."""
+        in_vak = WijnVoorraad.objects.get(vak=self.vak_a1)
+        self.create_bestellingregel(self.bestelling, vak=self.vak_a1, aantal=3)
+        response = self.client.get(self.url, {"bestelbaar": 1})
+        self.assertIn(in_vak, response.context["bestel_list"])
+        self.assertTrue(response.context["bestelbaar"])
+
+        andere = self.create_bestelling()
+        response = self.client.get(
+            reverse(
+                "WijnVoorraad:bestellingregelsselecteren",
+                kwargs=dict(bestelling_id=andere.id),
+            ),
+            {"bestelbaar": 1},
+        )
+        self.assertEqual(
+            response.context["bestel_list"], [WijnVoorraad.objects.get(vak=None)]
+        )
@@ -0,0 +1,106 @@
+"""Tests for the pagination of the wine and ontvangst list views."""
+
+import datetime
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from WijnVoorraad.models import Ontvangst, Wijn
+from WijnVoorraad.tests.models.model_helper import SharedTestDataMixin
+
+
+class TestCatalogusPaginatie(SharedTestDataMixin, TestCase):
+    """Pagination, page sizes, partial endpoint and cached count of WijnListView and
+    OntvangstListView."""
+
+    AANTAL = 60
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.deelnemer.users.add(cls.user)
+        wijnen = Wijn.objects.bulk_create(
+            Wijn(
+                domein=f"Domein {i:02}",
+                naam=f"Wijn {i:02}",
+                jaar=2000 + i % 5,
+                wijnsoort=cls.wijnsoort,
+            )
+            for i in range(cls.AANTAL - 1)
+        )
+        Ontvangst.objects.bulk_create(
+            Ontvangst(
+                deelnemer=cls.deelnemer,
+                wijn=wijn,
+                datumOntvangst=datetime.date(2024, 1, 1),
+            )
+            for wijn in wijnen
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_wijn_list_first_page(self):
+        response = self.client.get(reverse("WijnVoorraad:wijnlist"))
+        self.assertEqual(len(response.context["wijn_list"]), 50)
+        self.assertEqual(response.context["paginator"].count, self.AANTAL)
+        self.assertEqual(
+            response.context["volgende_url"],
+            reverse("WijnVoorraad:wijnlist") + "?page=2",
+        )
+        self.assertContains(response, f"{self.AANTAL} wijnen")
+
+    def test_wijn_list_pages_cover_all_wines_once(self):
+        ids = []
+        url = reverse("WijnVoorraad:wijnlist")
+        while url:
+            response = self.client.get(url)
+            ids += [wijn.id for wijn in response.context["wijn_list"]]
+            url = response.context["volgende_url"]
+        self.assertEqual(len(ids), self.AANTAL)
+        self.assertEqual(set(ids), set(Wijn.objects.values_list("id", flat=True)))
+
+    def test_page_size_from_request(self):
+        response = self.client.get(
+            reverse("WijnVoorraad:wijnlist"), {"per_pagina": 25}
+        )
+        self.assertEqual(len(response.context["wijn_list"]), 25)
+        self.assertEqual(
+            response.context["volgende_url"],
+            reverse("WijnVoorraad:wijnlist") + "?page=2&per_pagina=25",
+        )
+
+    def test_unknown_page_size_uses_default(self):
+        for per_pagina in ("7", "foo"):
+            response = self.client.get(
+                reverse("WijnVoorraad:wijnlist"), {"per_pagina": per_pagina}
+            )
+            self.assertEqual(len(response.context["wijn_list"]), 50)
+
+    def test_partial_returns_next_rows(self):
+        data = self.client.get(
+            reverse("WijnVoorraad:ontvangstlist"), {"page": 2, "partial": 1}
+        ).json()
+        self.assertIsNone(data["volgende_url"])
+        self.assertEqual(data["html"].count("<tr>"), self.AANTAL - 50)
+        self.assertNotIn("<thead>", data["html"])
+
+    def test_count_is_cached(self):
+        self.client.get(reverse("WijnVoorraad:ontvangstlist"))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse("WijnVoorraad:ontvangstlist"), {"page": 2}
+            )
+        self.assertEqual(response.context["paginator"].count, self.AANTAL)
+        self.assertFalse(
+            [q for q in queries.captured_queries if "COUNT(" in q["sql"].upper()]
+        )
+
+    def test_count_follows_changes(self):
+        self.client.get(reverse("WijnVoorraad:wijnlist"))
+        Wijn.objects.create(domein="Nieuw", naam="Nieuw", wijnsoort=self.wijnsoort)
+        response = self.client.get(reverse("WijnVoorraad:wijnlist"))
+        self.assertEqual(response.context["paginator"].count, self.AANTAL + 1)
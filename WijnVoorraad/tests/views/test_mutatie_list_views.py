@@ -0,0 +1,178 @@
+"""Tests for the keyset pagination of the mutation list views."""
+
+import datetime
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from WijnVoorraad.models import VoorraadMutatie, VoorraadMutatieArchief
+from WijnVoorraad.tests.models.model_helper import SharedTestDataMixin
+
+
+class TestMutatieListKeyset(SharedTestDataMixin, TestCase):
+    """Keyset pagination on (datum, id) of MutatieListView, MutatieInListView and
+    MutatieUitListView."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # views.py reads the database on import, so it can not be imported at module level
+        # pylint: disable=import-outside-toplevel
+        from WijnVoorraad.views import MutatieListView
+
+        cls.pagina = MutatieListView.keyset_page_size
+        cls.deelnemer.users.add(cls.user)
+        start = datetime.date(2024, 1, 1)
+        # several mutations per day, so the id decides the order within a day
+        VoorraadMutatie.objects.bulk_create(
+            VoorraadMutatie(
+                ontvangst=cls.ontvangst,
+                locatie=cls.locatie,
+                in_uit="I" if i % 2 else "U",
+                actie="K" if i % 2 else "D",
+                datum=start + datetime.timedelta(days=i // 3),
+                aantal=1,
+                omschrijving=f"Mutatie {i}",
+            )
+            for i in range(cls.pagina + 10)
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def verwachte_ids(self, **filters):
+        return list(
+            VoorraadMutatie.objects.filter(**filters)
+            .order_by("-datum", "-id")
+            .values_list("id", flat=True)
+        )
+
+    def test_first_page_is_limited_with_link_to_next_page(self):
+        response = self.client.get(reverse("WijnVoorraad:mutatielist"))
+        mutaties = response.context["mutatie_list"]
+        self.assertEqual(
+            [m.id for m in mutaties],
+            self.verwachte_ids()[: self.pagina],
+        )
+        laatste = mutaties[-1]
+        self.assertEqual(
+            response.context["volgende_url"],
+            f"{reverse('WijnVoorraad:mutatielist')}?na={laatste.datum}_{laatste.id}",
+        )
+        self.assertContains(response, "meer_laden")
+
+    def test_next_page_continues_after_cursor(self):
+        response = self.client.get(reverse("WijnVoorraad:mutatielist"))
+        response = self.client.get(response.context["volgende_url"])
+        self.assertEqual(
+            [m.id for m in response.context["mutatie_list"]],
+            self.verwachte_ids()[self.pagina :],
+        )
+        self.assertIsNone(response.context["volgende_url"])
+        self.assertNotContains(response, "meer_laden")
+
+    def test_partial_returns_rows_as_json(self):
+        response = self.client.get(reverse("WijnVoorraad:mutatielist"))
+        response = self.client.get(response.context["volgende_url"] + "&partial=1")
+        data = response.json()
+        self.assertIsNone(data["volgende_url"])
+        self.assertEqual(data["html"].count("<tr>"), 10)
+        self.assertNotIn("<thead>", data["html"])
+
+    def test_invalid_cursor_shows_first_page(self):
+        response = self.client.get(reverse("WijnVoorraad:mutatielist") + "?na=foo")
+        self.assertEqual(
+            [m.id for m in response.context["mutatie_list"]],
+            self.verwachte_ids()[: self.pagina],
+        )
+
+    def test_in_and_uit_lists_page_over_their_own_mutations(self):
+        for url_naam, in_uit in (
+            ("WijnVoorraad:mutatielist_in", "I"),
+            ("WijnVoorraad:mutatielist_uit", "U"),
+        ):
+            response = self.client.get(reverse(url_naam))
+            self.assertEqual(
+                [m.id for m in response.context["mutatie_list"]],
+                self.verwachte_ids(in_uit=in_uit),
+            )
+            self.assertIsNone(response.context["volgende_url"])
+
+
+class TestMutatieListArchief(SharedTestDataMixin, TestCase):
+    """With ?archief=1 the mutation lists merge VoorraadMutatieArchief in the pages."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # pylint: disable=import-outside-toplevel
+        from WijnVoorraad.views import MutatieListView
+
+        cls.pagina = MutatieListView.keyset_page_size
+        cls.deelnemer.users.add(cls.user)
+        start = datetime.date(2024, 1, 1)
+        mutaties = VoorraadMutatie.objects.bulk_create(
+            VoorraadMutatie(
+                ontvangst=cls.ontvangst,
+                locatie=cls.locatie,
+                in_uit="I" if i % 2 else "U",
+                actie="K" if i % 2 else "D",
+                datum=start + datetime.timedelta(days=i),
+                aantal=1,
+            )
+            for i in range(cls.pagina + 10)
+        )
+        # the older half is archived, with the original ids
+        cls.gearchiveerd = mutaties[::2]
+        VoorraadMutatieArchief.objects.bulk_create(
+            VoorraadMutatieArchief(
+                id=m.id,
+                ontvangst=m.ontvangst,
+                locatie=m.locatie,
+                in_uit=m.in_uit,
+                actie=m.actie,
+                datum=m.datum,
+                aantal=m.aantal,
+            )
+            for m in cls.gearchiveerd
+        )
+        VoorraadMutatie.objects.filter(id__in=[m.id for m in cls.gearchiveerd]).delete()
+        cls.alle_ids = sorted((m.id for m in mutaties), reverse=True)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_without_archive(self):
+        response = self.client.get(reverse("WijnVoorraad:mutatielist"))
+        self.assertFalse(response.context["met_archief"])
+        self.assertEqual(
+            len(response.context["mutatie_list"]),
+            len(self.alle_ids) - len(self.gearchiveerd),
+        )
+
+    def test_archive_is_merged_in_the_pages(self):
+        url = reverse("WijnVoorraad:mutatielist") + "?archief=1"
+        response = self.client.get(url)
+        self.assertTrue(response.context["met_archief"])
+        ids = [m.id for m in response.context["mutatie_list"]]
+        self.assertTrue(response.context["volgende_url"].endswith("&archief=1"))
+        response = self.client.get(response.context["volgende_url"])
+        ids += [m.id for m in response.context["mutatie_list"]]
+        self.assertEqual(ids, self.alle_ids)
+        self.assertIsNone(response.context["volgende_url"])
+        self.assertContains(
+            response,
+            reverse("WijnVoorraad:ontvangstdetail", args=[self.ontvangst.id]),
+        )
+
+    def test_in_list_with_archive(self):
+        response = self.client.get(
+            reverse("WijnVoorraad:mutatielist_in") + "?archief=1"
+        )
+        self.assertEqual(
+            {m.in_uit for m in response.context["mutatie_list"]},
+            {"I"},
+        )
+        self.assertEqual(len(response.context["mutatie_list"]), len(self.alle_ids) // 2)
@@ -0,0 +1,215 @@
+"""Query budget of the list and detail views.
+
+Every list and detail view in views.py declares the maximum number of queries of a GET
+(max_queries). These tests render each view with 10, 100 and 1000 rows and fail when a
+view does more queries than its budget, or when the number of queries grows with the
+number of rows.
+"""
+
+import datetime
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import resolve, reverse
+from WijnVoorraad.models import (
+    Bestelling,
+    BestellingRegel,
+    Deelnemer,
+    DruivenSoort,
+    Locatie,
+    Ontvangst,
+    Vak,
+    VoorraadMutatie,
+    Wijn,
+    WijnDruivensoort,
+    WijnSoort,
+    WijnVoorraad,
+)
+
+
+class QueryBudgetTestMixin:
+    """Builds a database with AANTAL rows for every list and renders every view with
+    assertNumQueries(max_queries). The counts are for a cold result cache."""
+
+    AANTAL = 10
+
+    @classmethod
+    def setUpTestData(cls):  # pylint: disable=invalid-name
+        n = cls.AANTAL
+        cls.user = get_user_model().objects.create(username="budget", is_staff=True)
+        cls.locatie = Locatie.objects.create(omschrijving="Kelder", aantal_kolommen=3)
+        cls.deelnemer = Deelnemer.objects.create(
+            naam="Jan", standaardLocatie=cls.locatie
+        )
+        cls.deelnemer.users.add(cls.user)
+        cls.wijnsoort = WijnSoort.objects.create(omschrijving="Rood")
+        druif = DruivenSoort.objects.create(omschrijving="Merlot")
+        cls.wijn = Wijn.objects.create(
+            domein="Domein", naam="Wijn", wijnsoort=cls.wijnsoort
+        )
+        wijnen = Wijn.objects.bulk_create(
+            Wijn(domein=f"Domein {i}", naam=f"Wijn {i}", wijnsoort=cls.wijnsoort)
+            for i in range(n)
+        )
+        WijnDruivensoort.objects.bulk_create(
+            WijnDruivensoort(wijn=wijn, druivensoort=druif)
+            for wijn in [cls.wijn, *wijnen]
+        )
+        vakken = Vak.objects.bulk_create(
+            Vak(locatie=cls.locatie, code=f"V{i:04}", capaciteit=n) for i in range(n)
+        )
+        cls.vak = vakken[0]
+        # all ontvangsten are of one wine, so the detail of that wine has n rows
+        ontvangsten = Ontvangst.objects.bulk_create(
+            Ontvangst(
+                deelnemer=cls.deelnemer,
+                wijn=cls.wijn,
+                datumOntvangst=datetime.date(2024, 1, 1),
+            )
+            for _ in range(n)
+        )
+        cls.ontvangst = ontvangsten[0]
+        cls.voorraad = WijnVoorraad.objects.bulk_create(
+            WijnVoorraad(
+                wijn=cls.wijn,
+                deelnemer=cls.deelnemer,
+                ontvangst=ontvangst,
+                locatie=cls.locatie,
+                vak=vak,
+                aantal=2,
+                aantal_rsv=1,
+            )
+            for ontvangst, vak in zip(ontvangsten, vakken)
+        )[0]
+        cls.mutatie = VoorraadMutatie.objects.bulk_create(
+            VoorraadMutatie(
+                ontvangst=cls.ontvangst,
+                locatie=cls.locatie,
+                vak=vakken[i],
+                in_uit="I",
+                actie="K",
+                datum=datetime.date(2024, 1, 1),
+                aantal=1,
+                omschrijving=f"Mutatie {i}",
+            )
+            for i in range(n)
+        )[0]
+        bestellingen = Bestelling.objects.bulk_create(
+            Bestelling(deelnemer=cls.deelnemer, vanLocatie=cls.locatie)
+            for _ in range(n)
+        )
+        cls.bestelling = bestellingen[0]
+        # every bestelling has one regel, the first bestelling has n regels
+        cls.bestellingregel = BestellingRegel.objects.bulk_create(
+            [
+                *(
+                    BestellingRegel(
+                        bestelling=cls.bestelling,
+                        ontvangst=ontvangst,
+                        vak=vak,
+                        aantal=1,
+                        isVerzameld=i % 2 == 0,
+                    )
+                    for i, (ontvangst, vak) in enumerate(zip(ontvangsten, vakken))
+                ),
+                *(
+                    BestellingRegel(
+                        bestelling=bestelling,
+                        ontvangst=cls.ontvangst,
+                        vak=cls.vak,
+                        aantal=1,
+                    )
+                    for bestelling in bestellingen[1:]
+                ),
+            ]
+        )[0]
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        session = self.client.session
+        session["initial_set"] = True
+        session["deelnemer_id"] = self.deelnemer.id
+        session["locatie_id"] = self.locatie.id
+        session.save()
+
+    def urls(self):
+        return [
+            reverse("WijnVoorraad:voorraadlist"),
+            reverse(
+                "WijnVoorraad:voorraaddetail",
+                kwargs=dict(
+                    locatie_id=self.locatie.id,
+                    wijn_id=self.wijn.id,
+                    ontvangst_id=self.ontvangst.id,
+                ),
+            ),
+            reverse("WijnVoorraad:voorraadvakkenlist"),
+            reverse("WijnVoorraad:verplaatsen", kwargs=dict(pk=self.voorraad.id)),
+            reverse(
+                "WijnVoorraad:verplaatsinvakken",
+                kwargs=dict(
+                    voorraad_id=self.voorraad.id,
+                    nieuwe_locatie_id=self.locatie.id,
+                    aantal=1,
+                ),
+            ),
+            reverse("WijnVoorraad:mutatielist"),
+            reverse("WijnVoorraad:mutatielist_in"),
+            reverse("WijnVoorraad:mutatielist_uit"),
+            reverse("WijnVoorraad:mutatiedetail", kwargs=dict(pk=self.mutatie.id)),
+            reverse("WijnVoorraad:ontvangstlist"),
+            reverse("WijnVoorraad:ontvangstdetail", kwargs=dict(pk=self.ontvangst.id)),
+            reverse(
+                "WijnVoorraad:ontvangstvoorraad",
+                kwargs=dict(ontvangst_id=self.ontvangst.id),
+            ),
+            reverse("WijnVoorraad:wijnlist"),
+            reverse("WijnVoorraad:wijndetail", kwargs=dict(pk=self.wijn.id)),
+            reverse("WijnVoorraad:wijn-opzoeken", kwargs=dict(pk=self.wijn.id)),
+            reverse("WijnVoorraad:bestellinglist"),
+            reverse("WijnVoorraad:bestellingdetail", kwargs=dict(pk=self.bestelling.id)),
+            reverse(
+                "WijnVoorraad:bestellingregelsselecteren",
+                kwargs=dict(bestelling_id=self.bestelling.id),
+            ),
+            reverse("WijnVoorraad:bestellingenverzamelen"),
+            reverse(
+                "WijnVoorraad:bestellingverzamelendetail",
+                kwargs=dict(pk=self.bestelling.id),
+            ),
+            reverse(
+                "WijnVoorraad:bestellingregelverplaatsen",
+                kwargs=dict(pk=self.bestellingregel.id),
+            ),
+            reverse(
+                "WijnVoorraad:bestellingregelverplaatsinvakken",
+                kwargs=dict(
+                    bestellingregel_id=self.bestellingregel.id,
+                    nieuwe_locatie_id=self.locatie.id,
+                    aantal=1,
+                ),
+            ),
+            reverse("WijnVoorraad:voorraadcontroleren"),
+        ]
+
+    def test_views_stay_within_query_budget(self):
+        for url in self.urls():
+            view_class = resolve(url).func.view_class
+            with self.subTest(view=view_class.__name__):
+                with self.assertNumQueries(view_class.max_queries):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+
+class TestQueryBudget10(QueryBudgetTestMixin, TestCase):
+    AANTAL = 10
+
+
+class TestQueryBudget100(QueryBudgetTestMixin, TestCase):
+    AANTAL = 100
+
+
+class TestQueryBudget1000(QueryBudgetTestMixin, TestCase):
+    AANTAL = 1000
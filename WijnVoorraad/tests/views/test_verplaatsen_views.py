@@ -0,0 +1,78 @@
+"""Tests for moving stock to several vakken at once."""
+
+from django.test import TestCase
+from django.urls import reverse
+from WijnVoorraad.models import BestellingRegel, VoorraadMutatie, WijnVoorraad
+from WijnVoorraad.tests.models.model_helper import SharedTestDataMixin
+
+
+class TestVerplaatsInVakken(SharedTestDataMixin, TestCase):
+    """VoorraadVerplaatsInVakken and BestellingregelVerplaatsInVakken move all chosen
+    vakken in one transaction."""
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.create_voorraad(5)
+        self.voorraad = self.voorraad_zonder_vak()
+
+    def voorraad_zonder_vak(self):
+        return WijnVoorraad.objects.get(ontvangst=self.ontvangst, vak=None)
+
+    def post_gegevens(self, *keuzes, **extra):
+        gegevens = {"aantal_vakken": len(keuzes), **extra}
+        for i, (vak, aantal) in enumerate(keuzes, start=1):
+            gegevens[f"nieuw_vak_id{i}"] = vak.id
+            gegevens[f"aantal_verplaatsen{i}"] = aantal
+        return gegevens
+
+    def url(self, naam, **kwargs):
+        return reverse(
+            f"WijnVoorraad:{naam}",
+            kwargs={"nieuwe_locatie_id": self.locatie.id, "aantal": 5, **kwargs},
+        )
+
+    def aantal(self, vak):
+        voorraad = WijnVoorraad.objects.filter(ontvangst=self.ontvangst, vak=vak).first()
+        return voorraad.aantal if voorraad else 0
+
+    def test_voorraad_moved_to_several_vakken(self):
+        response = self.client.post(
+            self.url("verplaatsinvakken", voorraad_id=self.voorraad.id),
+            self.post_gegevens(
+                (self.vak_a1, 2), (self.vak_a2, 3), voorraad_id=self.voorraad.id
+            ),
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.aantal(None), 0)
+        self.assertEqual(self.aantal(self.vak_a1), 2)
+        self.assertEqual(self.aantal(self.vak_a2), 3)
+        self.assertEqual(VoorraadMutatie.objects.filter(actie="V").count(), 4)
+
+    def test_nothing_moved_when_the_stock_is_not_enough(self):
+        response = self.client.post(
+            self.url("verplaatsinvakken", voorraad_id=self.voorraad.id),
+            self.post_gegevens(
+                (self.vak_a1, 4), (self.vak_a2, 4), voorraad_id=self.voorraad.id
+            ),
+            follow=True,
+        )
+        self.assertContains(response, "voorraad negatief")
+        self.assertEqual(self.aantal(None), 5)
+        self.assertFalse(VoorraadMutatie.objects.filter(actie="V").exists())
+
+    def test_bestellingregel_moved_to_several_vakken(self):
+        bestelling = self.create_bestelling()
+        regel = self.create_bestellingregel(bestelling=bestelling, aantal=3)
+        self.client.post(
+            self.url("bestellingregelverplaatsinvakken", bestellingregel_id=regel.id),
+            self.post_gegevens(
+                (self.vak_a1, 1), (self.vak_a2, 2), bestellingregel_id=regel.id
+            ),
+        )
+        regel = BestellingRegel.objects.get(pk=regel.pk)
+        self.assertEqual(regel.verwerkt, "V")
+        self.assertEqual(self.aantal(None), 2)
+        self.assertEqual(self.aantal(self.vak_a1), 1)
+        self.assertEqual(self.aantal(self.vak_a2), 2)
+        # the reservation is released
+        self.assertEqual(self.voorraad_zonder_vak().aantal_rsv, 0)
@@ -0,0 +1,46 @@
+"""Tests for the stock at a date page."""
+
+from datetime import date, timedelta
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+from django.urls import reverse
+from WijnVoorraad.models import VoorraadMomentopname, VoorraadMutatie
+from WijnVoorraad.tests.models.model_helper import SharedTestDataMixin
+
+
+class TestVoorraadOpDatum(SharedTestDataMixin, TestCase):
+    """VoorraadOpDatumView shows the stock of the chosen day."""
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.create_voorraad(3, vak=self.vak_a1)
+        self.url = reverse("WijnVoorraad:voorraadopdatum")
+
+    def test_stock_of_today(self):
+        response = self.client.get(self.url, {"datum": date.today().isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["totaal"], 3)
+        self.assertContains(response, self.wijn.volle_naam)
+
+    def test_stock_before_the_first_mutation(self):
+        gisteren = date.today() - timedelta(days=1)
+        response = self.client.get(self.url, {"datum": gisteren.isoformat()})
+        self.assertEqual(response.context["voorraad_list"], [])
+
+    def test_form_without_datum(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("voorraad_list", response.context)
+
+    def test_command_writes_the_momentopname(self):
+        gisteren = date.today() - timedelta(days=1)
+        VoorraadMutatie.objects.update(datum=gisteren)
+        call_command("momentopname_vastleggen", datum=gisteren, stdout=StringIO())
+        self.assertEqual(
+            list(VoorraadMomentopname.objects.values_list("vak", "aantal")),
+            [(self.vak_a1.id, 3)],
+        )
+        with self.assertRaises(CommandError):
+            call_command("momentopname_vastleggen", datum=date.today(), stdout=StringIO())
@@ -173,6 +173,16 @@ urlpatterns = [
     path(
         "verplaatsen/<int:pk>", views.VoorraadVerplaatsen.as_view(), name="verplaatsen"
     ),
+    path(
+        "voorraad/opdatum/",
+        views.VoorraadOpDatumView.as_view(),
+        name="voorraadopdatum",
+    ),
+    path(
+        "allesverplaatsen/",
+        views.VoorraadAllesVerplaatsen.as_view(),
+        name="allesverplaatsen",
+    ),
     path(
         "voorraad/<int:locatie_id>/<int:wijn_id>/<int:ontvangst_id>",
         views.VoorraadDetailView.as_view(),
@@ -1,7 +1,7 @@
 """Main views module"""
 
 import base64
-from datetime import datetime
+from datetime import date, datetime
 from enum import Enum
 import json
 from django.utils import timezone
@@ -9,9 +9,10 @@ from django.utils import timezone
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.db.models import F, Sum, Case, When
+from django.db.models import F, Q, Sum, Case, When
 from django.db.models.functions import Lower
 from django.http import HttpResponseRedirect, JsonResponse
+from django.template.loader import render_to_string
 from django.urls import reverse, reverse_lazy
 from django.views import View
 from django.views.generic import DetailView, ListView
@@ -21,13 +22,15 @@ from django.db.models.deletion import ProtectedError
 from openai import APIError, OpenAI, OpenAIError
 from pydantic import BaseModel, Field
 
-from . import wijnvars
+from . import resultaatcache, wijnvars
 from .forms import (
+    AllesVerplaatsenForm,
     MutatieCreateForm,
     MutatieUpdateForm,
     OntvangstCreateForm,
     OntvangstUpdateForm,
     VoorraadFilterForm,
+    VoorraadOpDatumForm,
     WijnForm,
     BestellingCreateForm,
     BestellingUpdateForm,
@@ -35,11 +38,13 @@ from .forms import (
 )
 from .models import (
     AIUsage,
-    Deelnemer,
     Locatie,
     Ontvangst,
     Vak,
+    Verplaatsing,
     VoorraadMutatie,
+    VoorraadMutatieArchief,
+    VoorraadOverzichtRegel,
     Wijn,
     WijnSoort,
     WijnVoorraad,
@@ -149,9 +154,140 @@ class AdminUserMixin(LoginRequiredMixin, UserPassesTestMixin):
         return self.request.user.is_staff
 
 
+class PartialRegelsMixin:
+    """With ?partial=1 a ListView returns only its rows, for "meer laden".
+
+    The response is JSON with the rows rendered by partial_template_name (html) and
+    the url of the next page (volgende_url, None on the last page).
+    """
+
+    partial_template_name = None
+
+    def get(self, request, *args, **kwargs):
+        if not request.GET.get("partial"):
+            return super().get(request, *args, **kwargs)
+        self.object_list = self.get_queryset()
+        context = self.get_context_data()
+        html = render_to_string(self.partial_template_name, context, request)
+        return JsonResponse({"html": html, "volgende_url": context["volgende_url"]})
+
+
+class KeysetPaginatieMixin(PartialRegelsMixin):
+    """Keyset pagination for a ListView on (datum, id), newest first.
+
+    The next page starts after the last row shown (?na=<datum>_<id>), so every page is
+    a range scan on the (datum, id) index however long the list is.
+    """
+
+    keyset_page_size = 50
+
+    def get_keyset_cursor(self):
+        na = self.request.GET.get("na")
+        if not na:
+            return None
+        try:
+            datum, pk = na.split("_")
+            return date.fromisoformat(datum), int(pk)
+        except ValueError:
+            return None
+
+    def get_archief_queryset(self):
+        """Rows of an archive table to merge with object_list, None for no archive."""
+        return None
+
+    def keyset_pagina(self, queryset, archief=None):
+        cursor = self.get_keyset_cursor()
+        regels = []
+        for deel in [queryset] if archief is None else [queryset, archief]:
+            deel = deel.order_by("-datum", "-id")
+            if cursor:
+                datum, pk = cursor
+                deel = deel.filter(Q(datum__lt=datum) | Q(datum=datum, id__lt=pk))
+            regels += deel[: self.keyset_page_size + 1]
+        if archief is not None:
+            # archived rows keep their original id, so (datum, id) stays unique
+            regels.sort(key=lambda regel: (regel.datum, regel.id), reverse=True)
+        volgende_url = None
+        if len(regels) > self.keyset_page_size:
+            regels = regels[: self.keyset_page_size]
+            laatste = regels[-1]
+            volgende_url = (
+                f"{self.request.path}?na={laatste.datum.isoformat()}_{laatste.id}"
+            )
+            if archief is not None:
+                volgende_url += "&archief=1"
+        return regels, volgende_url
+
+    def get_context_data(self, **kwargs):
+        archief = self.get_archief_queryset()
+        regels, volgende_url = self.keyset_pagina(self.object_list, archief)
+        kwargs["object_list"] = regels
+        context = super().get_context_data(**kwargs)
+        context["volgende_url"] = volgende_url
+        context["met_archief"] = archief is not None
+        return context
+
+
+class PaginatieMixin(PartialRegelsMixin):
+    """Page numbers (?page=) for a ListView.
+
+    The page size is paginate_by, or ?per_pagina= when it is one of pagina_groottes.
+    The total for the paginator comes from resultaatcache.gecachte_aantal (keyed on
+    resultaat_lijst and the filter state), so the COUNT query is not repeated for
+    every page.
+    """
+
+    paginate_by = 50
+    pagina_groottes = (25, 50, 100, 200)
+    resultaat_lijst = None
+
+    def get_paginate_by(self, queryset):
+        try:
+            per_pagina = int(self.request.GET.get("per_pagina", ""))
+        except ValueError:
+            return self.paginate_by
+        if per_pagina in self.pagina_groottes:
+            return per_pagina
+        return self.paginate_by
+
+    def get_paginator(
+        self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs
+    ):
+        paginator = super().get_paginator(
+            queryset, per_page, orphans, allow_empty_first_page, **kwargs
+        )
+        # Paginator.count is a cached_property, setting it skips the COUNT query
+        paginator.count = resultaatcache.gecachte_aantal(
+            self.resultaat_lijst, wijnvars.get_filter_status(self.request), queryset
+        )
+        return paginator
+
+    def pagina_url(self, pagina, per_pagina):
+        url = f"{self.request.path}?page={pagina}"
+        if per_pagina != self.paginate_by:
+            url += f"&per_pagina={per_pagina}"
+        return url
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        page_obj = context["page_obj"]
+        per_pagina = context["paginator"].per_page
+        context["volgende_url"] = None
+        if page_obj.has_next():
+            context["volgende_url"] = self.pagina_url(
+                page_obj.next_page_number(), per_pagina
+            )
+        context["pagina_groottes"] = [
+            (grootte, self.pagina_url(1, grootte), grootte == per_pagina)
+            for grootte in self.pagina_groottes
+        ]
+        return context
+
+
 class VoorraadListView(LoginRequiredMixin, ListView):
     model = WijnVoorraad
     context_object_name = "voorraad_list"
+    max_queries = 11
 
     def get_queryset(self):
         wijnvars.set_filter_options(
@@ -159,9 +295,7 @@ class VoorraadListView(LoginRequiredMixin, ListView):
         )
         d = wijnvars.get_session_deelnemer(self.request)
         l = wijnvars.get_session_locatie(self.request)
-        vrd_list = WijnVoorraad.objects.filter(deelnemer=d, locatie=l).order_by(
-            "wijn", "ontvangst__datumOntvangst"
-        )
+        vrd_list = WijnVoorraad.objects.filter(deelnemer=d, locatie=l)
 
         ws_id = wijnvars.get_session_wijnsoort_id(self.request)
         if ws_id:
@@ -169,43 +303,17 @@ class VoorraadListView(LoginRequiredMixin, ListView):
 
         fuzzy_selectie = wijnvars.get_session_fuzzy_selectie(self.request)
         if fuzzy_selectie:
-            vrdnw_list = []
-            for vrd in vrd_list:
-                if vrd.check_fuzzy_selectie(fuzzy_selectie):
-                    vrdnw_list.append(vrd)
-            vrd_list = vrdnw_list
-        if (
-            wijnvars.get_session_sortering(self.request)
-            == wijnvars.SorteringEnum.ONTVANGSTWIJN
-        ):
-            voorraad_list = (
-                WijnVoorraad.objects.filter(pk__in=[v.pk for v in vrd_list])
-                .group_by("wijn", "ontvangst", "deelnemer", "locatie")
-                .order_by("ontvangst__datumOntvangst", "wijn")
-                .annotate(aantal=Sum("aantal"))
-            )
-        elif (
-            wijnvars.get_session_sortering(self.request)
-            == wijnvars.SorteringEnum.ONTVANGSTDESCWIJN
-        ):
-            voorraad_list = (
-                WijnVoorraad.objects.filter(pk__in=[v.pk for v in vrd_list])
-                .group_by("wijn", "ontvangst", "deelnemer", "locatie")
-                .order_by("-ontvangst__datumOntvangst", "wijn")
-                .annotate(aantal=Sum("aantal"))
-            )
-        else:
-            voorraad_list = (
-                WijnVoorraad.objects.filter(pk__in=[v.pk for v in vrd_list])
-                .group_by("wijn", "ontvangst", "deelnemer", "locatie")
-                .order_by("wijn", "ontvangst__datumOntvangst")
-                .annotate(aantal=Sum("aantal"))
-            )
-
-        return voorraad_list
+            vrd_list = vrd_list.fuzzy(fuzzy_selectie)
+        if self.request.GET.get("bestelbaar"):
+            vrd_list = vrd_list.bestelbaar()
+        return vrd_list.overzicht(*wijnvars.get_voorraad_volgorde(self.request))
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        context["voorraad_list"] = VoorraadOverzichtRegel.van_rijen(
+            context["object_list"]
+        )
+        context["bestelbaar"] = bool(self.request.GET.get("bestelbaar"))
         wijnvars.set_context_filter_options(
             context, self.request, "WijnVoorraad:voorraadlist"
         )
@@ -284,6 +392,7 @@ class VoorraadDetailView(LoginRequiredMixin, ListView):
     model = WijnVoorraad
     context_object_name = "voorraad_list"
     template_name = "WijnVoorraad/wijnvoorraad_detail.html"
+    max_queries = 13
 
     def get_queryset(self):
         l = self.kwargs["locatie_id"]
@@ -291,7 +400,7 @@ class VoorraadDetailView(LoginRequiredMixin, ListView):
         o = self.kwargs["ontvangst_id"]
         ontvangst = Ontvangst.objects.get(pk=o)
         d = ontvangst.deelnemer.id
-        voorraad_list = WijnVoorraad.objects.filter(
+        voorraad_list = WijnVoorraad.objects.met_relaties().filter(
             deelnemer=d, locatie=l, wijn=w, ontvangst=o
         )
         return voorraad_list
@@ -346,6 +455,7 @@ class VoorraadVakkenListView(LoginRequiredMixin, ListView):
     model = Vak
     context_object_name = "vakken_list"
     template_name = "WijnVoorraad/voorraadvakken_list.html"
+    max_queries = 12
 
     def get_queryset(self):
         wijnvars.set_filter_options(
@@ -363,7 +473,11 @@ class VoorraadVakkenListView(LoginRequiredMixin, ListView):
         context = super().get_context_data(**kwargs)
         wijnvars.set_context_locatie_list(context)
         l = wijnvars.get_session_locatie(self.request)
-        voorraad_list = WijnVoorraad.objects.filter(locatie=l).order_by("vak", "wijn")
+        voorraad_list = (
+            WijnVoorraad.objects.met_relaties()
+            .filter(locatie=l)
+            .order_by("vak", "wijn")
+        )
         summary_deelnemer_list = (
             WijnVoorraad.objects.filter(locatie=l)
             .group_by("deelnemer")
@@ -397,19 +511,37 @@ class VoorraadVakkenListView(LoginRequiredMixin, ListView):
         return HttpResponseRedirect(url)
 
 
+def gekozen_vakken(post):
+    """The (vak, aantal) pairs filled in on a verplaatsinvakken page, the vakken
+    read with one query."""
+    try:
+        aantal_vakken = int(post["aantal_vakken"])
+    except ValueError:
+        aantal_vakken = 0
+    keuzes = [
+        (post["nieuw_vak_id" + str(i)], post["aantal_verplaatsen" + str(i)])
+        for i in range(1, aantal_vakken + 1)
+    ]
+    keuzes = [(vak_id, aantal) for vak_id, aantal in keuzes if aantal]
+    vakken = Vak.objects.select_related("locatie").in_bulk(
+        [int(vak_id) for vak_id, _ in keuzes]
+    )
+    return [(vakken[int(vak_id)], aantal) for vak_id, aantal in keuzes]
+
+
 class VoorraadVerplaatsen(LoginRequiredMixin, DetailView):
     model = WijnVoorraad
+    queryset = WijnVoorraad.objects.met_relaties()
     template_name = "WijnVoorraad/voorraad_verplaatsen.html"
     success_url = reverse_lazy("WijnVoorraad:voorraadlist")
+    max_queries = 4
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         voorraad = self.object
-        wijn = Wijn.objects.get(pk=voorraad.wijn.id)
-        locatie = Locatie.objects.get(pk=voorraad.locatie.id)
-        vak = None
-        if voorraad.vak:
-            vak = Vak.objects.get(pk=voorraad.vak.id)
+        wijn = voorraad.wijn
+        locatie = voorraad.locatie
+        vak = voorraad.vak
         context["voorraad"] = voorraad
         context["wijn"] = wijn
         context["locatie"] = locatie
@@ -443,12 +575,16 @@ class VoorraadVerplaatsen(LoginRequiredMixin, DetailView):
                     # Alsnog direct verplaatsen op de nieuwe locatie
                     v_nieuwe_vak = None
                     wijn = voorraad.wijn
-                    voorraad.verplaatsen(
-                        v_nieuwe_locatie, v_nieuwe_vak, v_aantal_verplaatsen
-                    )
-                    messages.success(
-                        request, f"Voorraad van {wijn.volle_naam} verplaatst"
-                    )
+                    try:
+                        voorraad.verplaatsen(
+                            v_nieuwe_locatie, v_nieuwe_vak, v_aantal_verplaatsen
+                        )
+                    except ValidationError as e:
+                        messages.error(request, e.message)
+                    else:
+                        messages.success(
+                            request, f"Voorraad van {wijn.volle_naam} verplaatst"
+                        )
                 url = reverse("WijnVoorraad:voorraadlist")
             else:
                 url = reverse(
@@ -471,10 +607,16 @@ class VoorraadVerplaatsen(LoginRequiredMixin, DetailView):
                 #
                 v_nieuwe_vak = None
                 wijn = voorraad.wijn
-                voorraad.verplaatsen(
-                    v_nieuwe_locatie, v_nieuwe_vak, v_aantal_verplaatsen
-                )
-                messages.success(request, f"Voorraad van {wijn.volle_naam} verplaatst")
+                try:
+                    voorraad.verplaatsen(
+                        v_nieuwe_locatie, v_nieuwe_vak, v_aantal_verplaatsen
+                    )
+                except ValidationError as e:
+                    messages.error(request, e.message)
+                else:
+                    messages.success(
+                        request, f"Voorraad van {wijn.volle_naam} verplaatst"
+                    )
             url = reverse("WijnVoorraad:voorraadlist")
         return HttpResponseRedirect(url)
 
@@ -483,12 +625,13 @@ class VoorraadVerplaatsInVakken(LoginRequiredMixin, ListView):
     model = Vak
     template_name = "WijnVoorraad/voorraad_verplaatsinvakken.html"
     success_url = reverse_lazy("WijnVoorraad:voorraadlist")
+    max_queries = 6
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         voorraad_id = self.kwargs["voorraad_id"]
-        voorraad = WijnVoorraad.objects.get(pk=voorraad_id)
-        wijn = Wijn.objects.get(pk=voorraad.wijn.id)
+        voorraad = WijnVoorraad.objects.met_relaties().get(pk=voorraad_id)
+        wijn = voorraad.wijn
         v_nieuwe_locatie_id = self.kwargs["nieuwe_locatie_id"]
         vakken_list = (
             Vak.objects.filter(locatie=v_nieuwe_locatie_id)
@@ -514,55 +657,129 @@ class VoorraadVerplaatsInVakken(LoginRequiredMixin, ListView):
 
     def post(self, request, *args, **kwargs):
         v_id = self.request.POST["voorraad_id"]
-        voorraad = WijnVoorraad.objects.get(pk=v_id)
+        voorraad = WijnVoorraad.objects.met_relaties().get(pk=v_id)
         wijn = voorraad.wijn
-        aantal_vakken = self.request.POST["aantal_vakken"]
+        verplaatsingen = [
+            Verplaatsing(
+                voorraad.ontvangst,
+                voorraad.locatie,
+                voorraad.vak,
+                v_nieuwe_vak.locatie,
+                v_nieuwe_vak,
+                v_aantal_verplaatsen,
+            )
+            for v_nieuwe_vak, v_aantal_verplaatsen in gekozen_vakken(self.request.POST)
+        ]
         try:
-            aantal_vakken_int = int(aantal_vakken)
-        except ValueError:
-            aantal_vakken_int = 0
-        for i in range(1, aantal_vakken_int + 1):
-            v_nieuw_vak_id = self.request.POST["nieuw_vak_id" + str(i)]
-            v_aantal_verplaatsen = self.request.POST["aantal_verplaatsen" + str(i)]
-            if v_aantal_verplaatsen:
-                v_nieuwe_vak = Vak.objects.get(pk=v_nieuw_vak_id)
-                v_nieuwe_locatie = v_nieuwe_vak.locatie
-                voorraad.verplaatsen(
-                    v_nieuwe_locatie, v_nieuwe_vak, v_aantal_verplaatsen
-                )
-
-        messages.success(request, f"Voorraad van {wijn.volle_naam} verplaatst")
+            # alle vakken in een keer: of alles wordt verplaatst, of niets
+            VoorraadMutatie.verplaatsen_lijst(verplaatsingen)
+        except ValidationError as e:
+            messages.error(request, e.message)
+        else:
+            messages.success(request, f"Voorraad van {wijn.volle_naam} verplaatst")
         return HttpResponseRedirect(reverse("WijnVoorraad:voorraadlist"))
 
 
-class MutatieListView(LoginRequiredMixin, ListView):
+class VoorraadAllesVerplaatsen(LoginRequiredMixin, FormView):
+    """Move all stock of a locatie or vak at once, after a preview of the result."""
+
+    form_class = AllesVerplaatsenForm
+    template_name = "WijnVoorraad/voorraad_alles_verplaatsen.html"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["title"] = "Alles verplaatsen"
+        return context
+
+    def form_valid(self, form):
+        if "Verplaatsen" in self.request.POST:
+            try:
+                aantal = WijnVoorraadService.AllesVerplaatsen(**form.cleaned_data)
+            except ValidationError as e:
+                messages.error(self.request, e.message)
+            else:
+                messages.success(self.request, f"{aantal} flessen verplaatst")
+                return HttpResponseRedirect(reverse("WijnVoorraad:voorraadlist"))
+        voorbeeld = WijnVoorraadService.AllesVerplaatsenVoorbeeld(**form.cleaned_data)
+        return self.render_to_response(
+            self.get_context_data(form=form, voorbeeld=voorbeeld)
+        )
+
+
+class VoorraadOpDatumView(LoginRequiredMixin, FormView):
+    """The stock at the end of a day in the past (see WijnVoorraadService.VoorraadOpDatum)."""
+
+    form_class = VoorraadOpDatumForm
+    template_name = "WijnVoorraad/voorraad_op_datum.html"
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        if "datum" in self.request.GET:
+            kwargs["data"] = self.request.GET
+        return kwargs
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["title"] = "Voorraad op datum"
+        form = context["form"]
+        if form.is_bound and form.is_valid():
+            voorraad_list = WijnVoorraadService.VoorraadOpDatum(**form.cleaned_data)
+            context["voorraad_list"] = voorraad_list
+            context["totaal"] = sum(regel["aantal"] for regel in voorraad_list)
+        return context
+
+    def form_valid(self, form):
+        return self.render_to_response(self.get_context_data(form=form))
+
+
+def mutaties_filteren(request, mutaties):
+    """Apply the session filters of the mutation lists, on VoorraadMutatie as well as
+    on VoorraadMutatieArchief."""
+    d = wijnvars.get_session_deelnemer(request)
+    if d:
+        mutaties = mutaties.filter(ontvangst__deelnemer=d)
+    l = wijnvars.get_session_locatie(request)
+    if l:
+        mutaties = mutaties.filter(locatie=l)
+    ws_id = wijnvars.get_session_wijnsoort_id(request)
+    if ws_id:
+        mutaties = mutaties.filter(ontvangst__wijn__wijnsoort__id=ws_id)
+    fuzzy_selectie = wijnvars.get_session_fuzzy_selectie(request)
+    if fuzzy_selectie:
+        mutaties = mutaties.fuzzy(fuzzy_selectie)
+    return mutaties
+
+
+class MutatieArchiefMixin:
+    """With ?archief=1 a mutation list also shows the archived mutations."""
+
+    archief_in_uit = None
+
+    def get_archief_queryset(self):
+        if not self.request.GET.get("archief"):
+            return None
+        archief = VoorraadMutatieArchief.objects.met_relaties()
+        if self.archief_in_uit:
+            archief = archief.filter(in_uit=self.archief_in_uit)
+        return mutaties_filteren(self.request, archief)
+
+
+class MutatieListView(
+    LoginRequiredMixin, MutatieArchiefMixin, KeysetPaginatieMixin, ListView
+):
     model = VoorraadMutatie
     context_object_name = "mutatie_list"
+    partial_template_name = "WijnVoorraad/mutatie_list_regels.html"
     template_name = "WijnVoorraad/mutatie_list.html"
+    max_queries = 10
 
     def get_queryset(self):
         wijnvars.set_filter_options(
             self.request, True, True, True, True, True, True, False
         )
-        d = wijnvars.get_session_deelnemer(self.request)
-        l = wijnvars.get_session_locatie(self.request)
-        mutatie_list = VoorraadMutatie.objects.order_by("-datum")
-        if d:
-            mutatie_list = mutatie_list.filter(ontvangst__deelnemer=d)
-        if l:
-            mutatie_list = mutatie_list.filter(locatie=l)
-        ws_id = wijnvars.get_session_wijnsoort_id(self.request)
-        if ws_id:
-            mutatie_list = mutatie_list.filter(ontvangst__wijn__wijnsoort__id=ws_id)
-
-        fuzzy_selectie = wijnvars.get_session_fuzzy_selectie(self.request)
-        if fuzzy_selectie:
-            mutnw_list = []
-            for mut in mutatie_list:
-                if mut.check_fuzzy_selectie(fuzzy_selectie):
-                    mutnw_list.append(mut)
-            mutatie_list = mutnw_list
-        return mutatie_list
+        return mutaties_filteren(
+            self.request, VoorraadMutatie.objects.met_relaties()
+        ).order_by("-datum", "-id")
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -570,6 +787,7 @@ class MutatieListView(LoginRequiredMixin, ListView):
             context, self.request, "WijnVoorraad:mutatielist"
         )
         context["title"] = "Mutaties"
+        context["toon_in_uit"] = True
         return context
 
     def post(self, request, *args, **kwargs):
@@ -578,34 +796,23 @@ class MutatieListView(LoginRequiredMixin, ListView):
         return HttpResponseRedirect(url)
 
 
-class MutatieUitListView(LoginRequiredMixin, ListView):
+class MutatieUitListView(
+    LoginRequiredMixin, MutatieArchiefMixin, KeysetPaginatieMixin, ListView
+):
     model = VoorraadMutatie
     context_object_name = "mutatie_list"
+    partial_template_name = "WijnVoorraad/mutatie_list_regels.html"
     template_name = "WijnVoorraad/mutatie_uit_list.html"
+    max_queries = 10
+    archief_in_uit = "U"
 
     def get_queryset(self):
         wijnvars.set_filter_options(
             self.request, True, True, True, True, True, True, False
         )
-        d = wijnvars.get_session_deelnemer(self.request)
-        l = wijnvars.get_session_locatie(self.request)
-        mutatie_list = VoorraadMutatie.objects.filter(in_uit="U").order_by("-datum")
-        if d:
-            mutatie_list = mutatie_list.filter(ontvangst__deelnemer=d)
-        if l:
-            mutatie_list = mutatie_list.filter(locatie=l)
-        ws_id = wijnvars.get_session_wijnsoort_id(self.request)
-        if ws_id:
-            mutatie_list = mutatie_list.filter(ontvangst__wijn__wijnsoort__id=ws_id)
-
-        fuzzy_selectie = wijnvars.get_session_fuzzy_selectie(self.request)
-        if fuzzy_selectie:
-            mutnw_list = []
-            for mut in mutatie_list:
-                if mut.check_fuzzy_selectie(fuzzy_selectie):
-                    mutnw_list.append(mut)
-            mutatie_list = mutnw_list
-        return mutatie_list
+        return mutaties_filteren(
+            self.request, VoorraadMutatie.objects.met_relaties().filter(in_uit="U")
+        ).order_by("-datum", "-id")
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -621,34 +828,23 @@ class MutatieUitListView(LoginRequiredMixin, ListView):
         return HttpResponseRedirect(url)
 
 
-class MutatieInListView(LoginRequiredMixin, ListView):
+class MutatieInListView(
+    LoginRequiredMixin, MutatieArchiefMixin, KeysetPaginatieMixin, ListView
+):
     model = VoorraadMutatie
     context_object_name = "mutatie_list"
+    partial_template_name = "WijnVoorraad/mutatie_list_regels.html"
     template_name = "WijnVoorraad/mutatie_in_list.html"
+    max_queries = 10
+    archief_in_uit = "I"
 
     def get_queryset(self):
         wijnvars.set_filter_options(
             self.request, True, True, True, True, True, True, False
         )
-        d = wijnvars.get_session_deelnemer(self.request)
-        l = wijnvars.get_session_locatie(self.request)
-        mutatie_list = VoorraadMutatie.objects.filter(in_uit="I").order_by("-datum")
-        if d:
-            mutatie_list = mutatie_list.filter(ontvangst__deelnemer=d)
-        if l:
-            mutatie_list = mutatie_list.filter(locatie=l)
-        ws_id = wijnvars.get_session_wijnsoort_id(self.request)
-        if ws_id:
-            mutatie_list = mutatie_list.filter(ontvangst__wijn__wijnsoort__id=ws_id)
-
-        fuzzy_selectie = wijnvars.get_session_fuzzy_selectie(self.request)
-        if fuzzy_selectie:
-            mutnw_list = []
-            for mut in mutatie_list:
-                if mut.check_fuzzy_selectie(fuzzy_selectie):
-                    mutnw_list.append(mut)
-            mutatie_list = mutnw_list
-        return mutatie_list
+        return mutaties_filteren(
+            self.request, VoorraadMutatie.objects.met_relaties().filter(in_uit="I")
+        ).order_by("-datum", "-id")
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -666,8 +862,10 @@ class MutatieInListView(LoginRequiredMixin, ListView):
 
 class MutatieDetailView(LoginRequiredMixin, DetailView):
     model = VoorraadMutatie
+    queryset = VoorraadMutatie.objects.met_relaties()
     template_name = "WijnVoorraad/mutatie_detail.html"
     context_object_name = "mutatie"
+    max_queries = 3
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -760,16 +958,22 @@ class MutatieUpdateView(LoginRequiredMixin, UpdateView):
         return context
 
 
-class OntvangstListView(LoginRequiredMixin, ListView):
+class OntvangstListView(LoginRequiredMixin, PaginatieMixin, ListView):
     model = Ontvangst
     template_name = "WijnVoorraad/ontvangst_list.html"
+    partial_template_name = "WijnVoorraad/ontvangst_list_regels.html"
     context_object_name = "ontvangst_list"
+    resultaat_lijst = "ontvangstlist"
+    max_queries = 11
 
     def get_queryset(self):
         wijnvars.set_filter_options(
             self.request, True, False, True, True, True, True, False
         )
-        ontvangst_list = Ontvangst.objects.all()
+        # the id makes the ordering unique, so no row is shown on two pages
+        ontvangst_list = Ontvangst.objects.select_related(
+            "deelnemer", "wijn__wijnsoort"
+        ).order_by(*Ontvangst._meta.ordering, "id")
         d = wijnvars.get_session_deelnemer(self.request)
         if d:
             ontvangst_list = ontvangst_list.filter(deelnemer=d)
@@ -780,11 +984,7 @@ class OntvangstListView(LoginRequiredMixin, ListView):
 
         fuzzy_selectie = wijnvars.get_session_fuzzy_selectie(self.request)
         if fuzzy_selectie:
-            ontvangstnw_list = []
-            for ontvangst in ontvangst_list:
-                if ontvangst.check_fuzzy_selectie(fuzzy_selectie):
-                    ontvangstnw_list.append(ontvangst)
-            ontvangst_list = ontvangstnw_list
+            ontvangst_list = ontvangst_list.fuzzy(fuzzy_selectie)
         return ontvangst_list
 
     def get_context_data(self, **kwargs):
@@ -803,14 +1003,29 @@ class OntvangstListView(LoginRequiredMixin, ListView):
 
 class OntvangstDetailView(LoginRequiredMixin, DetailView):
     model = Ontvangst
+    queryset = Ontvangst.objects.met_relaties()
     context_object_name = "ontvangst"
+    max_queries = 5
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["voorraad_aantal"] = WijnVoorraad.objects.filter(
             ontvangst=self.object
         ).aggregate(aantal=Sum("aantal"))
-        context["mutaties"] = VoorraadMutatie.objects.filter(ontvangst=self.object)
+        context["mutaties"] = VoorraadMutatie.objects.met_relaties().filter(
+            ontvangst=self.object
+        )
+        context["met_archief"] = bool(self.request.GET.get("archief"))
+        if context["met_archief"]:
+            context["mutaties"] = sorted(
+                [
+                    *context["mutaties"],
+                    *VoorraadMutatieArchief.objects.met_relaties().filter(
+                        ontvangst=self.object
+                    ),
+                ],
+                key=lambda m: (m.datum, m.in_uit),
+            )
         context["error_message"] = None
         context["title"] = "Ontvangst"
         return context
@@ -940,16 +1155,17 @@ class OntvangstVoorraadView(LoginRequiredMixin, ListView):
     model = WijnVoorraad
     context_object_name = "voorraad_list"
     template_name = "WijnVoorraad/ontvangst_voorraad.html"
+    max_queries = 4
 
     def get_queryset(self):
         o = self.kwargs["ontvangst_id"]
-        voorraad_list = WijnVoorraad.objects.filter(ontvangst=o)
+        voorraad_list = WijnVoorraad.objects.met_relaties().filter(ontvangst=o)
         return voorraad_list
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         o = self.kwargs["ontvangst_id"]
-        context["ontvangst"] = Ontvangst.objects.get(pk=o)
+        context["ontvangst"] = Ontvangst.objects.met_relaties().get(pk=o)
         context["title"] = "Ontvangst voorraad"
         return context
 
@@ -977,27 +1193,28 @@ class OntvangstVoorraadView(LoginRequiredMixin, ListView):
             return super().get(request, *args, **kwargs)
 
 
-class WijnListView(LoginRequiredMixin, ListView):
+class WijnListView(LoginRequiredMixin, PaginatieMixin, ListView):
     model = Wijn
     template_name = "WijnVoorraad/wijn_list.html"
+    partial_template_name = "WijnVoorraad/wijn_list_regels.html"
     context_object_name = "wijn_list"
+    resultaat_lijst = "wijnlist"
+    max_queries = 10
 
     def get_queryset(self):
         wijnvars.set_filter_options(
             self.request, False, False, False, False, True, True, False
         )
-        wijn_list = Wijn.objects.all()
+        wijn_list = Wijn.objects.select_related("wijnsoort").order_by(
+            *Wijn._meta.ordering, "id"
+        )
         ws_id = wijnvars.get_session_wijnsoort_id(self.request)
         if ws_id:
             wijn_list = wijn_list.filter(wijnsoort__id=ws_id)
 
         fuzzy_selectie = wijnvars.get_session_fuzzy_selectie(self.request)
         if fuzzy_selectie:
-            wijnnw_list = []
-            for wijn in wijn_list:
-                if wijn.check_fuzzy_selectie(fuzzy_selectie):
-                    wijnnw_list.append(wijn)
-            wijn_list = wijnnw_list
+            wijn_list = wijn_list.fuzzy(fuzzy_selectie)
         return wijn_list
 
     def get_context_data(self, **kwargs):
@@ -1016,14 +1233,20 @@ class WijnListView(LoginRequiredMixin, ListView):
 
 class WijnDetailView(LoginRequiredMixin, DetailView):
     model = Wijn
+    queryset = Wijn.objects.select_related("wijnsoort").prefetch_related(
+        "wijnDruivensoorten"
+    )
     context_object_name = "wijn"
+    max_queries = 6
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["voorraad_aantal"] = WijnVoorraad.objects.filter(
             ontvangst__wijn=self.object
         ).aggregate(aantal=Sum("aantal"))
-        context["ontvangst_list"] = Ontvangst.objects.filter(wijn=self.object)
+        context["ontvangst_list"] = Ontvangst.objects.met_relaties().filter(
+            wijn=self.object
+        )
         context["title"] = "Wijn"
         return context
 
@@ -1061,7 +1284,11 @@ class WijnDetailView(LoginRequiredMixin, DetailView):
 
 class WijnSearchView(LoginRequiredMixin, DetailView):
     model = Wijn
+    queryset = Wijn.objects.select_related("wijnsoort").prefetch_related(
+        "wijnDruivensoorten"
+    )
     context_object_name = "wijn"
+    max_queries = 4
     template_name = "WijnVoorraad/wijn_detail.html"
 
     def get_context_data(self, **kwargs):
@@ -1320,24 +1547,25 @@ class BestellingCreateView(LoginRequiredMixin, CreateView):
 class BestellingDetailView(LoginRequiredMixin, DetailView):
     model = Bestelling
     context_object_name = "bestelling"
+    max_queries = 9
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        br = BestellingRegel.objects.filter(bestelling=self.object).order_by(
-            "ontvangst__wijn",
-            "ontvangst__datumOntvangst",
+        br = (
+            BestellingRegel.objects.met_relaties()
+            .filter(bestelling=self.object)
+            .order_by(
+                "ontvangst__wijn",
+                "ontvangst__datumOntvangst",
+            )
         )
-        vakken = Vak.objects.filter(locatie=self.object.vanLocatie)
-        if vakken:
-            loc_heeft_vakken = True
-        else:
-            loc_heeft_vakken = False
+        loc_heeft_vakken = Vak.objects.filter(locatie=self.object.vanLocatie).exists()
         context["loc_heeft_vakken"] = loc_heeft_vakken
         regels = []
         VerzameldeOnverwerkteRegels = False
         AllVerzameld = True
         AllVerwerkt = True
-        for regel in br:
+        for regel in br.met_voorraad():
             if regel.isVerzameld:
                 if regel.verwerkt == "N":
                     VerzameldeOnverwerkteRegels = True
@@ -1345,15 +1573,11 @@ class BestellingDetailView(LoginRequiredMixin, DetailView):
                     AllVerwerkt = False
             else:
                 AllVerzameld = False
-            try:
-                vrd = WijnVoorraad.objects.get(
-                    ontvangst=regel.ontvangst,
-                    locatie=regel.bestelling.vanLocatie,
-                    vak=regel.vak,
-                )
+            vrd = regel.voorraad
+            if vrd:
                 regel.aantal_vrd = vrd.aantal
                 regel.aantal_vrd_rsv = vrd.aantal_rsv
-            except WijnVoorraad.DoesNotExist:
+            else:
                 regel.aantal_vrd = 0
                 regel.aantal_vrd_rsv = 0
             regels.append(regel)
@@ -1429,12 +1653,13 @@ class BestellingListView(LoginRequiredMixin, ListView):
     model = Bestelling
     template_name = "WijnVoorraad/bestelling_list.html"
     context_object_name = "bestelling_list"
+    max_queries = 10
 
     def get_queryset(self):
         wijnvars.set_filter_options(
             self.request, True, True, True, True, False, False, False
         )
-        bestellingen = Bestelling.objects.all()
+        bestellingen = Bestelling.objects.met_totalen()
         d = wijnvars.get_session_deelnemer(self.request)
         l = wijnvars.get_session_locatie(self.request)
         if d:
@@ -1442,62 +1667,7 @@ class BestellingListView(LoginRequiredMixin, ListView):
         if l:
             bestellingen = bestellingen.filter(vanLocatie=l)
 
-        bestelling_list = []
-        for bestelling in bestellingen:
-            bestellingregels = BestellingRegel.objects.filter(
-                bestelling=bestelling,
-            ).aggregate(
-                tot_aantal=Sum(
-                    Case(
-                        When(
-                            aantal_correctie__isnull=False,
-                            then=F("aantal_correctie"),
-                        ),
-                        default=F("aantal"),
-                    )
-                ),
-            )
-
-            br_verzameld = BestellingRegel.objects.filter(
-                bestelling=bestelling,
-                verwerkt="N",
-                isVerzameld=True,
-            ).aggregate(
-                aantal_verzameld=Sum(
-                    Case(
-                        When(
-                            aantal_correctie__isnull=False,
-                            then=F("aantal_correctie"),
-                        ),
-                        default=F("aantal"),
-                    )
-                ),
-            )
-
-            br_verwerkt = (
-                BestellingRegel.objects.filter(
-                    bestelling=bestelling,
-                )
-                .exclude(verwerkt="N")
-                .aggregate(
-                    aantal_verwerkt=Sum(
-                        Case(
-                            When(
-                                aantal_correctie__isnull=False,
-                                then=F("aantal_correctie"),
-                            ),
-                            default=F("aantal"),
-                        )
-                    ),
-                )
-            )
-
-            bestelling.tot_aantal = bestellingregels["tot_aantal"] or 0
-            bestelling.aantal_verzameld = br_verzameld["aantal_verzameld"]
-            bestelling.aantal_verwerkt = br_verwerkt["aantal_verwerkt"]
-            bestelling_list.append(bestelling)
-
-        return bestelling_list
+        return bestellingen
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -1535,6 +1705,7 @@ class BestellingRegelsSelecteren(LoginRequiredMixin, ListView):
     template_name = "WijnVoorraad/bestellingregels_selecteren.html"
     context_object_name = "bestel_list"
     success_url = reverse_lazy("WijnVoorraad:voorraadlist")
+    max_queries = 12
 
     def get_queryset(self):
         wijnvars.set_filter_options(
@@ -1542,10 +1713,11 @@ class BestellingRegelsSelecteren(LoginRequiredMixin, ListView):
         )
         b_id = self.kwargs["bestelling_id"]
         b = Bestelling.objects.get(pk=b_id)
-        d = Deelnemer.objects.get(pk=b.deelnemer.id)
-        l = Locatie.objects.get(pk=b.vanLocatie.id)
-        voorraad_list = WijnVoorraad.objects.filter(deelnemer=d, locatie=l).order_by(
-            "wijn", "ontvangst__datumOntvangst"
+        voorraad_list = (
+            WijnVoorraad.objects.met_relaties()
+            .prefetch_related("wijn__wijnDruivensoorten")
+            .filter(deelnemer=b.deelnemer_id, locatie=b.vanLocatie_id)
+            .order_by("wijn", "ontvangst__datumOntvangst")
         )
 
         ws_id = wijnvars.get_session_wijnsoort_id(self.request)
@@ -1554,20 +1726,19 @@ class BestellingRegelsSelecteren(LoginRequiredMixin, ListView):
 
         fuzzy_selectie = wijnvars.get_session_fuzzy_selectie(self.request)
         if fuzzy_selectie:
-            vrdnw_list = []
-            for vrd in voorraad_list:
-                if vrd.check_fuzzy_selectie(fuzzy_selectie):
-                    vrdnw_list.append(vrd)
-            voorraad_list = vrdnw_list
+            voorraad_list = voorraad_list.fuzzy(fuzzy_selectie)
+        regels = BestellingRegel.objects.filter(bestelling=b).per_sleutel()
+        bestelbaar = self.request.GET.get("bestelbaar")
         bestel_list = []
         for vrd in voorraad_list:
-            try:
-                br = BestellingRegel.objects.get(
-                    bestelling=b, ontvangst=vrd.ontvangst, vak=vrd.vak
-                )
+            br = regels.get((vrd.ontvangst_id, vrd.vak_id))
+            # keep the stock this bestelling already reserves on
+            if bestelbaar and not br and vrd.aantal_beschikbaar <= 0:
+                continue
+            if br:
                 vrd.bestellingregel_id = br.id
                 vrd.aantal_bestellen = br.aantal
-            except BestellingRegel.DoesNotExist:
+            else:
                 vrd.bestellingregel_id = ""
                 vrd.aantal_bestellen = ""
             bestel_list.append(vrd)
@@ -1579,8 +1750,11 @@ class BestellingRegelsSelecteren(LoginRequiredMixin, ListView):
             context, self.request, "WijnVoorraad:bestellingregelsselecteren"
         )
         bestelling_id = self.kwargs["bestelling_id"]
-        bestelling = Bestelling.objects.get(pk=bestelling_id)
+        bestelling = Bestelling.objects.select_related("deelnemer", "vanLocatie").get(
+            pk=bestelling_id
+        )
         context["bestelling"] = bestelling
+        context["bestelbaar"] = bool(self.request.GET.get("bestelbaar"))
         context["title"] = "Bestelling selecteren"
         return context
 
@@ -1600,33 +1774,41 @@ class BestellingRegelsSelecteren(LoginRequiredMixin, ListView):
                 aantal_vrd_int = int(aantal_vrd)
             except ValueError:
                 aantal_vrd_int = 0
-            aantal_regels = 0
-            for i in range(1, aantal_vrd_int + 1):
-                v_id = request.POST["voorraad_id" + str(i)]
+            nummers = range(1, aantal_vrd_int + 1)
+            voorraden = WijnVoorraad.objects.in_bulk(
+                [request.POST["voorraad_id" + str(i)] for i in nummers]
+            )
+            aantallen = {}
+            vervallen = 0
+            for i in nummers:
+                voorraad = voorraden.get(int(request.POST["voorraad_id" + str(i)]))
                 v_aantal_bestellen = request.POST["aantal_bestellen" + str(i)]
-                br_id = request.POST.get("bestellingregel_id" + str(i))
-                if br_id:
-                    br = BestellingRegel.objects.get(pk=br_id)
+                if voorraad is None:
+                    # deleted (or booked off completely) since the page was shown
                     if v_aantal_bestellen:
-                        if br.aantal != int(v_aantal_bestellen):
-                            br.aantal = v_aantal_bestellen
-                            br.save()
-                            aantal_regels += 1
-                    else:
-                        br.delete()
-                        aantal_regels += 1
-                elif v_aantal_bestellen:
-                    voorraad = WijnVoorraad.objects.get(pk=v_id)
-                    v_nieuwe_bestelregel = BestellingRegel()
-                    v_nieuwe_bestelregel.bestelling = bestelling
-                    v_nieuwe_bestelregel.ontvangst = voorraad.ontvangst
-                    v_nieuwe_bestelregel.vak = voorraad.vak
-                    v_nieuwe_bestelregel.aantal = v_aantal_bestellen
-                    v_nieuwe_bestelregel.opmerking = ""
-                    v_nieuwe_bestelregel.save()
-                    aantal_regels += 1
-            messages.success(request, f"{aantal_regels} bestelregel(s) verwerkt")
-            url = reverse("WijnVoorraad:bestellingdetail", kwargs=dict(pk=b_id))
+                        vervallen += 1
+                    continue
+                aantallen[(voorraad.ontvangst_id, voorraad.vak_id)] = (
+                    int(v_aantal_bestellen) if v_aantal_bestellen else None
+                )
+            try:
+                if vervallen:
+                    raise ValidationError(
+                        "Een deel van de geselecteerde voorraad is er niet meer. "
+                        "Controleer de selectie en sla opnieuw op."
+                    )
+                aantal_regels = WijnVoorraadService.BestellingRegelsReserveren(
+                    bestelling, aantallen
+                )
+            except ValidationError as e:
+                messages.error(request, e.message)
+                url = reverse(
+                    "WijnVoorraad:bestellingregelsselecteren",
+                    kwargs=dict(bestelling_id=b_id),
+                )
+            else:
+                messages.success(request, f"{aantal_regels} bestelregel(s) verwerkt")
+                url = reverse("WijnVoorraad:bestellingdetail", kwargs=dict(pk=b_id))
         return HttpResponseRedirect(url)
 
 
@@ -1652,71 +1834,17 @@ class BestellingenVerzamelen(LoginRequiredMixin, ListView):
     template_name = "WijnVoorraad/bestellingen_verzamelen.html"
     context_object_name = "bestelling_list"
     success_url = reverse_lazy("WijnVoorraad:voorraadlist")
+    max_queries = 15
 
     def get_queryset(self):
         wijnvars.set_filter_options(
             self.request, False, True, True, False, False, False, False
         )
         l = wijnvars.get_session_locatie(self.request)
-        bestellingen = Bestelling.objects.filter(
+        bestellingen = Bestelling.objects.met_totalen().filter(
             vanLocatie=l, datumAfgesloten__isnull=True
         )
-        bestelling_list = []
-        for bestelling in bestellingen:
-            bestellingregels = BestellingRegel.objects.filter(
-                bestelling=bestelling,
-            ).aggregate(
-                tot_aantal=Sum(
-                    Case(
-                        When(
-                            aantal_correctie__isnull=False,
-                            then=F("aantal_correctie"),
-                        ),
-                        default=F("aantal"),
-                    )
-                ),
-            )
-
-            br_verzameld = BestellingRegel.objects.filter(
-                bestelling=bestelling,
-                verwerkt="N",
-                isVerzameld=True,
-            ).aggregate(
-                aantal_verzameld=Sum(
-                    Case(
-                        When(
-                            aantal_correctie__isnull=False,
-                            then=F("aantal_correctie"),
-                        ),
-                        default=F("aantal"),
-                    )
-                ),
-            )
-
-            br_verwerkt = (
-                BestellingRegel.objects.filter(
-                    bestelling=bestelling,
-                )
-                .exclude(verwerkt="N")
-                .aggregate(
-                    aantal_verwerkt=Sum(
-                        Case(
-                            When(
-                                aantal_correctie__isnull=False,
-                                then=F("aantal_correctie"),
-                            ),
-                            default=F("aantal"),
-                        )
-                    ),
-                )
-            )
-
-            bestelling.tot_aantal = bestellingregels["tot_aantal"] or 0
-            bestelling.aantal_verzameld = br_verzameld["aantal_verzameld"]
-            bestelling.aantal_verwerkt = br_verwerkt["aantal_verwerkt"]
-            bestelling_list.append(bestelling)
-
-        return bestelling_list
+        return bestellingen
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -1725,31 +1853,22 @@ class BestellingenVerzamelen(LoginRequiredMixin, ListView):
         )
         wijnvars.set_context_locatie_list(context)
         l = wijnvars.get_session_locatie(self.request)
-        vakken = Vak.objects.filter(locatie=l)
-        if vakken:
-            loc_heeft_vakken = True
-        else:
-            loc_heeft_vakken = False
+        loc_heeft_vakken = Vak.objects.filter(locatie=l).exists()
         context["locatie"] = l
         context["loc_heeft_vakken"] = loc_heeft_vakken
-        br = BestellingRegel.objects.filter(
-            bestelling__vanLocatie=l, bestelling__datumAfgesloten__isnull=True
-        ).order_by(
-            "ontvangst__wijn",
-            "ontvangst__datumOntvangst",
+        br = (
+            BestellingRegel.objects.met_relaties()
+            .filter(bestelling__vanLocatie=l, bestelling__datumAfgesloten__isnull=True)
+            .order_by(
+                "ontvangst__wijn",
+                "ontvangst__datumOntvangst",
+            )
         )
 
         bestelregel_list = []
-        for regel in br:
-            try:
-                vrd = WijnVoorraad.objects.get(
-                    ontvangst=regel.ontvangst,
-                    locatie=regel.bestelling.vanLocatie,
-                    vak=regel.vak,
-                )
-                regel.aantal_vrd = vrd.aantal
-            except WijnVoorraad.DoesNotExist:
-                regel.aantal_vrd = 0
+        for regel in br.met_voorraad():
+            vrd = regel.voorraad
+            regel.aantal_vrd = vrd.aantal if vrd else 0
             bestelregel_list.append(regel)
 
         br_aggr = br.aggregate(
@@ -1807,34 +1926,26 @@ class BestellingVerzamelenDetail(LoginRequiredMixin, DetailView):
     template_name = "WijnVoorraad/bestelling_verzamelen_detail.html"
     context_object_name = "bestelling"
     success_url = reverse_lazy("WijnVoorraad:bestellingenverzamelen")
+    max_queries = 13
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         l = wijnvars.get_session_locatie(self.request)
-        vakken = Vak.objects.filter(locatie=l)
-        if vakken:
-            loc_heeft_vakken = True
-        else:
-            loc_heeft_vakken = False
-
-        br = BestellingRegel.objects.filter(
-            bestelling=self.object,
-        ).order_by(
-            "ontvangst__wijn",
-            "ontvangst__datumOntvangst",
+        loc_heeft_vakken = Vak.objects.filter(locatie=l).exists()
+
+        br = (
+            BestellingRegel.objects.met_relaties()
+            .filter(bestelling=self.object)
+            .order_by(
+                "ontvangst__wijn",
+                "ontvangst__datumOntvangst",
+            )
         )
 
         bestelregel_list = []
-        for regel in br:
-            try:
-                vrd = WijnVoorraad.objects.get(
-                    ontvangst=regel.ontvangst,
-                    locatie=regel.bestelling.vanLocatie,
-                    vak=regel.vak,
-                )
-                regel.aantal_vrd = vrd.aantal
-            except WijnVoorraad.DoesNotExist:
-                regel.aantal_vrd = 0
+        for regel in br.met_voorraad():
+            vrd = regel.voorraad
+            regel.aantal_vrd = vrd.aantal if vrd else 0
             bestelregel_list.append(regel)
 
         br_aggr = br.aggregate(
@@ -1886,17 +1997,17 @@ class BestellingVerzamelenDetail(LoginRequiredMixin, DetailView):
 
 class BestellingRegelVerplaatsen(LoginRequiredMixin, DetailView):
     model = BestellingRegel
+    queryset = BestellingRegel.objects.met_relaties()
     template_name = "WijnVoorraad/bestellingregel_verplaatsen.html"
     success_url = reverse_lazy("WijnVoorraad:voorraadlist")
+    max_queries = 4
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         regel = self.object
-        wijn = Wijn.objects.get(pk=regel.ontvangst.wijn.id)
-        locatie = Locatie.objects.get(pk=regel.bestelling.vanLocatie.id)
-        vak = None
-        if regel.vak:
-            vak = Vak.objects.get(pk=regel.vak.id)
+        wijn = regel.ontvangst.wijn
+        locatie = regel.bestelling.vanLocatie
+        vak = regel.vak
         context["bestellingregel"] = regel
         context["wijn"] = wijn
         context["locatie"] = locatie
@@ -1933,13 +2044,17 @@ class BestellingRegelVerplaatsen(LoginRequiredMixin, DetailView):
                 if v_nieuwe_locatie != regel.bestelling.vanLocatie:
                     # Alsnog direct verplaatsen op de nieuwe locatie
                     v_nieuwe_vak = None
-                    regel.verplaatsen(
-                        v_nieuwe_locatie, v_nieuwe_vak, v_aantal_verplaatsen
-                    )
-                    messages.success(
-                        request,
-                        f"Bestelregel {regel.ontvangst.wijn.volle_naam} verplaatst",
-                    )
+                    try:
+                        regel.verplaatsen(
+                            v_nieuwe_locatie, v_nieuwe_vak, v_aantal_verplaatsen
+                        )
+                    except ValidationError as e:
+                        messages.error(request, e.message)
+                    else:
+                        messages.success(
+                            request,
+                            f"Bestelregel {regel.ontvangst.wijn.volle_naam} verplaatst",
+                        )
                 url = reverse(
                     "WijnVoorraad:bestellingdetail", kwargs=dict(pk=regel.bestelling.id)
                 )
@@ -1963,11 +2078,17 @@ class BestellingRegelVerplaatsen(LoginRequiredMixin, DetailView):
                 # Verplaatsen naar de nieuwe locatie zonder vak te kiezen
                 #
                 v_nieuwe_vak = None
-                regel.verplaatsen(v_nieuwe_locatie, v_nieuwe_vak, v_aantal_verplaatsen)
-                messages.success(
-                    request,
-                    f"Bestelregel {regel.ontvangst.wijn.volle_naam} verplaatst",
-                )
+                try:
+                    regel.verplaatsen(
+                        v_nieuwe_locatie, v_nieuwe_vak, v_aantal_verplaatsen
+                    )
+                except ValidationError as e:
+                    messages.error(request, e.message)
+                else:
+                    messages.success(
+                        request,
+                        f"Bestelregel {regel.ontvangst.wijn.volle_naam} verplaatst",
+                    )
             else:
                 # Geen nieuwe locatie en geen vak: niets te verplaatsen
                 pass
@@ -1981,12 +2102,13 @@ class BestellingregelVerplaatsInVakken(LoginRequiredMixin, ListView):
     model = Vak
     template_name = "WijnVoorraad/bestellingregel_verplaatsinvakken.html"
     success_url = reverse_lazy("WijnVoorraad:voorraadlist")
+    max_queries = 6
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         br_id = self.kwargs["bestellingregel_id"]
-        regel = BestellingRegel.objects.get(pk=br_id)
-        wijn = Wijn.objects.get(pk=regel.ontvangst.wijn.id)
+        regel = BestellingRegel.objects.met_relaties().get(pk=br_id)
+        wijn = regel.ontvangst.wijn
         v_nieuwe_locatie_id = self.kwargs["nieuwe_locatie_id"]
         vakken_list = (
             Vak.objects.filter(locatie=v_nieuwe_locatie_id)
@@ -2012,31 +2134,21 @@ class BestellingregelVerplaatsInVakken(LoginRequiredMixin, ListView):
 
     def post(self, request, *args, **kwargs):
         br_id = self.request.POST["bestellingregel_id"]
-        regel = BestellingRegel.objects.get(pk=br_id)
-        aantal_vakken = self.request.POST["aantal_vakken"]
+        regel = BestellingRegel.objects.met_relaties().get(pk=br_id)
+        bestemmingen = [
+            (v_nieuwe_vak.locatie, v_nieuwe_vak, v_aantal_verplaatsen)
+            for v_nieuwe_vak, v_aantal_verplaatsen in gekozen_vakken(self.request.POST)
+        ]
         try:
-            aantal_vakken_int = int(aantal_vakken)
-        except ValueError:
-            aantal_vakken_int = 0
-        for i in range(1, aantal_vakken_int + 1):
-            v_nieuw_vak_id = self.request.POST["nieuw_vak_id" + str(i)]
-            v_aantal_verplaatsen = self.request.POST["aantal_verplaatsen" + str(i)]
-            if v_aantal_verplaatsen:
-                v_nieuwe_vak = Vak.objects.get(pk=v_nieuw_vak_id)
-                v_nieuwe_locatie = v_nieuwe_vak.locatie
-                # bijwerken van de verwerktstatus van de regel
-                # pas als alle verplaatsingen klaar zijn
-                bijwerken = False
-                regel.verplaatsen(
-                    v_nieuwe_locatie, v_nieuwe_vak, v_aantal_verplaatsen, bijwerken
-                )
-        regel.verwerkt = "V"
-        regel.save()
-
-        messages.success(
-            request,
-            f"Bestellingregel {regel.ontvangst.wijn.volle_naam} verplaatst",
-        )
+            # de regel wordt pas verwerkt als alle verplaatsingen gelukt zijn
+            regel.verplaatsen_naar_vakken(bestemmingen)
+        except ValidationError as e:
+            messages.error(request, e.message)
+        else:
+            messages.success(
+                request,
+                f"Bestellingregel {regel.ontvangst.wijn.volle_naam} verplaatst",
+            )
         url = reverse(
             "WijnVoorraad:bestellingdetail", kwargs=dict(pk=regel.bestelling.id)
         )
@@ -2049,6 +2161,7 @@ class VoorraadControleren(AdminUserMixin, ListView):
     template_name = "WijnVoorraad/voorraad_controleren.html"
     success_url = reverse_lazy("WijnVoorraad:voorraadlist")
     raise_exception = True
+    max_queries = 10
 
     def get_queryset(self):
         locatie_list = WijnVoorraadService.ControleerAlleLocaties()
@@ -2056,7 +2169,10 @@ class VoorraadControleren(AdminUserMixin, ListView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        ontvangst_list = WijnVoorraadService.ControleerAlleOntvangsten()
+        context["met_archief"] = bool(self.request.GET.get("archief"))
+        ontvangst_list = WijnVoorraadService.ControleerAlleOntvangsten(
+            met_archief=context["met_archief"]
+        )
         context["ontvangst_list"] = ontvangst_list
         context["title"] = "Voorraad controleren"
         return context
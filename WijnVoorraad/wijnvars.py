@@ -12,6 +12,38 @@ class SorteringEnum(models.TextChoices):
     WIJNONTVANGST = "WO", _("Wijn + Ontvangstdatum (default)")
     ONTVANGSTWIJN = "OW", _("Ontvangstdatum oplopend + Wijn")
     ONTVANGSTDESCWIJN = "ODW", _("Ontvangstdatum aflopend + Wijn")
+    JAARWIJN = "JW", _("Jaar + Wijn")
+    PRIJSWIJN = "PW", _("Prijs aflopend + Wijn")
+    WIJNSOORTWIJN = "SW", _("Wijnsoort + Wijn")
+    BESCHIKBAARWIJN = "BW", _("Beschikbaar aflopend + Wijn")
+
+
+# Volgorde van de voorraadlijst per sortering, "wijn" volgt de ordering van Wijn
+VOORRAAD_VOLGORDE = {
+    SorteringEnum.WIJNONTVANGST: ("wijn", "ontvangst__datumOntvangst"),
+    SorteringEnum.ONTVANGSTWIJN: ("ontvangst__datumOntvangst", "wijn"),
+    SorteringEnum.ONTVANGSTDESCWIJN: ("-ontvangst__datumOntvangst", "wijn"),
+    SorteringEnum.JAARWIJN: (
+        models.F("wijn__jaar").asc(nulls_last=True),
+        "wijn",
+        "ontvangst__datumOntvangst",
+    ),
+    SorteringEnum.PRIJSWIJN: (
+        models.F("ontvangst__prijs").desc(nulls_last=True),
+        "wijn",
+        "ontvangst__datumOntvangst",
+    ),
+    SorteringEnum.WIJNSOORTWIJN: (
+        "wijn__wijnsoort__omschrijving",
+        "wijn",
+        "ontvangst__datumOntvangst",
+    ),
+    SorteringEnum.BESCHIKBAARWIJN: (
+        "-aantal_beschikbaar",
+        "wijn",
+        "ontvangst__datumOntvangst",
+    ),
+}
 
 
 def unified_wijnsoort(wijnsoort_omschrijving):
@@ -167,6 +199,26 @@ def get_session_sortering(request):
     return sortering
 
 
+def get_voorraad_volgorde(request):
+    return VOORRAAD_VOLGORDE.get(
+        get_session_sortering(request),
+        VOORRAAD_VOLGORDE[SorteringEnum.WIJNONTVANGST],
+    )
+
+
+def get_filter_status(request):
+    """Normalised filter state of the list views, used as key for cached results."""
+    # the fuzzy selection is case insensitive, other normalisations would change the result
+    fuzzy_selectie = get_session_fuzzy_selectie(request) or ""
+    return {
+        "deelnemer_id": get_session_deelnemer_id(request),
+        "locatie_id": get_session_locatie_id(request),
+        "wijnsoort_id": get_session_wijnsoort_id(request),
+        "fuzzy_selectie": fuzzy_selectie.lower(),
+        "sortering": get_session_sortering(request),
+    }
+
+
 def set_session_return_url(request, return_url):
     request.session["return_url"] = return_url
     return request
@@ -0,0 +1,319 @@
+"""Full-text search index (SQLite FTS5) used for the fuzzy selection in the list views.
+
+Every Wijn, Ontvangst and VoorraadMutatie has one row in its own FTS5 table, with the
+rowid equal to the primary key of the object. The trigram tokenizer supports substring
+searches, so a MATCH on the index finds the objects whose text contains the term,
+without loading the rows into Python. The text is that of wijn_tekst, ontvangst_tekst
+and mutatie_tekst: lower case without accents (see normaliseer); for wijnen and
+ontvangsten it is also stored in the search_blob column, used when there is no index.
+
+A second table for wines (WIJN_AUTOCOMPLETE_TABEL) holds accent-folded text in separate
+columns and is used for the ranked, typo tolerant lookup of the wine autocomplete.
+
+The index is kept up to date by the save() and delete() methods of the models.
+Run the management command ``zoekindex_opbouwen`` to rebuild it from scratch.
+"""
+
+import unicodedata
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+WIJN_TABEL = "WijnVoorraad_zoekindex_wijn"
+ONTVANGST_TABEL = "WijnVoorraad_zoekindex_ontvangst"
+MUTATIE_TABEL = "WijnVoorraad_zoekindex_mutatie"
+WIJN_AUTOCOMPLETE_TABEL = "WijnVoorraad_zoekindex_wijn_autocomplete"
+TABELLEN = (WIJN_TABEL, ONTVANGST_TABEL, MUTATIE_TABEL, WIJN_AUTOCOMPLETE_TABEL)
+
+# The trigram tokenizer can only use the index for terms of at least 3 characters
+MIN_LENGTE_MATCH = 3
+
+# Fields of Wijn that are part of the fuzzy selection (next to wijnsoort and druivensoorten)
+WIJN_VELDEN = ("naam", "domein", "jaar", "land", "streek", "classificatie", "opmerking")
+ONTVANGST_VELDEN = ("leverancier", "opmerking")
+MUTATIE_VELDEN = ("omschrijving",)
+
+# bm25 weights of the autocomplete columns: naam, domein, jaar, wijnsoort, overig
+AUTOCOMPLETE_GEWICHTEN = (10.0, 8.0, 5.0, 4.0, 1.0)
+AUTOCOMPLETE_LIMIET = 100
+
+
+def index_beschikbaar():
+    """The index tables are only created on SQLite (see migration 0078)."""
+    return connection.vendor == "sqlite"
+
+
+def _tekst(*delen):
+    # A newline as separator prevents a search term from matching across two fields
+    return "\n".join(str(deel) for deel in delen if deel not in (None, ""))
+
+
+def normaliseer(tekst):
+    """Lower case text without accents, "Château" becomes "chateau"."""
+    tekst = unicodedata.normalize("NFKD", str(tekst or ""))
+    return "".join(c for c in tekst if not unicodedata.combining(c)).lower()
+
+
+def wijn_tekst(wijn):
+    """Normalised search text of a wine, stored in Wijn.search_blob."""
+    # the druivensoorten of a new wine are added after the first save
+    if wijn.pk is None:
+        druivensoorten = []
+    else:
+        druivensoorten = [d.omschrijving for d in wijn.wijnDruivensoorten.all()]
+    return normaliseer(
+        _tekst(
+            *(getattr(wijn, veld) for veld in WIJN_VELDEN),
+            wijn.wijnsoort.omschrijving,
+            *druivensoorten,
+        )
+    )
+
+
+def ontvangst_tekst(ontvangst):
+    """Normalised search text of an ontvangst, stored in Ontvangst.search_blob."""
+    return normaliseer(_tekst(*(getattr(ontvangst, veld) for veld in ONTVANGST_VELDEN)))
+
+
+def mutatie_tekst(mutatie):
+    return normaliseer(_tekst(*(getattr(mutatie, veld) for veld in MUTATIE_VELDEN)))
+
+
+def _bijwerken(tabel, object_id, tekst):
+    if not index_beschikbaar():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM "{tabel}" WHERE rowid = %s', [object_id])
+        cursor.execute(
+            f'INSERT INTO "{tabel}" (rowid, tekst) VALUES (%s, %s)', [object_id, tekst]
+        )
+
+
+def wijn_autocomplete_kolommen(wijn):
+    return (
+        normaliseer(wijn.naam),
+        normaliseer(wijn.domein),
+        normaliseer(wijn.jaar),
+        normaliseer(wijn.wijnsoort.omschrijving),
+        normaliseer(_tekst(wijn.land, wijn.streek, wijn.classificatie)),
+    )
+
+
+def _autocomplete_bijwerken(wijn):
+    if not index_beschikbaar():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM "{WIJN_AUTOCOMPLETE_TABEL}" WHERE rowid = %s', [wijn.pk]
+        )
+        cursor.execute(
+            f'INSERT INTO "{WIJN_AUTOCOMPLETE_TABEL}" '
+            "(rowid, naam, domein, jaar, wijnsoort, overig) "
+            "VALUES (%s, %s, %s, %s, %s, %s)",
+            [wijn.pk, *wijn_autocomplete_kolommen(wijn)],
+        )
+
+
+def _verwijderen(tabel, object_id):
+    if not index_beschikbaar():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM "{tabel}" WHERE rowid = %s', [object_id])
+
+
+def wijn_bijwerken(wijn):
+    _bijwerken(WIJN_TABEL, wijn.pk, wijn.search_blob)
+    _autocomplete_bijwerken(wijn)
+
+
+def wijnen_bijwerken(wijnen):
+    for wijn in wijnen.select_related("wijnsoort").prefetch_related(
+        "wijnDruivensoorten"
+    ):
+        wijn.search_blob_bijwerken()
+
+
+def wijn_verwijderen(wijn_id):
+    _verwijderen(WIJN_TABEL, wijn_id)
+    _verwijderen(WIJN_AUTOCOMPLETE_TABEL, wijn_id)
+
+
+def ontvangst_bijwerken(ontvangst):
+    _bijwerken(ONTVANGST_TABEL, ontvangst.pk, ontvangst.search_blob)
+
+
+def ontvangst_verwijderen(ontvangst_id):
+    _verwijderen(ONTVANGST_TABEL, ontvangst_id)
+
+
+def mutatie_bijwerken(mutatie):
+    _bijwerken(MUTATIE_TABEL, mutatie.pk, mutatie_tekst(mutatie))
+
+
+def mutaties_toevoegen(mutaties):
+    """Add new mutations (see VoorraadMutatie.bulk_boeken) with one statement."""
+    if not index_beschikbaar():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO "{MUTATIE_TABEL}" (rowid, tekst) VALUES (%s, %s)',
+            [(mutatie.pk, mutatie_tekst(mutatie)) for mutatie in mutaties],
+        )
+
+
+def mutatie_verwijderen(mutatie_id):
+    _verwijderen(MUTATIE_TABEL, mutatie_id)
+
+
+def mutaties_verwijderen(mutatie_ids):
+    """Remove many mutations (see WijnVoorraadService.MutatiesArchiveren) at once."""
+    if not index_beschikbaar():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'DELETE FROM "{MUTATIE_TABEL}" WHERE rowid = %s',
+            [(mutatie_id,) for mutatie_id in mutatie_ids],
+        )
+
+
+def opbouwen():
+    """Rebuild all index tables from the current content of the database.
+
+    The search_blob columns are used as they are, the management command
+    search_blob_vullen recalculates them first.
+    """
+    # pylint: disable=import-outside-toplevel
+    from .models import Ontvangst, VoorraadMutatie, Wijn
+
+    bronnen = (
+        (
+            WIJN_TABEL,
+            Wijn.objects.all(),
+            lambda wijn: wijn.search_blob,
+        ),
+        (ONTVANGST_TABEL, Ontvangst.objects.all(), lambda o: o.search_blob),
+        (MUTATIE_TABEL, VoorraadMutatie.objects.all(), mutatie_tekst),
+    )
+    aantallen = {}
+    with connection.cursor() as cursor:
+        for tabel, queryset, tekst in bronnen:
+            cursor.execute(f'DELETE FROM "{tabel}"')
+            rijen = [(obj.pk, tekst(obj)) for obj in queryset.order_by().iterator(2000)]
+            cursor.executemany(
+                f'INSERT INTO "{tabel}" (rowid, tekst) VALUES (%s, %s)', rijen
+            )
+            aantallen[tabel] = len(rijen)
+
+        cursor.execute(f'DELETE FROM "{WIJN_AUTOCOMPLETE_TABEL}"')
+        rijen = [
+            (wijn.pk, *wijn_autocomplete_kolommen(wijn))
+            for wijn in Wijn.objects.select_related("wijnsoort").order_by().iterator(2000)
+        ]
+        cursor.executemany(
+            f'INSERT INTO "{WIJN_AUTOCOMPLETE_TABEL}" '
+            "(rowid, naam, domein, jaar, wijnsoort, overig) "
+            "VALUES (%s, %s, %s, %s, %s, %s)",
+            rijen,
+        )
+        aantallen[WIJN_AUTOCOMPLETE_TABEL] = len(rijen)
+    return aantallen
+
+
+def _zoek_ids(tabel, term):
+    """Lazy subquery with the ids of the objects in tabel that contain term."""
+    term = normaliseer(term)
+    if len(term) >= MIN_LENGTE_MATCH:
+        # search for the term as one phrase, quotes are escaped by doubling them
+        return RawSQL(
+            f'SELECT rowid FROM "{tabel}" WHERE tekst MATCH %s',
+            ['"' + term.replace('"', '""') + '"'],
+        )
+    # Short terms: no index support, but still a single query on the index table
+    term = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return RawSQL(
+        f"SELECT rowid FROM \"{tabel}\" WHERE tekst LIKE %s ESCAPE '\\'",
+        [f"%{term}%"],
+    )
+
+
+def wijn_q(term, prefix=""):
+    """Q object selecting the wines (via prefix) that match term."""
+    if index_beschikbaar():
+        return Q(**{f"{prefix}id__in": _zoek_ids(WIJN_TABEL, term)})
+    return Q(**{f"{prefix}search_blob__contains": normaliseer(term)})
+
+
+def ontvangst_q(term, prefix=""):
+    """Q object selecting the ontvangsten that match term, on their own fields or the wine."""
+    if index_beschikbaar():
+        eigen_q = Q(**{f"{prefix}id__in": _zoek_ids(ONTVANGST_TABEL, term)})
+    else:
+        eigen_q = Q(**{f"{prefix}search_blob__contains": normaliseer(term)})
+    return eigen_q | wijn_q(term, f"{prefix}wijn__")
+
+
+def omschrijvingen(queryset, term):
+    """The descriptions in queryset (mutations or archived mutations) that contain
+    term after normalising.
+
+    There is no normalised column for descriptions, so the distinct descriptions
+    (few: most mutations have a standard text) are checked in Python.
+    """
+    term = normaliseer(term)
+    return [
+        omschrijving
+        for omschrijving in queryset.order_by()
+        .values_list("omschrijving", flat=True)
+        .distinct()
+        if term in normaliseer(omschrijving)
+    ]
+
+
+def mutatie_q(term):
+    if index_beschikbaar():
+        eigen_q = Q(id__in=_zoek_ids(MUTATIE_TABEL, term))
+    else:
+        # pylint: disable=import-outside-toplevel
+        from .models import VoorraadMutatie
+
+        eigen_q = Q(omschrijving__in=omschrijvingen(VoorraadMutatie.objects, term))
+    return eigen_q | ontvangst_q(term, "ontvangst__")
+
+
+def voorraad_q(term):
+    return wijn_q(term, "wijn__") | ontvangst_q(term, "ontvangst__")
+
+
+def _trigrammen(term):
+    trigrammen = []
+    for woord in normaliseer(term).split():
+        for i in range(len(woord) - MIN_LENGTE_MATCH + 1):
+            trigram = woord[i : i + MIN_LENGTE_MATCH]
+            if trigram not in trigrammen:
+                trigrammen.append(trigram)
+    return trigrammen
+
+
+def zoek_wijnen(term, limiet=AUTOCOMPLETE_LIMIET):
+    """Ids of the wines that best match term, the best match first.
+
+    The term is split in trigrams and a wine matches when it shares at least one of
+    them, so misspelled words are still found. bm25 ranks the wines that share more
+    (and rarer) trigrams higher, with the weights of AUTOCOMPLETE_GEWICHTEN per column.
+    Returns None when the index can not be used (no SQLite, or only words shorter
+    than 3 characters); the caller should fall back to a normal search then.
+    """
+    trigrammen = _trigrammen(term)
+    if not trigrammen or not index_beschikbaar():
+        return None
+    match = " OR ".join('"' + t.replace('"', '""') + '"' for t in trigrammen)
+    gewichten = ", ".join(str(g) for g in AUTOCOMPLETE_GEWICHTEN)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM "{WIJN_AUTOCOMPLETE_TABEL}" '
+            f'WHERE "{WIJN_AUTOCOMPLETE_TABEL}" MATCH %s '
+            f'ORDER BY bm25("{WIJN_AUTOCOMPLETE_TABEL}", {gewichten}) LIMIT %s',
+            [match, limiet],
+        )
+        return [rij[0] for rij in cursor.fetchall()]